@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+from tk_dispatch import TkDispatcher
+
+API_URL = os.environ.get("FINGERPRINT_API_URL", "http://localhost:3000")
+# (connect, read) timeouts in seconds.
+TIMEOUT = (3.05, 30)
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUSES = (502, 503, 504)
+POOL_SIZE = 4
+TIMING_HISTORY = 200
+
+class APIClient(TkDispatcher):
+    """Client for the fingerprint API (main.js) with one keep-alive connection pool.
+
+    Every request goes through a shared requests.Session with timeouts and
+    retries with exponential backoff. Connection failures are retried for
+    every method; read errors and 502/503/504 replies are only retried for
+    idempotent methods, so an enrollment POST is never sent twice.
+
+    Calls are available three ways: blocking (signin() etc.), as coroutines
+    (signin_async() etc., run on the client's thread pool), and through
+    submit(), whose callbacks run on the Tk thread once attach() has been
+    called. Each request's duration is kept in timings.
+    """
+
+    def __init__(self, base_url=API_URL, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.timings = deque(maxlen=TIMING_HISTORY)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix="api-client")
+
+    @property
+    def session(self):
+        # requests is imported on first use so the GUI starts without it.
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=RETRY_STATUSES, raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def request(self, method, path, route=None, **kwargs):
+        """Send one request and return the requests.Response.
+
+        route names the endpoint in the traces when path holds an id.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings.append({"method": method, "path": path, "status": status, "seconds": seconds})
+            instrumentation.record(f"api.{method} {route or path}", start, seconds, status=status)
+
+    def signin(self, username, password, fingerprint_hash=None):
+        data = {'username': username, 'password': password}
+        if fingerprint_hash is not None:
+            data['fingerprint_hash'] = fingerprint_hash
+        return self.request("POST", "/api/signin", json=data)
+
+    def logout(self):
+        return self.request("POST", "/api/logout")
+
+    def insert_fingerprint(self, fields, fingerprint_image, filename, template=None):
+        """Upload an enrollment; fingerprint_image is the encoded image bytes and template optional Template bytes."""
+        files = {'fingerprint_image': (filename, fingerprint_image, 'image/png')}
+        if template is not None:
+            files['fingerprint_template'] = (f"{os.path.splitext(filename)[0]}.tpl", template, 'application/octet-stream')
+        return self.request("POST", "/api/fingerprint/insert", data=fields, files=files)
+
+    def delete_fingerprint(self, pilotid):
+        return self.request("DELETE", f"/api/fingerprint/delete/{pilotid}", route="/api/fingerprint/delete")
+
+    async def call_async(self, function, *args, **kwargs):
+        """Run a blocking client call on the client's thread pool from asyncio code."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def signin_async(self, username, password, fingerprint_hash=None):
+        return await self.call_async(self.signin, username, password, fingerprint_hash)
+
+    async def logout_async(self):
+        return await self.call_async(self.logout)
+
+    async def insert_fingerprint_async(self, fields, fingerprint_image, filename, template=None):
+        return await self.call_async(self.insert_fingerprint, fields, fingerprint_image, filename, template)
+
+    async def delete_fingerprint_async(self, pilotid):
+        return await self.call_async(self.delete_fingerprint, pilotid)
+
+    def submit(self, function, *args, on_done=None, on_error=None):
+        """Run function(*args) on the thread pool; the callbacks receive its result or exception.
+
+        The callbacks run on the thread that calls dispatch(), normally the
+        Tk thread after attach().
+        """
+        future = self._executor.submit(function, *args)
+
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                self._post(on_error, error)
+            else:
+                self._post(on_done, future.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def timing_summary(self):
+        """Count, mean and worst duration in milliseconds per endpoint over the recent requests."""
+        summary = {}
+        for timing in list(self.timings):
+            entry = summary.setdefault(f"{timing['method']} {timing['path']}", [])
+            entry.append(timing["seconds"] * 1000)
+        return {endpoint: {"count": len(values), "mean_ms": sum(values) / len(values), "max_ms": max(values)}
+                for endpoint, values in summary.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
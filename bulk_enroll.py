@@ -0,0 +1,231 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from template_store import TemplateStore, ORB_NFEATURES, decode_image, encode_image
+from api_client import APIClient, API_URL
+from capture_quality import assess_quality
+
+UPLOAD_CONCURRENCY = 4
+# Records featurized per pool round, per worker; bounds the prepared images held at once.
+PREPARE_WINDOW = 4
+FINAL_STATUSES = ("enrolled", "duplicate", "invalid")
+REPORT_FIELDS = ["line", "username", "pilotid", "image", "status", "detail", "quality", "keypoints", "upload_ms"]
+
+def read_manifest(manifest_path, images_dir=None):
+    """Read the CSV manifest into records.
+
+    Columns: username, password (optional), droneid, pilotid, address and
+    image (optional). A relative image path is resolved against images_dir,
+    or the manifest's folder; without an image column <username>.png is used.
+    """
+    images_dir = images_dir or os.path.dirname(os.path.abspath(manifest_path))
+    records = []
+    with open(manifest_path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            row = {name.strip(): (value or "").strip() for name, value in row.items() if name}
+            image = row.get("image") or f"{row.get('username', '')}.png"
+            records.append({
+                "line": line,
+                "key": row.get("pilotid") or f"line {line}",
+                "username": row.get("username", ""),
+                "password": row.get("password", ""),
+                "droneid": row.get("droneid", ""),
+                "pilotid": row.get("pilotid", ""),
+                "address": row.get("address", ""),
+                "image": os.path.join(images_dir, image),
+            })
+    return records
+
+def load_checkpoint(checkpoint_path):
+    """Latest outcome per record key from a checkpoint file."""
+    done = {}
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                done[result["key"]] = result
+    return done
+
+# Per-process state of the featurization pool.
+_worker_store = None
+
+def _init_worker(store_directory, nfeatures, preprocessing):
+    global _worker_store
+    _worker_store = TemplateStore(directory=store_directory, nfeatures=nfeatures, preprocessing=preprocessing)
+
+def _prepare(record):
+    """Validate one record and featurize its image. Returns (record, png bytes or None).
+
+    Any unexpected error fails only this record (retried on a rerun), never the whole import.
+    """
+    record = dict(record, status=None, detail="", quality=None, keypoints=None)
+    try:
+        return _featurize(record)
+    except Exception as e:
+        record.update(status="failed", detail=f"preparing failed: {type(e).__name__}: {e}")
+        return record, None
+
+def _featurize(record):
+    try:
+        if not record["username"]:
+            raise ValueError("username is empty")
+        int(record["droneid"])
+        int(record["pilotid"])
+    except ValueError as e:
+        record.update(status="invalid", detail=f"bad field: {e}")
+        return record, None
+    try:
+        with open(record["image"], "rb") as f:
+            data = f.read()
+    except OSError as e:
+        # Not final: the image may still be copied in before a rerun.
+        record.update(status="missing", detail=f"cannot read image: {e}")
+        return record, None
+    try:
+        image = decode_image(data)
+    except ValueError as e:
+        record.update(status="invalid", detail=f"unreadable image: {e}")
+        return record, None
+    quality = assess_quality(image)
+    record["quality"] = quality.score
+    if not quality.acceptable:
+        record.update(status="invalid", detail=f"poor image: {quality.reason}")
+        return record, None
+    if not data.startswith(b"\x89PNG"):
+        data = encode_image(image)
+    # Cache the template of the exact bytes that are uploaded, so signin finds it.
+    _, template = _worker_store.add_data(data, image)
+    record["keypoints"] = len(template.keypoints)
+    return record, data
+
+def _upload(client, record, data):
+    fields = {name: record[name] for name in ("username", "password", "droneid", "pilotid", "address", "quality")}
+    start = time.perf_counter()
+    try:
+        response = client.insert_fingerprint(fields, data, f"{record['username']}_fingerprint.png")
+        try:
+            error = response.json().get("error", "")
+        except ValueError:
+            error = response.text[:200]
+        if response.status_code == 201:
+            record.update(status="enrolled")
+        elif response.status_code == 400 and "Duplicate" in error:
+            record.update(status="duplicate", detail=error)
+        else:
+            record.update(status="failed", detail=f"HTTP {response.status_code}: {error}")
+    except Exception as e:
+        record.update(status="failed", detail=str(e))
+    record["upload_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+def bulk_enroll(manifest_path, api_url=API_URL, images_dir=None, checkpoint_path=None, report_path=None,
+                workers=None, concurrency=UPLOAD_CONCURRENCY, template_store=None):
+    """Enroll every record of a manifest and return the per-record results.
+
+    Images are validated and featurized on a process pool and uploaded to
+    /api/fingerprint/insert by at most concurrency threads. Records go through
+    the pool in windows and at most twice concurrency uploads are queued, so
+    only a bounded number of images is in memory at once. Each outcome is
+    appended to the checkpoint as soon as it is known; on a rerun, records
+    already enrolled, rejected as duplicates or invalid are skipped and only
+    failed, missing or unfinished ones are tried again.
+    """
+    template_store = template_store or TemplateStore()
+    checkpoint_path = checkpoint_path or f"{manifest_path}.checkpoint.jsonl"
+    report_path = report_path or f"{os.path.splitext(manifest_path)[0]}.report.csv"
+    records = read_manifest(manifest_path, images_dir)
+    done = load_checkpoint(checkpoint_path)
+    results = {key: result for key, result in done.items() if result["status"] in FINAL_STATUSES}
+
+    pending, seen = [], {}
+    for record in records:
+        if record["pilotid"] and record["pilotid"] in seen:
+            results[f"line {record['line']}"] = dict(record, status="duplicate",
+                                                     detail=f"pilotid repeated in manifest (line {seen[record['pilotid']]})")
+            continue
+        seen[record["pilotid"]] = record["line"]
+        if record["key"] not in results:
+            pending.append(record)
+    print(f"{len(records)} records, {len(records) - len(pending)} already done or rejected, {len(pending)} to enroll")
+
+    lock = threading.Lock()
+    client = APIClient(api_url, pool_size=concurrency)
+    with open(checkpoint_path, "a") as checkpoint:
+        def finish(record):
+            with lock:
+                results[record["key"]] = record
+                checkpoint.write(json.dumps(record) + "\n")
+                checkpoint.flush()
+                print(f"line {record['line']}: {record['username']} ({record['pilotid']}) {record['status']} {record['detail']}")
+
+        queued = threading.BoundedSemaphore(2 * concurrency)
+
+        def uploaded(future):
+            try:
+                finish(future.result())
+            finally:
+                queued.release()
+
+        initargs = (template_store.directory, template_store.nfeatures, template_store.preprocessing)
+        window = (workers or os.cpu_count() or 1) * PREPARE_WINDOW
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool, \
+                ThreadPoolExecutor(concurrency, thread_name_prefix="bulk-upload") as uploads:
+            for start in range(0, len(pending), window):
+                for record, data in pool.imap_unordered(_prepare, pending[start:start + window]):
+                    if data is None:
+                        finish(record)
+                    else:
+                        queued.acquire()
+                        uploads.submit(_upload, client, record, data).add_done_callback(uploaded)
+    client.close()
+
+    ordered = sorted(results.values(), key=lambda result: result["line"])
+    write_report(report_path, ordered)
+    counts = {}
+    for result in ordered:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(f"Report written to {report_path}: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    return ordered
+
+def write_report(report_path, results):
+    with open(report_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enroll the fingerprints listed in a CSV manifest.")
+    parser.add_argument("manifest", help="CSV with username, password, droneid, pilotid, address and image columns")
+    parser.add_argument("--images", help="folder the image paths are relative to (default: the manifest's folder)")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--fake-api", action="store_true", help="upload to an in-process stand-in for the API")
+    parser.add_argument("--concurrency", type=int, default=UPLOAD_CONCURRENCY, help="parallel uploads")
+    parser.add_argument("--workers", type=int, help="featurization processes (default: one per CPU)")
+    parser.add_argument("--checkpoint", help="default: <manifest>.checkpoint.jsonl")
+    parser.add_argument("--report", help="default: <manifest>.report.csv")
+    parser.add_argument("--nfeatures", type=int, default=ORB_NFEATURES)
+    args = parser.parse_args(argv)
+
+    api_url, server = args.api_url, None
+    if args.fake_api:
+        from fake_api import FakeAPIServer
+        server = FakeAPIServer().start()
+        api_url = server.url
+    try:
+        bulk_enroll(args.manifest, api_url, args.images, args.checkpoint, args.report, args.workers,
+                    args.concurrency, TemplateStore(nfeatures=args.nfeatures))
+    finally:
+        if server is not None:
+            server.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
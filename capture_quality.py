@@ -0,0 +1,90 @@
+import os
+import sys
+from collections import namedtuple
+import numpy as np
+import cv2
+from preprocessing import preprocess
+
+# Limits below which a frame is not worth matching. The weakest usable
+# images in ./fingerprints cover a third of the frame with a ridge
+# coherence of 0.55 and give over 900 corners; the near-blank captures
+# (1.png, 2.png, rough.png) cover under a fifth.
+MIN_FOREGROUND = 0.25
+MIN_CONTRAST = 0.5
+MIN_CLARITY = 0.45
+MIN_KEYPOINTS = 600
+# Values that score full marks; the score is the mean of the four ratios.
+GOOD_FOREGROUND = 0.5
+GOOD_CONTRAST = 0.9
+GOOD_CLARITY = 0.7
+GOOD_KEYPOINTS = 1500
+# Enrolled images scoring below this are flagged for re-enrollment.
+LOW_SCORE = 60
+COHERENCE_WINDOW = 16
+FAST_THRESHOLD = 20
+
+class QualityReport(namedtuple("QualityReport", ["acceptable", "score", "foreground", "contrast", "clarity",
+                                                 "keypoints", "reason"])):
+    """Result of assess_quality().
+
+    foreground is the fraction of the frame covered by the finger, contrast
+    the 5-95 percentile gray range of the finger over 255, clarity the mean
+    ridge orientation coherence (1 for perfectly parallel ridges, near 0 for
+    noise) and keypoints the number of FAST corners on the finger. Checks
+    stop at the first failure, leaving the later measures as None; reason
+    says which one failed. score is 0 to 100.
+    """
+    __slots__ = ()
+
+def ridge_clarity(image, mask, window=COHERENCE_WINDOW):
+    """Mean orientation coherence of the gradients over the mask."""
+    image = image.astype(np.float32)
+    gx = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3)
+    gxx = cv2.boxFilter(gx * gx, -1, (window, window))
+    gyy = cv2.boxFilter(gy * gy, -1, (window, window))
+    gxy = cv2.boxFilter(gx * gy, -1, (window, window))
+    coherence = np.sqrt((gxx - gyy) ** 2 + 4 * gxy * gxy) / (gxx + gyy + 1e-6)
+    return float(coherence[mask > 0].mean())
+
+def _score(foreground, contrast, clarity, keypoints):
+    measures = [(foreground, GOOD_FOREGROUND), (contrast, GOOD_CONTRAST), (clarity, GOOD_CLARITY),
+                (keypoints, GOOD_KEYPOINTS)]
+    return round(100 * sum(min((value or 0) / good, 1.0) for value, good in measures) / len(measures))
+
+def assess_quality(image):
+    """Check a grayscale frame before matching. Takes a few milliseconds and returns a QualityReport."""
+    processed = preprocess(image, "roi")
+    mask = processed.mask
+    foreground = float(np.count_nonzero(mask)) / image.size
+    contrast = clarity = keypoints = None
+    reason = None
+    if foreground < MIN_FOREGROUND:
+        reason = "Too little of the finger was captured"
+    else:
+        x, y, w, h = processed.roi
+        values = image[y:y + h, x:x + w][mask > 0]
+        low, high = np.percentile(values, (5, 95))
+        contrast = float(high - low) / 255
+        if contrast < MIN_CONTRAST:
+            reason = "The image is too faint"
+        else:
+            clarity = ridge_clarity(processed.image, mask)
+            if clarity < MIN_CLARITY:
+                reason = "The ridges are not clear (smudged or moved finger)"
+            else:
+                detector = cv2.FastFeatureDetector_create(FAST_THRESHOLD)
+                keypoints = len(detector.detect(processed.image, mask))
+                if keypoints < MIN_KEYPOINTS:
+                    reason = "Too few ridge features were found"
+    return QualityReport(reason is None, _score(foreground, contrast, clarity, keypoints),
+                         foreground, contrast, clarity, keypoints, reason)
+
+if __name__ == "__main__":
+    directory_path = sys.argv[1] if len(sys.argv) > 1 else "./fingerprints"
+    for image_file in sorted(os.listdir(directory_path)):
+        image = cv2.imread(os.path.join(directory_path, image_file), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            continue
+        report = assess_quality(image)
+        print(f"{image_file}: score {report.score}, " + ("ok" if report.acceptable else report.reason))
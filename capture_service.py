@@ -0,0 +1,218 @@
+import queue
+import threading
+import time
+import instrumentation
+from tk_dispatch import TkDispatcher
+
+POLL_INTERVAL = 0.02
+MAX_POLL_INTERVAL = 0.25
+POLL_BACKOFF = 1.5
+CAPTURE_TIMEOUT = 30.0
+
+class CaptureCancelled(Exception):
+    """Passed to on_error when a pending capture is cancelled."""
+
+class CaptureJob:
+    """One requested capture. Callbacks run on the GUI thread via CaptureService.dispatch."""
+
+    def __init__(self, on_frame, on_status=None, on_error=None, timeout=CAPTURE_TIMEOUT, prematch=None,
+                 on_match=None, lift_first=False, process=None):
+        self.on_frame = on_frame
+        self.process = process
+        self.on_status = on_status
+        self.on_error = on_error
+        self.timeout = timeout
+        self.prematch = prematch
+        self.on_match = on_match
+        self.lift_first = lift_first
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+class SensorTask:
+    """A function run on the capture thread with the sensor, between captures."""
+
+    def __init__(self, function, args, on_done=None, on_error=None):
+        self.function = function
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+
+class CaptureService(TkDispatcher):
+    """Runs fingerprint captures on a dedicated thread so the GUI never waits on the UART.
+
+    session is a SensorSession; the sensor is only connected once the first
+    capture starts, and connection errors are reported to on_error. The
+    worker polls the sensor with an interval that starts short and backs off
+    while no finger is present, honours timeouts and cancellation, and posts
+    status messages and decoded frames to a queue. attach() drains that
+    queue from the Tk event loop with after(), so all callbacks run on the
+    GUI thread. Other sensor work (such as loading templates into the
+    sensor) is queued with run() so it never interleaves with a capture.
+    """
+
+    def __init__(self, session, poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL):
+        super().__init__()
+        self.session = session
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._jobs = queue.Queue()
+        self._current = None
+        self._frame_buffer = None
+        self._thread = threading.Thread(target=self._run, name="capture-service", daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        """Whether a capture is running or queued; sensor tasks do not count."""
+        with self._jobs.mutex:
+            queued = any(isinstance(job, CaptureJob) for job in self._jobs.queue)
+        return queued or isinstance(self._current, CaptureJob)
+
+    def capture(self, on_frame, on_status=None, on_error=None, timeout=CAPTURE_TIMEOUT, prematch=None,
+                on_match=None, lift_first=False, process=None):
+        """Queue a capture; on_frame receives the decoded 288x256 frame.
+
+        prematch, if given, is called on the capture thread with the
+        sensor's Adafruit_Fingerprint object once the image is taken and
+        before it is transferred. If it returns anything but None, on_match
+        receives that instead and the image is never transferred. With
+        lift_first, a finger still resting on the sensor from the previous
+        capture must be lifted before the new one is taken.
+
+        process, if given, is called on the capture thread with the frame
+        and on_frame receives its result instead, so slow work such as
+        matching never runs on the GUI thread. Frames are decoded into one
+        buffer reused by every capture: process must not keep the frame it
+        is given (without process, on_frame gets a copy).
+        """
+        job = CaptureJob(on_frame, on_status, on_error, timeout, prematch, on_match, lift_first, process)
+        self._jobs.put(job)
+        return job
+
+    def run(self, function, *args, on_done=None, on_error=None):
+        """Queue function(finger, *args) to run on the capture thread; on_done receives its result."""
+        task = SensorTask(function, args, on_done, on_error)
+        self._jobs.put(task)
+        return task
+
+    def cancel(self):
+        """Cancel the running capture and any queued ones."""
+        kept = []
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(job, CaptureJob):
+                job.cancel()
+                self._post(job.on_error, CaptureCancelled("Capture cancelled."))
+            else:
+                kept.append(job)
+        for job in kept:
+            self._jobs.put(job)
+        # A running sensor task cannot be interrupted; it finishes on its own.
+        current = self._current
+        if isinstance(current, CaptureJob):
+            current.cancel()
+
+    def close(self, timeout=1.0):
+        self.cancel()
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if isinstance(job, SensorTask):
+                self._run_task(job)
+                continue
+            if job.cancelled:
+                continue
+            self._current = job
+            try:
+                callback, result = self._capture(job)
+            except Exception as e:
+                self._reset_on_link_error(e)
+                callback, result = job.on_error, e
+            # Cleared before posting, so a callback can start the next capture.
+            self._current = None
+            self._post(callback, result)
+
+    def _run_task(self, task):
+        self._current = task
+        try:
+            self._post(task.on_done, task.function(self.session.finger, *task.args))
+        except Exception as e:
+            self._reset_on_link_error(e)
+            self._post(task.on_error, e)
+        finally:
+            self._current = None
+
+    def _reset_on_link_error(self, error):
+        # A serial error (serial.SerialException is an OSError) leaves a dead port behind;
+        # closing the session makes the next capture reconnect. Capture timeouts are not link errors.
+        if isinstance(error, OSError) and not isinstance(error, TimeoutError):
+            self.session.close()
+
+    def _capture(self, job):
+        import adafruit_fingerprint
+        from frame_decoder import decode_frame, new_frame_buffer
+
+        if not self.session.is_open:
+            self._post(job.on_status, "Connecting to sensor...")
+        finger = self.session.finger
+        deadline = time.monotonic() + job.timeout
+        if job.lift_first:
+            self._post(job.on_status, "Lift your finger...")
+            with instrumentation.span("capture.lift_wait"):
+                self._wait_for(finger, job, deadline, adafruit_fingerprint.NOFINGER, "The finger was not lifted.")
+        self._post(job.on_status, "Waiting for finger...")
+        with instrumentation.span("capture.sensor_wait"):
+            self._wait_for(finger, job, deadline, adafruit_fingerprint.OK, "No finger detected.")
+
+        if job.prematch is not None:
+            self._post(job.on_status, "Searching the sensor...")
+            with instrumentation.span("capture.prematch") as span:
+                match = job.prematch(finger)
+                span.set(matched=match is not None)
+            if match is not None:
+                return job.on_match, match
+
+        self._post(job.on_status, "Transferring image...")
+        payload = self.session.upload_image()
+        if self._frame_buffer is None:
+            self._frame_buffer = new_frame_buffer()
+        with instrumentation.span("capture.decode"):
+            frame = decode_frame(payload, out=self._frame_buffer)
+        self._post(job.on_status, "Image captured.")
+        if job.process is None:
+            return job.on_frame, frame.copy()
+        return job.on_frame, job.process(frame)
+
+    def _wait_for(self, finger, job, deadline, wanted, timeout_message):
+        """Poll get_image() until it returns wanted (OK: finger imaged, NOFINGER: sensor clear)."""
+        import adafruit_fingerprint
+        interval = self.poll_interval
+        while True:
+            status = finger.get_image()
+            instrumentation.count("sensor.get_image")
+            if status == wanted:
+                return
+            if time.monotonic() >= deadline:
+                raise TimeoutError(timeout_message)
+            if job._cancelled.wait(interval):
+                raise CaptureCancelled("Capture cancelled.")
+            # Back off while the sensor is idle; poll fast again once a finger
+            # starts to touch it (anything other than NOFINGER).
+            if status == adafruit_fingerprint.NOFINGER:
+                interval = min(interval * POLL_BACKOFF, self.max_poll_interval)
+            else:
+                interval = self.poll_interval
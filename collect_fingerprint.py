@@ -1,47 +1,58 @@
-import time
-import numpy as np
-from matplotlib import pyplot as plt
-import serial
-import adafruit_fingerprint
+import startup_profile
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk
+from sensor_session import SensorSession
+from capture_service import CaptureService, CaptureCancelled
 
-uart = serial.Serial("COM4", baudrate=57600, timeout=1)
-finger = adafruit_fingerprint.Adafruit_Fingerprint(uart)
+startup_profile.record("imports", startup_profile.since_start())
 
-def get_fingerprint_photo(save_path="fingerprint_image.png"):
-    """Get and save fingerprint image to a file"""
-    print("Waiting for image...")
-    while finger.get_image() != adafruit_fingerprint.OK:
-        pass
-    print("Got image...Transferring image data...")
-    imgList = finger.get_fpdata("image", 2)
-    imgArray = np.zeros(73728, np.uint8)
-    for i, val in enumerate(imgList):
-        imgArray[(i * 2)] = val & 240
-        imgArray[(i * 2) + 1] = (val & 15) * 16
-    imgArray = np.reshape(imgArray, (288, 256))
-    plt.imsave(save_path, imgArray, cmap='gray')
+sensor_session = SensorSession()
+
+def save_fingerprint_frame(imgArray, save_path="fingerprint_image.png"):
+    """Save a captured fingerprint frame to a file"""
+    from matplotlib import image as mpimg
+    mpimg.imsave(save_path, imgArray, cmap='gray')
     print(f"Fingerprint image saved as {save_path}")
 
-def save_fingerprint_image():
+def save_fingerprint_image(capture_service, status_var):
     """Callback function to save fingerprint image when button is clicked"""
-    try:
-        get_fingerprint_photo(save_path="fingerprint_image.png")
-        messagebox.showinfo("Saved", "Fingerprint image saved successfully as fingerprint_image.png")
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to save fingerprint image: {str(e)}")
+    def on_frame(imgArray):
+        try:
+            save_fingerprint_frame(imgArray, save_path="fingerprint_image.png")
+            messagebox.showinfo("Saved", "Fingerprint image saved successfully as fingerprint_image.png")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save fingerprint image: {str(e)}")
+    
+    def on_error(error):
+        status_var.set(str(error))
+        if not isinstance(error, (CaptureCancelled, TimeoutError)):
+            messagebox.showerror("Error", f"Failed to save fingerprint image: {str(error)}")
+    
+    if not capture_service.busy:
+        capture_service.capture(on_frame, on_status=status_var.set, on_error=on_error)
 
 def create_ui():
     """Create a simple UI with a button to save fingerprint image"""
     root = tk.Tk()
     root.title("Fingerprint Image Capture")
     
-    button_save = tk.Button(root, text="Save Fingerprint Image", command=save_fingerprint_image)
+    capture_service = CaptureService(sensor_session)
+    capture_service.attach(root)
+    status_var = tk.StringVar()
+    
+    button_save = tk.Button(root, text="Save Fingerprint Image",
+                            command=lambda: save_fingerprint_image(capture_service, status_var))
     button_save.pack(pady=20)
     
+    tk.Label(root, textvariable=status_var).pack(pady=5)
+    
+    button_cancel = tk.Button(root, text="Cancel", command=capture_service.cancel)
+    button_cancel.pack(pady=10)
+    
+    root.after_idle(startup_profile.record, "window ready", startup_profile.since_start())
     root.mainloop()
+    capture_service.close()
+    sensor_session.close()
 
 if __name__ == "__main__":
     create_ui()
@@ -0,0 +1,187 @@
+import os
+import json
+import threading
+import numpy as np
+
+INDEX_PATH = "fingerprint_index.npz"
+DESCRIPTOR_BYTES = 32
+# 256-bit ORB descriptors are split into 16 substrings of 16 bits. Two
+# descriptors within Hamming distance 15 share at least one substring exactly.
+SUBSTRING_TABLES = DESCRIPTOR_BYTES // 2
+MAX_HAMMING_DISTANCE = 50
+# Substring values shared by this many gallery descriptors carry no information.
+MAX_BUCKET_SIZE = 2000
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+def hamming_distances(descriptors1, descriptors2):
+    """Row-wise Hamming distance between two (N, 32) uint8 descriptor arrays."""
+    return _POPCOUNT[np.bitwise_xor(descriptors1, descriptors2)].sum(axis=1, dtype=np.int32)
+
+def _substrings(descriptors):
+    return np.ascontiguousarray(descriptors, dtype=np.uint8).view(np.uint16)
+
+class DescriptorIndex:
+    """Multi-index hash over binary ORB descriptors that votes for enrolled labels.
+
+    Every label (a pilot id) owns the descriptors of its template. A query looks
+    up each probe substring in 16 sorted tables, keeps hits within
+    max_distance of the probe descriptor and gives each label one vote per
+    probe descriptor that hit it. Only the best voted labels need full
+    geometric verification.
+
+    The index is shared by the GUI, API and capture threads, so every method
+    holds the index's lock; read info through entry() and entries(), which
+    return copies.
+    """
+
+    def __init__(self, path=INDEX_PATH, max_distance=MAX_HAMMING_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.labels = []
+        self.info = {}
+        self._descriptors = np.empty((0, DESCRIPTOR_BYTES), np.uint8)
+        self._owners = np.empty(0, np.int32)
+        self._tables = None
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return str(label) in self.info
+
+    def entry(self, label):
+        """Info stored with label, or None once it has been removed."""
+        with self._lock:
+            info = self.info.get(str(label))
+            return None if info is None else dict(info)
+
+    def entries(self):
+        """{label: info} of every indexed label."""
+        with self._lock:
+            return {label: dict(info) for label, info in self.info.items()}
+
+    def add(self, label, descriptors, info=None, save=True):
+        """Insert or replace the descriptors enrolled under label."""
+        with self._lock:
+            label = str(label)
+            if label in self.info:
+                self.remove(label, save=False)
+            if descriptors is None:
+                descriptors = np.empty((0, DESCRIPTOR_BYTES), np.uint8)
+            owner = len(self.labels)
+            self.labels.append(label)
+            self.info[label] = info or {}
+            self._descriptors = np.concatenate([self._descriptors, np.asarray(descriptors, np.uint8)])
+            self._owners = np.concatenate([self._owners, np.full(len(descriptors), owner, np.int32)])
+            self._tables = None
+            if save:
+                self.save()
+
+    def remove(self, label, save=True):
+        """Delete a label and its descriptors. Returns False if it was not indexed."""
+        with self._lock:
+            label = str(label)
+            if label not in self.info:
+                return False
+            owner = self.labels.index(label)
+            keep = self._owners != owner
+            self._descriptors = self._descriptors[keep]
+            owners = self._owners[keep]
+            owners[owners > owner] -= 1
+            self._owners = owners
+            del self.labels[owner]
+            del self.info[label]
+            self._tables = None
+            if save:
+                self.save()
+            return True
+
+    def clear(self, save=True):
+        """Drop every label."""
+        with self._lock:
+            self.labels = []
+            self.info = {}
+            self._descriptors = np.empty((0, DESCRIPTOR_BYTES), np.uint8)
+            self._owners = np.empty(0, np.int32)
+            self._tables = None
+            if save:
+                self.save()
+
+    def query(self, descriptors, limit=3, min_votes=1):
+        """Return up to limit (label, votes) pairs for a probe, best first."""
+        with self._lock:
+            if descriptors is None or not len(descriptors) or not len(self._descriptors):
+                return []
+            probe = np.ascontiguousarray(descriptors, dtype=np.uint8)
+            probe_idx, gallery_idx = self._lookup(_substrings(probe))
+            if not len(probe_idx):
+                return []
+
+            # A pair can collide in several tables; check each one once.
+            pairs = np.unique(probe_idx.astype(np.int64) * len(self._descriptors) + gallery_idx)
+            probe_idx, gallery_idx = np.divmod(pairs, len(self._descriptors))
+            close = hamming_distances(probe[probe_idx], self._descriptors[gallery_idx]) <= self.max_distance
+            probe_idx, owners = probe_idx[close], self._owners[gallery_idx[close]]
+
+            # One vote per probe descriptor and label.
+            votes = np.bincount(np.unique(probe_idx * len(self.labels) + owners) % len(self.labels),
+                                minlength=len(self.labels))
+            ranked = np.argsort(-votes, kind="stable")[:limit]
+            return [(self.labels[i], int(votes[i])) for i in ranked if votes[i] >= min_votes]
+
+    def save(self):
+        """Write the index to self.path atomically."""
+        with self._lock:
+            if not self.path:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            meta = json.dumps({"labels": self.labels, "info": self.info})
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, descriptors=self._descriptors, owners=self._owners, meta=np.array(meta))
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Replace the in-memory index with the one stored at self.path."""
+        with self._lock:
+            with np.load(self.path) as data:
+                meta = json.loads(str(data["meta"]))
+                self._descriptors = data["descriptors"]
+                self._owners = data["owners"]
+            self.labels = meta["labels"]
+            self.info = meta["info"]
+            self._tables = None
+
+    def _build_tables(self):
+        substrings = _substrings(self._descriptors).T
+        order = np.argsort(substrings, axis=1, kind="stable").astype(np.int64)
+        self._tables = (np.take_along_axis(substrings, order, axis=1), order)
+
+    def _lookup(self, probe_substrings):
+        """Return (probe row, gallery row) pairs sharing at least one substring."""
+        if self._tables is None:
+            self._build_tables()
+        sorted_values, order = self._tables
+        probe_hits, gallery_hits = [], []
+        for table in range(SUBSTRING_TABLES):
+            values = probe_substrings[:, table]
+            lo = np.searchsorted(sorted_values[table], values, side="left")
+            hi = np.searchsorted(sorted_values[table], values, side="right")
+            counts = hi - lo
+            counts[counts > MAX_BUCKET_SIZE] = 0
+            total = counts.sum()
+            if not total:
+                continue
+            # Expand each [lo, hi) bucket range into explicit gallery positions.
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            probe_hits.append(np.repeat(np.arange(len(values)), counts))
+            gallery_hits.append(order[table][starts + np.arange(total)])
+        if not probe_hits:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(probe_hits), np.concatenate(gallery_hits)
@@ -1,28 +1,16 @@
-import time
-import serial
-import adafruit_fingerprint
-
-# UART setup for fingerprint sensor
-uart = serial.Serial("COM4", baudrate=57600, timeout=2)
-time.sleep(1)  # Adding delay to ensure the sensor is ready
-finger = adafruit_fingerprint.Adafruit_Fingerprint(uart)
+from sensor_session import SensorSession
+from sensor_library import empty_library
 
 # Function to delete all stored fingerprints
-def delete_all_fingerprints():
+def delete_all_fingerprints(finger):
     print("Deleting all stored fingerprints...")
-    for location in range(1, 128):  # Loop through all possible storage locations
-        i = finger.delete_model(location)
-        if i == adafruit_fingerprint.OK:
-            print(f"Fingerprint model at location {location} deleted.")
-        else:
-            print(f"Failed to delete fingerprint model at location {location}.")
-
-    print("All fingerprints deleted.")
+    # One Empty command clears the whole library instead of a Delete per slot.
+    count = empty_library(finger)
+    print(f"All fingerprints deleted ({count} templates removed).")
 
 # Main program
 if __name__ == "__main__":
-    delete_all_fingerprints()
-
-    # Close UART connection when done
-    uart.close()
-
+    # UART setup for fingerprint sensor, with a delay to ensure the sensor is ready.
+    # The connection is closed when done.
+    with SensorSession(timeout=2, settle_time=1) as session:
+        delete_all_fingerprints(session.finger)
@@ -0,0 +1,129 @@
+import sys
+import json
+import base64
+import hashlib
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """In-memory stand-in for the Express API in main.js, for tests and bulk-import dry runs.
+
+    Implements /api/fingerprint/insert, /api/signin, /api/logout and
+    /api/fingerprint/delete/:pilotid with the same status codes and error
+    messages, including the duplicate pilotid rejection. fail_next makes the
+    next inserts answer 500, to exercise retries and resume.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("localhost", 0)):
+        super().__init__(address, FakeAPIHandler)
+        self.records = {}
+        self.images = {}
+        self.templates = {}
+        self.fail_next = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _form(self):
+        """Parse a multipart/form-data body into (fields, files)."""
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser(policy=HTTP).parsebytes(header + self._body())
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is not None:
+                files[name] = (part.get_filename(), part.get_payload(decode=True))
+            else:
+                fields[name] = part.get_payload(decode=True).decode()
+        return fields, files
+
+    def do_POST(self):
+        server = self.server
+        if self.path == "/api/fingerprint/insert":
+            fields, files = self._form()
+            with server.lock:
+                if server.fail_next > 0:
+                    server.fail_next -= 1
+                    return self._reply(500, {"error": "Database error"})
+                try:
+                    pilotid = int(fields.get("pilotid"))
+                except (TypeError, ValueError):
+                    return self._reply(500, {"error": "Database error"})
+                if pilotid in server.records:
+                    return self._reply(400, {"error": "Duplicate entry. Username, Drone ID, or Pilot ID already exists."})
+                record = dict(fields, pilotid=pilotid)
+                server.records[pilotid] = record
+                if "fingerprint_image" in files:
+                    server.images[pilotid] = files["fingerprint_image"][1]
+                if "fingerprint_template" in files:
+                    server.templates[pilotid] = (files["fingerprint_template"][1], fields.get("template_params"))
+            return self._reply(201, {"message": "Fingerprint inserted", "id": pilotid})
+        if self.path == "/api/signin":
+            body = json.loads(self._body() or b"{}")
+            with server.lock:
+                user = next((r for r in server.records.values()
+                             if r.get("username") == body.get("username") and r.get("password") == body.get("password")), None)
+                image = server.images.get(user["pilotid"]) if user else None
+                template = server.templates.get(user["pilotid"]) if user else None
+            if user is None:
+                return self._reply(404, {"error": "User not found"})
+            if image is None:
+                return self._reply(500, {"error": "Error reading fingerprint image"})
+            fingerprint_hash = hashlib.sha256(image).hexdigest()
+            response = {"token": "fake", "fingerprint_hash": fingerprint_hash, "username": user["username"],
+                        "droneid": user.get("droneid"), "pilotid": user["pilotid"], "address": user.get("address"),
+                        "fingerprint_quality": float(user["quality"]) if user.get("quality") else None}
+            if body.get("fingerprint_hash") != fingerprint_hash:
+                response["fingerprint_image"] = base64.b64encode(image).decode()
+                if template is not None:
+                    response["fingerprint_template"] = base64.b64encode(template[0]).decode()
+                    response["fingerprint_template_params"] = template[1]
+            return self._reply(200, response)
+        if self.path == "/api/logout":
+            return self._reply(200, {"message": "Logout successful"})
+        self._reply(404, {"error": "Not found"})
+
+    def do_DELETE(self):
+        prefix = "/api/fingerprint/delete/"
+        if not self.path.startswith(prefix):
+            return self._reply(404, {"error": "Not found"})
+        with self.server.lock:
+            removed = self.server.records.pop(int(self.path[len(prefix):]), None)
+        if removed is None:
+            return self._reply(404, {"error": "Fingerprint not found"})
+        self._reply(200, {"message": "Fingerprint deleted"})
+
+if __name__ == "__main__":
+    server = FakeAPIServer(("localhost", int(sys.argv[1]) if len(sys.argv) > 1 else 3000))
+    print(f"Fake API listening at {server.url}")
+    server.serve_forever()
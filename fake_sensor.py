@@ -0,0 +1,281 @@
+import os
+import sys
+import tty
+import time
+import struct
+import hashlib
+import termios
+import threading
+from sensor_transport import (STARTCODE, COMMAND_PACKET, DATA_PACKET, ACK_PACKET, END_PACKET, UPLOAD_IMAGE,
+                              SYSPARAM_BAUDRATE, SYSPARAM_PACKET_SIZE, PACKET_SIZES, packet_checksum)
+
+OK = 0x00
+PACKET_ERROR = 0x01
+NO_FINGER = 0x02
+NOT_FOUND = 0x09
+BAD_LOCATION = 0x0B
+READ_FAIL = 0x0C
+
+GET_IMAGE = 0x01
+IMAGE_TO_CHAR = 0x02
+SEARCH = 0x04
+STORE = 0x06
+LOAD = 0x07
+UPLOAD_CHAR = 0x08
+DOWNLOAD_CHAR = 0x09
+DOWNLOAD_IMAGE = 0x0B
+DELETE = 0x0C
+EMPTY = 0x0D
+SET_SYSPARAM = 0x0E
+READ_SYSPARAM = 0x0F
+VERIFY_PASSWORD = 0x13
+FAST_SEARCH = 0x1B
+TEMPLATE_COUNT = 0x1D
+READ_INDEX = 0x1F
+
+ADDRESS = b"\xff\xff\xff\xff"
+LIBRARY_SIZE = 127
+TEMPLATE_BYTES = 512
+MATCH_SCORE = 120
+
+_TERMIOS_SPEEDS = {getattr(termios, f"B{rate}"): rate
+                   for rate in (9600, 19200, 38400, 57600, 115200) if hasattr(termios, f"B{rate}")}
+
+class FakeSensor:
+    """AS608 stand-in on a pseudo-terminal, for exercising the serial code without hardware.
+
+    Open SensorTransport or serial.Serial on .port. The fake answers the
+    commands the application uses, honours SetSysPara for the baud rate and
+    data packet size, and only replies intelligibly when the host's line
+    speed matches its own, like the real sensor. frames are packed image
+    payloads (see frame_decoder.encode_frame) handed out by successive
+    captures. library maps slot numbers to stored template bytes and is
+    managed with the usual store, load, delete, empty and index commands.
+    Feature extraction is a digest of the image, so a search only finds
+    templates made from exactly the same image.
+    corrupt_packets lists data packet numbers whose checksum is
+    broken on the first corrupt_uploads image uploads. With realtime set,
+    replies are delayed by their time on the wire at the current baud rate.
+    POSIX only.
+    """
+
+    def __init__(self, frames, baudrate=57600, packet_size=128, corrupt_packets=(), corrupt_uploads=1,
+                 realtime=False, library=None):
+        self.frames = list(frames)
+        self.library = dict(library or {})
+        self.char_buffers = {1: bytes(TEMPLATE_BYTES), 2: bytes(TEMPLATE_BYTES)}
+        self._receiving = None
+        self._received = b""
+        self.baudrate = baudrate
+        self.packet_size = packet_size
+        self.corrupt_packets = set(corrupt_packets)
+        self.corrupt_uploads = corrupt_uploads
+        self.realtime = realtime
+        self.uploads = 0
+        self.commands = []
+        self._image = None
+        self._next_frame = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="fake-sensor", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed = True
+        os.close(self._slave)
+        os.close(self._master)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _host_baudrate(self):
+        return _TERMIOS_SPEEDS.get(termios.tcgetattr(self._slave)[5])
+
+    def _read_exact(self, count):
+        data = b""
+        while len(data) < count:
+            chunk = os.read(self._master, count - len(data))
+            if not chunk:
+                raise OSError("pty closed")
+            data += chunk
+        return data
+
+    def _run(self):
+        try:
+            while not self._closed:
+                header = self._read_exact(9)
+                if header[:2] != STARTCODE:
+                    continue
+                packet_type, length = struct.unpack(">BH", header[6:9])
+                body = self._read_exact(length)
+                if packet_checksum(packet_type, body[:-2]) != struct.unpack(">H", body[-2:])[0]:
+                    self._ack(PACKET_ERROR)
+                    continue
+                if packet_type in (DATA_PACKET, END_PACKET) and self._receiving is not None:
+                    self._receive(packet_type, body[:-2])
+                    continue
+                if packet_type != COMMAND_PACKET:
+                    self._ack(PACKET_ERROR)
+                    continue
+                self.commands.append(body[0])
+                self._handle(body[0], body[1:-2])
+        except OSError:
+            pass
+
+    def _handle(self, command, args):
+        if command == VERIFY_PASSWORD:
+            self._ack(OK)
+        elif command == READ_SYSPARAM:
+            self._ack(OK, struct.pack(">HHHH4sHH", 0, 0, LIBRARY_SIZE, 3, ADDRESS,
+                                      PACKET_SIZES.index(self.packet_size), self.baudrate // 9600))
+        elif command == SET_SYSPARAM:
+            param, value = args[0], args[1]
+            self._ack(OK)
+            if param == SYSPARAM_BAUDRATE:
+                self.baudrate = value * 9600
+            elif param == SYSPARAM_PACKET_SIZE:
+                self.packet_size = PACKET_SIZES[value]
+        elif command == GET_IMAGE:
+            if not self.frames:
+                self._ack(NO_FINGER)
+                return
+            self._image = self.frames[self._next_frame % len(self.frames)]
+            self._next_frame += 1
+            self._ack(OK)
+        elif command == UPLOAD_IMAGE:
+            if self._image is None:
+                self._ack(PACKET_ERROR)
+                return
+            self._ack(OK)
+            self._send_image(self._image)
+        elif command == DOWNLOAD_IMAGE:
+            self._receiving, self._received = "image", b""
+            self._ack(OK)
+        elif command == IMAGE_TO_CHAR:
+            if self._image is None:
+                self._ack(PACKET_ERROR)
+                return
+            self.char_buffers[args[0]] = image_template(self._image)
+            self._ack(OK)
+        elif command in (SEARCH, FAST_SEARCH):
+            start, count = struct.unpack(">HH", args[1:5])
+            template = self.char_buffers[args[0]]
+            slot = next((slot for slot in sorted(self.library)
+                         if start <= slot < start + count and self.library[slot] == template), None)
+            if slot is None:
+                self._ack(NOT_FOUND, bytes(4))
+            else:
+                self._ack(OK, struct.pack(">HH", slot, MATCH_SCORE))
+        elif command == TEMPLATE_COUNT:
+            self._ack(OK, struct.pack(">H", len(self.library)))
+        elif command == READ_INDEX:
+            bitmap = bytearray(32)
+            for slot in self.library:
+                if slot // 256 == args[0]:
+                    bitmap[(slot % 256) // 8] |= 1 << (slot % 8)
+            self._ack(OK, bytes(bitmap))
+        elif command == EMPTY:
+            self.library.clear()
+            self._ack(OK)
+        elif command == DELETE:
+            start, count = struct.unpack(">HH", args[:4])
+            if start + count > LIBRARY_SIZE + 1:
+                self._ack(BAD_LOCATION)
+                return
+            for slot in range(start, start + count):
+                self.library.pop(slot, None)
+            self._ack(OK)
+        elif command == STORE:
+            slot = struct.unpack(">H", args[1:3])[0]
+            if slot > LIBRARY_SIZE:
+                self._ack(BAD_LOCATION)
+                return
+            self.library[slot] = self.char_buffers[args[0]]
+            self._ack(OK)
+        elif command == LOAD:
+            slot = struct.unpack(">H", args[1:3])[0]
+            if slot not in self.library:
+                self._ack(READ_FAIL)
+                return
+            self.char_buffers[args[0]] = self.library[slot]
+            self._ack(OK)
+        elif command == UPLOAD_CHAR:
+            self._ack(OK)
+            self._send_data(self.char_buffers[args[0]])
+        elif command == DOWNLOAD_CHAR:
+            self._receiving, self._received = args[0], b""
+            self._ack(OK)
+        else:
+            self._ack(PACKET_ERROR)
+
+    def _receive(self, packet_type, payload):
+        self._received += payload
+        if packet_type == END_PACKET:
+            if self._receiving == "image":
+                self._image = self._received
+            else:
+                self.char_buffers[self._receiving] = self._received
+            self._receiving = None
+
+    def _ack(self, code, payload=b""):
+        self._write(self._packet(ACK_PACKET, bytes([code]) + payload))
+
+    def _send_image(self, image):
+        self.uploads += 1
+        corrupt = self.corrupt_packets if self.uploads <= self.corrupt_uploads else ()
+        self._send_data(image, corrupt)
+
+    def _send_data(self, data, corrupt=()):
+        size = self.packet_size
+        count = len(data) // size
+        for index in range(count):
+            packet_type = END_PACKET if index == count - 1 else DATA_PACKET
+            packet = bytearray(self._packet(packet_type, data[index * size:(index + 1) * size]))
+            if index in corrupt:
+                packet[-1] ^= 0xFF
+            self._write(bytes(packet))
+
+    def _packet(self, packet_type, payload):
+        length = len(payload) + 2
+        return (STARTCODE + ADDRESS + struct.pack(">BH", packet_type, length) + payload
+                + struct.pack(">H", packet_checksum(packet_type, payload)))
+
+    def _write(self, data):
+        if self._host_baudrate() != self.baudrate:
+            # A host listening at another speed only sees noise.
+            data = bytes(len(data))
+        if self.realtime:
+            time.sleep(len(data) * 10 / self.baudrate)
+        os.write(self._master, data)
+
+def image_template(image):
+    """Stand-in for the sensor's feature extraction: a digest of the packed image."""
+    return (hashlib.sha256(image).digest() * (TEMPLATE_BYTES // 32))[:TEMPLATE_BYTES]
+
+def self_test(image_path):
+    """Capture one image through SensorTransport from a fake sensor with injected packet errors."""
+    import cv2
+    from frame_decoder import encode_frame, decode_frame
+    from sensor_transport import SensorTransport, TARGET_BAUDRATE
+
+    payload = encode_frame(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+    with FakeSensor([payload], baudrate=57600, packet_size=128, corrupt_packets={3, 50, 143}) as sensor:
+        transport = SensorTransport(sensor.port, baudrate=9600, target_baudrate=TARGET_BAUDRATE)
+        try:
+            finger = transport.connect()
+            print(f"Negotiated {transport.baudrate} baud, {transport.packet_size}-byte packets")
+            assert finger.get_image() == OK
+            received = transport.upload_image()
+        finally:
+            transport.close()
+    assert received == payload, "image payload differs"
+    decode_frame(received)
+    print(f"Image transferred intact: {transport.last_transfer}")
+
+if __name__ == "__main__":
+    self_test(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints/arvind3.png")
@@ -0,0 +1,294 @@
+import os
+import sys
+import time
+import struct
+import hashlib
+import sqlite3
+import argparse
+from urllib.request import pathname2url
+import instrumentation
+
+DB_PATH = os.environ.get("FINGERPRINT_DB", "trialdb.db")
+# PRAGMA user_version of a database migrated by this module; main.js creates version 0.
+SCHEMA_VERSION = 1
+BATCH_SIZE = 500
+# Seconds a writer waits for another connection (e.g. main.js) to finish.
+BUSY_TIMEOUT = 10.0
+PILOT_COLUMNS = ("username", "password", "droneid", "pilotid", "address", "fingerprint_image_path", "timestamp",
+                 "fingerprint_quality", "fingerprint_template_path", "fingerprint_template_params")
+# Columns main.js added to the fingerprints table after it was first created.
+ADDED_COLUMNS = {"fingerprint_quality": "REAL", "fingerprint_template_path": "TEXT",
+                 "fingerprint_template_params": "TEXT"}
+
+# The same table main.js creates, for databases this module creates first.
+CREATE_FINGERPRINTS = """CREATE TABLE IF NOT EXISTS fingerprints (
+    username TEXT,
+    password TEXT,
+    droneid INTEGER,
+    pilotid INTEGER PRIMARY KEY,
+    address TEXT,
+    fingerprint_image_path TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fingerprint_quality REAL,
+    fingerprint_template_path TEXT,
+    fingerprint_template_params TEXT
+)"""
+
+# MIGRATIONS[v] takes a database from user_version v to v + 1.
+MIGRATIONS = [
+    [
+        # Signin looks pilots up by username and password.
+        "CREATE INDEX IF NOT EXISTS fingerprints_username ON fingerprints (username, password)",
+        # One template per pilot and extractor (params_key), so a gallery is one range of the primary key.
+        """CREATE TABLE IF NOT EXISTS templates (
+            params_key TEXT NOT NULL,
+            pilotid INTEGER NOT NULL,
+            engine TEXT NOT NULL,
+            image_hash TEXT NOT NULL,
+            template BLOB NOT NULL,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (params_key, pilotid)
+        )""",
+        "CREATE INDEX IF NOT EXISTS templates_pilotid ON templates (pilotid)",
+        # main.js deletes pilots without enabling foreign keys, so a trigger removes their templates.
+        """CREATE TRIGGER IF NOT EXISTS fingerprints_delete_templates AFTER DELETE ON fingerprints
+        BEGIN
+            DELETE FROM templates WHERE pilotid = OLD.pilotid;
+        END""",
+    ],
+]
+
+def resolve_image_path(path, db_path=DB_PATH):
+    """fingerprint_image_path as a local path; main.js stores it relative to its folder, with Windows separators."""
+    if not path:
+        return None
+    path = path.replace("\\", "/")
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), path)
+
+class FingerprintDB:
+    """Data access to trialdb.db: pilots, their enrolled templates as BLOBs, and the schema.
+
+    Opening a database for writing switches it to WAL mode, so reads here
+    do not block main.js writing; the schema is only changed by an explicit
+    migrate() to SCHEMA_VERSION. With readonly the file is opened read-only
+    and left exactly as it is. Large result sets are read with streaming
+    cursors (iter_*) and writes are batched, one transaction per BATCH_SIZE
+    rows.
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=BATCH_SIZE, readonly=False):
+        self.path = path
+        self.batch_size = batch_size
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True,
+                                        timeout=BUSY_TIMEOUT)
+        else:
+            self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # Safe with WAL: a power cut can lose the last commits, never corrupt the file.
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.row_factory = sqlite3.Row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def schema_version(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        """Bring the schema up to SCHEMA_VERSION. Returns the number of migrations applied."""
+        version = self.schema_version
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"{self.path} has schema version {version}; this code supports up to {SCHEMA_VERSION}.")
+        with self.conn:
+            self.conn.execute(CREATE_FINGERPRINTS)
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(fingerprints)")}
+            # Databases created before these columns existed lack them.
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE fingerprints ADD COLUMN {column} {column_type}")
+            for step in range(version, SCHEMA_VERSION):
+                for statement in MIGRATIONS[step]:
+                    self.conn.execute(statement)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return SCHEMA_VERSION - version
+
+    def iter_rows(self, sql, params=()):
+        """Yield the rows of a query as dicts, fetching batch_size at a time."""
+        cursor = self.conn.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+    def find_pilot(self, username, password):
+        """The pilot signing in with these credentials, or None (uses the fingerprints_username index)."""
+        row = self.conn.execute("SELECT * FROM fingerprints WHERE username = ? AND password = ?",
+                                (username, password)).fetchone()
+        return dict(row) if row else None
+
+    def pilot(self, pilotid):
+        row = self.conn.execute("SELECT * FROM fingerprints WHERE pilotid = ?", (pilotid,)).fetchone()
+        return dict(row) if row else None
+
+    def iter_pilots(self, columns=PILOT_COLUMNS):
+        unknown = [column for column in columns if column not in PILOT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown column {', '.join(unknown)}; choose from {', '.join(PILOT_COLUMNS)}.")
+        return self.iter_rows(f"SELECT {', '.join(columns)} FROM fingerprints ORDER BY pilotid")
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def insert_pilots(self, pilots):
+        """Insert or replace pilots (dicts with the PILOT_COLUMNS they have), batch_size per transaction."""
+        count = 0
+        for batch in self._batches(pilots):
+            columns = [column for column in PILOT_COLUMNS if column in batch[0]]
+            sql = (f"INSERT OR REPLACE INTO fingerprints ({', '.join(columns)}) "
+                   f"VALUES ({', '.join('?' * len(columns))})")
+            with self.conn:
+                self.conn.executemany(sql, [tuple(pilot.get(column) for column in columns) for pilot in batch])
+            count += len(batch)
+        return count
+
+    def delete_pilot(self, pilotid):
+        """Delete a pilot; the trigger removes its templates."""
+        with self.conn:
+            return self.conn.execute("DELETE FROM fingerprints WHERE pilotid = ?", (pilotid,)).rowcount > 0
+
+    def put_templates(self, store, entries):
+        """Store (pilotid, image_hash, template) entries extracted by store, batch_size per transaction."""
+        engine = store.params["detector"]
+        count = 0
+        for batch in self._batches(entries):
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO templates (params_key, pilotid, engine, image_hash, template) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(store.params_key, pilotid, engine, image_hash, template.to_bytes())
+                     for pilotid, image_hash, template in batch])
+            count += len(batch)
+        return count
+
+    def template(self, store, pilotid):
+        row = self.conn.execute("SELECT template FROM templates WHERE params_key = ? AND pilotid = ?",
+                                (store.params_key, pilotid)).fetchone()
+        return None if row is None else store.template_class.from_bytes(row["template"])
+
+    def iter_templates(self, store):
+        """Yield (pilotid, template) for every pilot with a template from store's extractor, in one scan."""
+        rows = self.iter_rows("SELECT pilotid, template FROM templates WHERE params_key = ? ORDER BY pilotid",
+                              (store.params_key,))
+        for row in rows:
+            yield row["pilotid"], store.template_class.from_bytes(row["template"])
+
+    def load_gallery(self, store):
+        """{pilotid: template} of every enrolled pilot, for 1:N matching."""
+        with instrumentation.span("db.load_gallery") as span:
+            gallery = dict(self.iter_templates(store))
+            span.set(pilots=len(gallery))
+        return gallery
+
+    def sync_templates(self, store, refresh=False):
+        """Extract and store the templates of the pilots that have an image but no template from store.
+
+        With refresh, every pilot's image is read again and its template
+        replaced if the image changed. A pilot enrolled with several
+        impressions gets the fused template uploaded with the image, when it
+        was made by store's extractor. Returns (stored, failed).
+        """
+        sql = ("SELECT f.pilotid, f.fingerprint_image_path, f.fingerprint_template_path, "
+               "f.fingerprint_template_params, t.image_hash FROM fingerprints f "
+               "LEFT JOIN templates t ON t.pilotid = f.pilotid AND t.params_key = ? "
+               "WHERE f.fingerprint_image_path IS NOT NULL")
+        if not refresh:
+            sql += " AND t.pilotid IS NULL"
+        # Listed first: the templates table is written while the work runs.
+        pending = list(self.iter_rows(sql + " ORDER BY f.pilotid", (store.params_key,)))
+        failed = []
+
+        def extracted():
+            from template_store import decode_image
+            for row in pending:
+                try:
+                    with open(resolve_image_path(row["fingerprint_image_path"], self.path), "rb") as f:
+                        data = f.read()
+                    image_hash = hashlib.sha256(data).hexdigest()
+                    if image_hash == row["image_hash"]:
+                        continue
+                    if row["fingerprint_template_path"] and row["fingerprint_template_params"] == store.params_key:
+                        with open(resolve_image_path(row["fingerprint_template_path"], self.path), "rb") as f:
+                            template = store.template_class.from_bytes(f.read())
+                    else:
+                        template = store.extract(decode_image(data))
+                    yield row["pilotid"], image_hash, template
+                except (OSError, ValueError, struct.error) as e:
+                    failed.append((row["pilotid"], str(e)))
+
+        stored = self.put_templates(store, extracted())
+        return stored, failed
+
+def benchmark(db, store):
+    """Time loading the gallery from the database against reading each pilot's template from store's files."""
+    paths = [resolve_image_path(row["fingerprint_image_path"], db.path)
+             for row in db.iter_pilots(("fingerprint_image_path",)) if row["fingerprint_image_path"]]
+    # Pilots whose image is gone have no template file to read (sync_templates reports them).
+    paths = [path for path in paths if os.path.exists(path)]
+    for path in paths:
+        store.get(path)
+    start = time.perf_counter()
+    from_files = [store.get(path) for path in paths]
+    file_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    gallery = db.load_gallery(store)
+    db_seconds = time.perf_counter() - start
+    print(f"{len(from_files)} templates from files: {file_seconds * 1000:.1f} ms; "
+          f"{len(gallery)} from the database: {db_seconds * 1000:.1f} ms")
+    return file_seconds, db_seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate trialdb.db and store the enrolled pilots' templates in it.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--engine", help="fingerprint engine whose templates to store (default FINGERPRINT_ENGINE)")
+    parser.add_argument("--refresh", action="store_true", help="re-read every image and replace changed templates")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare loading the gallery from the database and from template files")
+    args = parser.parse_args(argv)
+
+    from fingerprint_engines import ENGINE, get_fingerprint_engine
+    store = get_fingerprint_engine(args.engine or ENGINE).store
+    with FingerprintDB(args.db) as db:
+        migrated = db.migrate()
+        print(f"{args.db}: schema version {db.schema_version}" + (f" ({migrated} migrations applied)" if migrated else ""))
+        stored, failed = db.sync_templates(store, refresh=args.refresh)
+        print(f"Stored {stored} {store.params['detector']} templates")
+        for pilotid, error in failed:
+            print(f"Pilot {pilotid}: {error}", file=sys.stderr)
+        if args.benchmark:
+            benchmark(db, store)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import itertools
+from abc import ABC, abstractmethod
+import cv2
+
+ENGINE = os.environ.get("FINGERPRINT_ENGINE", "orb")
+
+class FingerprintEngine(ABC):
+    """Template extraction, 1:1 verification and 1:N identification for one kind of template.
+
+    store is a TemplateStore-like cache of the engine's templates.
+    Identification uses a DescriptorIndex as the registry of enrolled
+    pilots; each entry's info holds the template_key of its template.
+    """
+    name = None
+
+    def extract(self, image):
+        return self.store.extract(image)
+
+    def index_descriptors(self, template):
+        """Descriptors to put in the DescriptorIndex for template, or None."""
+        return None
+
+    def candidates(self, probe, index, limit):
+        """Labels of the enrolled pilots to verify the probe against, most likely first."""
+        return list(index.entries())
+
+    @abstractmethod
+    def verify(self, probe, gallery):
+        """VerificationResult of comparing two templates."""
+
+    def identify(self, probe, index, limit=3):
+        """Yield (label, gallery template, VerificationResult) for the candidates, in order."""
+        for label in self.candidates(probe, index, limit):
+            # A pilot logged out or deleted since the query is skipped.
+            info = index.entry(label)
+            gallery = None if info is None else self.store.load(info['template_key'])
+            if gallery is not None:
+                yield label, gallery, self.verify(probe, gallery)
+
+    @abstractmethod
+    def template_bytes(self, template):
+        """Size of template in bytes, for comparing engines."""
+
+class OrbEngine(FingerprintEngine):
+    """ORB keypoints, shortlisted by descriptor index votes and verified by the match cascade."""
+    name = "orb"
+
+    def __init__(self, store=None, cascade=None):
+        from template_store import TemplateStore
+        from match_cascade import MatchCascade
+        self.store = store or TemplateStore()
+        self.cascade = cascade or MatchCascade()
+
+    def index_descriptors(self, template):
+        return template.descriptors
+
+    def candidates(self, probe, index, limit):
+        return [label for label, votes in index.query(probe.descriptors, limit=limit)]
+
+    def verify(self, probe, gallery):
+        return self.cascade.verify(probe, gallery)
+
+    def template_bytes(self, template):
+        descriptors = 0 if template.descriptors is None else template.descriptors.nbytes
+        return template.keypoints.nbytes + descriptors
+
+class MinutiaeEngine(FingerprintEngine):
+    """Minutiae templates of a few hundred bytes; comparisons are cheap enough to check every pilot."""
+    name = "minutiae"
+
+    def __init__(self, store=None):
+        from minutiae import MinutiaeStore
+        self.store = store or MinutiaeStore()
+
+    def verify(self, probe, gallery):
+        from minutiae import verify_minutiae
+        return verify_minutiae(probe, gallery)
+
+    def template_bytes(self, template):
+        return len(template.to_bytes())
+
+ENGINES = {engine.name: engine for engine in (OrbEngine, MinutiaeEngine)}
+
+def get_fingerprint_engine(name=ENGINE):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown fingerprint engine {name!r}; choose one of {', '.join(ENGINES)}.")
+    return ENGINES[name]()
+
+def finger_label(filename):
+    """Finger a sample image belongs to, from its name (arvind3.png -> arvind), or None if unnamed."""
+    return os.path.splitext(filename)[0].rstrip("0123456789") or None
+
+def compare_engines(directory_path, engines=None):
+    """Compare template size, speed and accuracy of the engines on a folder of labelled images.
+
+    Every pair of images whose names give a finger (see finger_label) is
+    verified; pairs of the same finger should match and all others not.
+    """
+    engines = engines or [engine() for engine in ENGINES.values()]
+    image_files = [f for f in sorted(os.listdir(directory_path)) if finger_label(f)]
+    images = {f: cv2.imread(os.path.join(directory_path, f), cv2.IMREAD_GRAYSCALE) for f in image_files}
+    pairs = list(itertools.combinations(image_files, 2))
+    genuine = sum(finger_label(a) == finger_label(b) for a, b in pairs)
+
+    print(f"{len(image_files)} images, {genuine} genuine and {len(pairs) - genuine} impostor pairs")
+    print(f"{'engine':<10}{'bytes':>8}{'extract ms':>12}{'match ms':>10}{'accepted':>10}{'false acc.':>12}")
+    summary = {}
+    for engine in engines:
+        start = time.perf_counter()
+        templates = {f: engine.extract(image) for f, image in images.items()}
+        extract_seconds = (time.perf_counter() - start) / len(images)
+        start = time.perf_counter()
+        results = {(a, b): engine.verify(templates[a], templates[b]) for a, b in pairs}
+        match_seconds = (time.perf_counter() - start) / len(pairs)
+        accepted = sum(r.match for (a, b), r in results.items() if finger_label(a) == finger_label(b))
+        false_accepts = sum(r.match for (a, b), r in results.items() if finger_label(a) != finger_label(b))
+        size = sum(engine.template_bytes(t) for t in templates.values()) / len(templates)
+        print(f"{engine.name:<10}{size:>8.0f}{extract_seconds * 1000:>12.1f}{match_seconds * 1000:>10.2f}"
+              f"{accepted:>6}/{genuine:<3}{false_accepts:>8}/{len(pairs) - genuine}")
+        summary[engine.name] = {"template_bytes": size, "extract_ms": extract_seconds * 1000,
+                                "match_ms": match_seconds * 1000, "genuine_accepted": accepted,
+                                "false_accepts": false_accepts}
+    return summary
+
+if __name__ == "__main__":
+    compare_engines(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints")
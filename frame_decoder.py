@@ -0,0 +1,54 @@
+import numpy as np
+
+FRAME_HEIGHT = 288
+FRAME_WIDTH = 256
+FRAME_SIZE = FRAME_HEIGHT * FRAME_WIDTH
+PACKED_SIZE = FRAME_SIZE // 2
+
+# The sensor sends two 4-bit pixels per byte, high nibble first. Row i of the
+# table holds the two 8-bit pixels that byte value i expands to.
+_values = np.arange(256, dtype=np.uint16)
+_UNPACK_TABLE = np.stack([_values & 0xF0, (_values & 0x0F) << 4], axis=1).astype(np.uint8)
+del _values
+
+def new_frame_buffer():
+    """Allocate a frame buffer that can be reused across calls to decode_frame."""
+    return np.empty((FRAME_HEIGHT, FRAME_WIDTH), np.uint8)
+
+def as_packed_array(payload):
+    """View a get_fpdata("image") payload (list, bytes or array) as a uint8 array."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        packed = np.frombuffer(payload, dtype=np.uint8)
+    else:
+        packed = np.asarray(payload, dtype=np.uint8)
+    if packed.size != PACKED_SIZE:
+        raise ValueError(f"Expected {PACKED_SIZE} bytes of image data, got {packed.size}.")
+    return packed.reshape(PACKED_SIZE)
+
+def decode_frame(payload, out=None):
+    """Unpack a 4-bit sensor image payload into a 288x256 uint8 frame.
+
+    If out is given it must be a C-contiguous 288x256 uint8 array; it is filled
+    in place and returned, so repeated captures can share one buffer.
+    """
+    packed = as_packed_array(payload)
+    if out is None:
+        out = new_frame_buffer()
+    elif out.shape != (FRAME_HEIGHT, FRAME_WIDTH) or out.dtype != np.uint8 or not out.flags.c_contiguous:
+        raise ValueError("Output buffer must be a contiguous 288x256 uint8 array.")
+    np.take(_UNPACK_TABLE, packed, axis=0, out=out.reshape(PACKED_SIZE, 2), mode="clip")
+    return out
+
+def encode_frame(frame):
+    """Pack a 288x256 uint8 frame into the sensor's 4-bit image payload; the inverse of decode_frame."""
+    frame = np.asarray(frame, dtype=np.uint8)
+    if frame.shape != (FRAME_HEIGHT, FRAME_WIDTH):
+        raise ValueError(f"Expected a {FRAME_HEIGHT}x{FRAME_WIDTH} frame, got {frame.shape}.")
+    pixels = frame.reshape(PACKED_SIZE, 2)
+    return ((pixels[:, 0] & 0xF0) | (pixels[:, 1] >> 4)).tobytes()
+
+def normalize_frame(frame):
+    """Stretch a frame to the full 0-255 range, as saving it with imsave(cmap='gray') did."""
+    low, high = int(frame.min()), int(frame.max())
+    table = np.clip(np.rint((np.arange(256) - low) * (255.0 / max(high - low, 1))), 0, 255).astype(np.uint8)
+    return table[frame]
@@ -0,0 +1,185 @@
+import os
+import sys
+import itertools
+import numpy as np
+import cv2
+
+# rigid: rotation and translation (3 DOF); similarity adds scale (4 DOF);
+# affine (6 DOF); homography (8 DOF, cv2.findHomography, the original check).
+# A finger pressed on a flat sensor only moves and turns, and slightly
+# changes scale with pressure; run this module on ./fingerprints to compare.
+MODELS = ("rigid", "similarity", "affine", "homography")
+GEOMETRY_MODEL = os.environ.get("FINGERPRINT_GEOMETRY", "similarity")
+# Set FINGERPRINT_ORIENTATION_FILTER=0 to skip the orientation consistency prefilter.
+ORIENTATION_FILTER = os.environ.get("FINGERPRINT_ORIENTATION_FILTER", "1") == "1"
+REPROJ_THRESHOLD = 5.0
+CONFIDENCE = 0.995
+MAX_ITERATIONS = 2000
+# Hypotheses drawn and scored together per RANSAC round.
+BATCH_SIZE = 64
+ORIENTATION_BINS = 12
+SAMPLE_SIZES = {"rigid": 2, "similarity": 2, "affine": 3}
+
+def orientation_filter(angles1, angles2, bins=ORIENTATION_BINS):
+    """Mask of the matches whose keypoint rotation agrees with the dominant one.
+
+    On a rigid or similarity transform every true match turns its keypoint
+    by the same angle. The rotations (degrees) are histogrammed and matches
+    in the fullest bin or its two neighbours are kept.
+    """
+    rotation = np.mod(np.asarray(angles2) - np.asarray(angles1), 360)
+    width = 360 / bins
+    bin_index = (rotation // width).astype(np.intp) % bins
+    peak = np.argmax(np.bincount(bin_index, minlength=bins))
+    offset = (bin_index - peak) % bins
+    return (offset <= 1) | (offset == bins - 1)
+
+def _fit_two_point(src, dst, scale):
+    """Rigid or similarity transforms, (B, 2, 3), from point pairs of shape (B, 2, 2)."""
+    v_src = src[:, 1] - src[:, 0]
+    v_dst = dst[:, 1] - dst[:, 0]
+    angle = np.arctan2(v_dst[:, 1], v_dst[:, 0]) - np.arctan2(v_src[:, 1], v_src[:, 0])
+    s = np.linalg.norm(v_dst, axis=1) / np.maximum(np.linalg.norm(v_src, axis=1), 1e-9) if scale else 1.0
+    cos, sin = s * np.cos(angle), s * np.sin(angle)
+    A = np.empty((len(src), 2, 3))
+    A[:, 0, 0], A[:, 0, 1], A[:, 1, 0], A[:, 1, 1] = cos, -sin, sin, cos
+    A[:, :, 2] = dst[:, 0] - np.einsum("bij,bj->bi", A[:, :, :2], src[:, 0])
+    return A
+
+def _fit_affine(src, dst):
+    """Affine transforms, (B, 2, 3), from point triples of shape (B, 3, 2); degenerate triples give NaN."""
+    X = np.concatenate([src, np.ones(src.shape[:2] + (1,))], axis=2)
+    A = np.full((len(src), 2, 3), np.nan)
+    ok = np.abs(np.linalg.det(X)) > 1e-6
+    A[ok] = np.linalg.solve(X[ok], dst[ok]).transpose(0, 2, 1)
+    return A
+
+def fit_model(src, dst, model):
+    """Least-squares fit of one transform to all the given correspondences. Returns a 2x3 matrix."""
+    if model == "affine":
+        X = np.hstack([src, np.ones((len(src), 1))])
+        return np.linalg.lstsq(X, dst, rcond=None)[0].T
+    # Umeyama: rotation from the SVD of the cross-covariance, scale only for similarity.
+    mean_src, mean_dst = src.mean(axis=0), dst.mean(axis=0)
+    centred_src, centred_dst = src - mean_src, dst - mean_dst
+    U, S, Vt = np.linalg.svd(centred_dst.T @ centred_src)
+    d = np.sign(np.linalg.det(U @ Vt))
+    R = U @ np.diag([1, d]) @ Vt
+    scale = (S[0] + d * S[1]) / max(float((centred_src ** 2).sum()), 1e-9) if model == "similarity" else 1.0
+    A = np.empty((2, 3))
+    A[:, :2] = scale * R
+    A[:, 2] = mean_dst - A[:, :2] @ mean_src
+    return A
+
+def _samples(rng, n, size):
+    """BATCH_SIZE random minimal samples of distinct point indices, (BATCH_SIZE, size)."""
+    if n > 256:
+        # Repeats are rare among many points and only waste a hypothesis.
+        return rng.integers(0, n, (BATCH_SIZE, size))
+    return np.argsort(rng.random((BATCH_SIZE, n)), axis=1)[:, :size]
+
+def _residuals(A, src, dst):
+    """Squared reprojection error of every point under every transform, (B, N)."""
+    x, y = src[:, 0], src[:, 1]
+    dx = A[:, 0, :1] * x + A[:, 0, 1:2] * y + (A[:, 0, 2:] - dst[:, 0])
+    dy = A[:, 1, :1] * x + A[:, 1, 1:2] * y + (A[:, 1, 2:] - dst[:, 1])
+    return dx * dx + dy * dy
+
+def ransac(src, dst, model, threshold=REPROJ_THRESHOLD, confidence=CONFIDENCE, max_iterations=MAX_ITERATIONS,
+           rng=None):
+    """Robustly fit a rigid, similarity or affine transform mapping src onto dst.
+
+    Hypotheses from random minimal samples are drawn and scored in batches
+    of BATCH_SIZE, all points against all hypotheses at once. The number of
+    iterations adapts to the best inlier ratio found so far, so clean
+    correspondences stop after a round or two. The best hypothesis is
+    refitted to its inliers. Returns (2x3 matrix, boolean inlier mask), or
+    (None, all-False mask) when nothing fits.
+    """
+    src = np.asarray(src, np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, np.float64).reshape(-1, 2)
+    n, sample_size = len(src), SAMPLE_SIZES[model]
+    if n < sample_size:
+        return None, np.zeros(n, bool)
+    rng = rng or np.random.default_rng(0)
+    threshold = threshold ** 2
+    best, best_count = None, 0
+    needed, iterations = max_iterations, 0
+    while iterations < min(needed, max_iterations):
+        samples = _samples(rng, n, sample_size)
+        if model == "affine":
+            A = _fit_affine(src[samples], dst[samples])
+        else:
+            A = _fit_two_point(src[samples], dst[samples], scale=model == "similarity")
+        errors = _residuals(A, src, dst)
+        counts = np.where(np.isnan(A).any(axis=(1, 2)), 0, (errors < threshold).sum(axis=1))
+        iterations += BATCH_SIZE
+        top = int(np.argmax(counts))
+        if counts[top] > best_count:
+            best, best_count = A[top], int(counts[top])
+            ratio = best_count / n
+            needed = MAX_ITERATIONS if ratio <= 0 else \
+                int(np.ceil(np.log(1 - confidence) / np.log(max(1 - ratio ** sample_size, 1e-12))))
+    if best is None or best_count < sample_size:
+        return None, np.zeros(n, bool)
+    inliers = _residuals(best[None], src, dst)[0] < threshold
+    refined = fit_model(src[inliers], dst[inliers], model)
+    refined_inliers = _residuals(refined[None], src, dst)[0] < threshold
+    if refined_inliers.sum() >= inliers.sum():
+        return refined, refined_inliers
+    return best, inliers
+
+def estimate_transform(src, dst, model=GEOMETRY_MODEL, threshold=REPROJ_THRESHOLD):
+    """Fit model to the correspondences. Returns (matrix or None, boolean inlier mask)."""
+    if model not in MODELS:
+        raise ValueError(f"Unknown geometry model {model!r}; choose one of {', '.join(MODELS)}.")
+    if model == "homography":
+        if len(src) < 4:
+            return None, np.zeros(len(src), bool)
+        M, mask = cv2.findHomography(np.asarray(src, np.float32).reshape(-1, 1, 2),
+                                     np.asarray(dst, np.float32).reshape(-1, 1, 2), cv2.RANSAC, threshold)
+        if M is None:
+            return None, np.zeros(len(src), bool)
+        return M, mask.ravel().astype(bool)
+    return ransac(src, dst, model, threshold)
+
+def compare_models(directory_path, models=MODELS):
+    """Accuracy, separation and speed of each model, with and without the orientation filter.
+
+    Pairs of images named after the same finger (see
+    fingerprint_engines.finger_label) should match and all others not. The
+    lowest genuine and highest impostor inlier counts show how far apart
+    the two are under each model; ms is per geometric check that ran.
+    """
+    from template_store import TemplateStore
+    from verification import verify_templates
+    from fingerprint_engines import finger_label
+    template_store = TemplateStore()
+    image_files = [f for f in sorted(os.listdir(directory_path)) if finger_label(f)]
+    templates = {f: template_store.get(os.path.join(directory_path, f)) for f in image_files}
+    pairs = list(itertools.combinations(image_files, 2))
+    genuine = sum(finger_label(a) == finger_label(b) for a, b in pairs)
+    print(f"{len(pairs)} pairs, {genuine} genuine")
+    print(f"{'model':<12}{'filter':>7}{'accepted':>10}{'false acc.':>12}{'min genuine':>13}{'max impostor':>14}{'ms':>7}")
+    for model, orientation in itertools.product(models, (False, True)):
+        accepted = false_accepts = checks = 0
+        genuine_inliers, impostor_inliers = [], []
+        seconds = 0.0
+        for a, b in pairs:
+            result = verify_templates(templates[a], templates[b], model=model, orientation=orientation)
+            if "ransac" in result.timings:
+                checks += 1
+                seconds += result.timings["ransac"] + result.timings.get("orientation", 0.0)
+            if finger_label(a) == finger_label(b):
+                accepted += result.match
+                if result.match:
+                    genuine_inliers.append(result.inliers)
+            else:
+                false_accepts += result.match
+                impostor_inliers.append(result.inliers)
+        print(f"{model:<12}{'on' if orientation else 'off':>7}{accepted:>7}/{genuine:<3}"
+              f"{false_accepts:>8}/{len(pairs) - genuine:<4}{min(genuine_inliers, default=0):>13}"
+              f"{max(impostor_inliers, default=0):>14}{seconds * 1000 / max(checks, 1):>7.2f}")
+
+if __name__ == "__main__":
+    compare_models(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints")
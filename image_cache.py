@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import instrumentation
+
+CACHE_DIR = "downloaded_images"
+MAX_ENTRIES = 64
+MANIFEST = "manifest.json"
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+class ImageCache:
+    """Content-addressed, LRU-bounded cache of the fingerprint images downloaded at signin.
+
+    Images are stored as <sha256>.png exactly as the API sent them, and a
+    manifest maps each username to the hash of its current image, so signin
+    can send that hash and the API only returns the image when it changed.
+    Entries survive logout. When more than max_entries images are cached the
+    least recently used ones are deleted and on_evict(hash) is called, e.g.
+    to drop their cached templates.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_entries=MAX_ENTRIES, on_evict=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._users = {}
+        self._last_used = {}
+        self._load()
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def lookup(self, username):
+        """Hash of the cached image of username, or None if there is no usable copy."""
+        with self._lock:
+            digest = self._users.get(username)
+            if digest is None or not os.path.exists(self.path_for(digest)):
+                return None
+            return digest
+
+    def get(self, username):
+        """Path of the cached image of username, marking it as recently used."""
+        with self._lock:
+            digest = self._users.get(username)
+            if digest is None or not os.path.exists(self.path_for(digest)):
+                return None
+            self._last_used[digest] = time.time()
+            self._save()
+            return self.path_for(digest)
+
+    def put(self, username, data):
+        """Store the encoded image bytes for username and return their path."""
+        digest = content_hash(data)
+        path = self.path_for(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with instrumentation.span("image.write", bytes=len(data)), open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._users[username] = digest
+            self._last_used[digest] = time.time()
+            evicted = self._evict()
+            self._save()
+        # Called without the lock, so the callback may use the cache.
+        if self.on_evict is not None:
+            for digest in evicted:
+                self.on_evict(digest)
+        return path
+
+    def _evict(self):
+        """Delete the least recently used images beyond max_entries and return their hashes."""
+        excess = len(self._last_used) - self.max_entries
+        if excess <= 0:
+            return []
+        evicted = sorted(self._last_used, key=self._last_used.get)[:excess]
+        for digest in evicted:
+            del self._last_used[digest]
+            self._users = {user: d for user, d in self._users.items() if d != digest}
+            if os.path.exists(self.path_for(digest)):
+                os.remove(self.path_for(digest))
+        return evicted
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._users = dict(manifest.get("users", {}))
+        self._last_used = {digest: float(t) for digest, t in manifest.get("last_used", {}).items()}
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"users": self._users, "last_used": self._last_used}, f)
+        os.replace(tmp_path, path)
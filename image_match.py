@@ -1,96 +1,195 @@
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
 import os
+import sys
+import time
+import argparse
+from stat import S_ISREG
+import multiprocessing
+from template_store import TemplateStore
+from verification import verify_templates
+from match_matrix import MatchMatrix, matrix_path
 
-def load_image(path):
-    """Load an image from the specified file path and convert it to grayscale."""
-    image = cv2.imread(path)
-    if image is None:
-        raise FileNotFoundError(f"Image at path {path} not found.")
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    return gray_image
-
-def detect_and_compute(image):
-    """Detect key points and compute descriptors using ORB."""
-    orb = cv2.ORB_create(nfeatures=1500)
-    keypoints, descriptors = orb.detectAndCompute(image, None)
-    return keypoints, descriptors
-
-def match_descriptors(descriptors1, descriptors2):
-    """Match descriptors using BFMatcher with a ratio test."""
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING)
-    matches = bf.knnMatch(descriptors1, descriptors2, k=2)
+PAIR_CHUNK_SIZE = 256
+
+# Per-process state of the directory matcher's worker pool.
+_worker_store = None
+_worker_templates = {}
+_worker_min_match_count = 10
+
+def _init_worker(store_directory, nfeatures, preprocessing, min_match_count):
+    global _worker_store, _worker_min_match_count
+    _worker_store = TemplateStore(directory=store_directory, nfeatures=nfeatures, preprocessing=preprocessing)
+    _worker_min_match_count = min_match_count
+
+def _featurize(image_path):
+    """Extract and cache the template of one image. Returns (path, key, error)."""
+    try:
+        key, _ = _worker_store.add(image_path)
+        return image_path, key, None
+    except Exception as e:
+        return image_path, None, e
+
+def _worker_template(key):
+    template = _worker_templates.get(key)
+    if template is None:
+        template = _worker_templates[key] = _worker_store.load(key)
+    return template
+
+def _match_unit(unit):
+    """Compare one image against a run of other images. Returns (results, errors).
+
+    results holds (key1, key2, match, inliers) for every pair compared.
+    """
+    key1, others = unit
+    results, errors = [], []
+    template1 = _worker_template(key1)
+    for key2 in others:
+        try:
+            result = verify_templates(template1, _worker_template(key2), _worker_min_match_count)
+            results.append((key1, key2, result.match, result.inliers))
+        except Exception as e:
+            errors.append((key1, key2, e))
+    return results, errors
+
+def _pair_units(pending, chunk_size):
+    """Split the pending rows of the pair matrix into runs of at most chunk_size pairs."""
+    for key1, others in pending:
+        for start in range(0, len(others), chunk_size):
+            yield key1, others[start:start + chunk_size]
+
+def _scan(directory_path):
+    """os.stat of every file in a directory, by name."""
+    stats = {}
+    for image_file in sorted(os.listdir(directory_path)):
+        stat = os.stat(os.path.join(directory_path, image_file))
+        if S_ISREG(stat.st_mode):
+            stats[image_file] = stat
+    return stats
+
+def sync_match_matrix(pool, directory_path, matrix, template_store, stats=None):
+    """Bring the matrix's rows in line with the directory, featurizing only new or changed files."""
+    stats = _scan(directory_path) if stats is None else stats
+    keys = {}
+    changed = []
+    for image_file, stat in stats.items():
+        key = matrix.cached_key(image_file, stat)
+        # The template may have been pruned from the cache, or extracted with other settings.
+        if key is None or not key.endswith(template_store.params_key) or not os.path.exists(template_store.path_for(key)):
+            changed.append(image_file)
+        else:
+            keys[image_file] = key
+    paths = [os.path.join(directory_path, image_file) for image_file in changed]
+    for image_file, (_, key, error) in zip(changed, pool.imap(_featurize, paths)):
+        if error is not None:
+            print(f"Error processing {image_file}: {error}")
+        else:
+            keys[image_file] = key
+    matrix.set_files({image_file: (stats[image_file], key) for image_file, key in sorted(keys.items())})
+
+def compare_pending(pool, matrix, chunk_size=PAIR_CHUNK_SIZE):
+    """Compare the pairs the matrix has no result for and yield (image1, image2, inliers) for new matches.
+
+    The matrix is saved when done, or when interrupted, so finished pairs
+    are not compared again.
+    """
+    names = matrix.names_by_key()
+    try:
+        for results, errors in pool.imap_unordered(_match_unit, _pair_units(matrix.pending(), chunk_size)):
+            for key1, key2, error in errors:
+                print(f"Error processing {names[key1][0]} and {names[key2][0]}: {error}")
+            for key1, key2, match, inliers in results:
+                matrix.record(key1, key2, match, inliers)
+                if not match:
+                    continue
+                for image1 in names[key1]:
+                    for image2 in names[key2]:
+                        # A key paired with itself means identical files; report each pair once.
+                        if key1 != key2 or image1 < image2:
+                            yield min(image1, image2), max(image1, image2), inliers
+    finally:
+        matrix.save()
+
+def _open_pool(template_store, min_match_count, workers):
+    initargs = (template_store.directory, template_store.nfeatures, template_store.preprocessing, min_match_count)
+    return multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs)
+
+def match_fingerprints_in_directory(directory_path, min_match_count=10, workers=None,
+                                    chunk_size=PAIR_CHUNK_SIZE, template_store=None, matrix=None):
+    """Match all fingerprint images in a directory.
+
+    Results are kept in a MatchMatrix (by default match_cache/, one per
+    folder), so a rerun only featurizes new or changed images and only
+    compares the pairs involving them. (image1, image2, inliers) is yielded
+    for every matching pair: first those already known, then new ones as
+    their work units finish on the process pool.
+    """
+    if template_store is None:
+        template_store = TemplateStore()
+    if matrix is None:
+        matrix = MatchMatrix(matrix_path(directory_path), min_match_count)
     
-    # Apply ratio test
-    good_matches = []
-    for m, n in matches:
-        if m.distance < 0.75 * n.distance:
-            good_matches.append(m)
-    return good_matches
-
-def verify_fingerprints(image1, image2, min_match_count=10):
-    """Verify if two fingerprint images match."""
-    # Detect key points and compute descriptors
-    keypoints1, descriptors1 = detect_and_compute(image1)
-    keypoints2, descriptors2 = detect_and_compute(image2)
+    with _open_pool(template_store, min_match_count, workers) as pool:
+        sync_match_matrix(pool, directory_path, matrix, template_store)
+        yield from matrix.matching_pairs()
+        yield from compare_pending(pool, matrix, chunk_size)
+
+def watch_directory(directory_path, min_match_count=10, workers=None, interval=2.0,
+                    template_store=None, matrix=None):
+    """Match images against the rest of the folder as they arrive. Yields (image1, image2, inliers) for new matches.
+
+    The folder is polled every interval seconds; changes are processed once
+    a poll sees the same listing as the one before, so files still being
+    copied are not read half written. Runs until interrupted.
+    """
+    if template_store is None:
+        template_store = TemplateStore()
+    if matrix is None:
+        matrix = MatchMatrix(matrix_path(directory_path), min_match_count)
     
-    if descriptors1 is None or descriptors2 is None:
-        return False, 0
+    def snapshot(stats):
+        return {name: (stat.st_size, stat.st_mtime_ns) for name, stat in stats.items()}
     
-    # Match descriptors
-    matches = match_descriptors(descriptors1, descriptors2)
+    with _open_pool(template_store, min_match_count, workers) as pool:
+        seen = None
+        previous = None
+        while True:
+            stats = _scan(directory_path)
+            current = snapshot(stats)
+            if current != seen and current == previous:
+                sync_match_matrix(pool, directory_path, matrix, template_store, stats)
+                yield from compare_pending(pool, matrix)
+                seen = current
+            previous = current
+            time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the matching pairs among the fingerprint images of a folder.")
+    parser.add_argument("directory", nargs="?", default="./fingerprints")
+    parser.add_argument("--watch", action="store_true", help="keep matching new images as they are added")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between polls in watch mode")
+    parser.add_argument("--rebuild", action="store_true", help="discard the stored results and compare every pair")
+    args = parser.parse_args(argv)
+
+    if args.rebuild and os.path.exists(matrix_path(args.directory)):
+        os.remove(matrix_path(args.directory))
     
-    # Ensure there are enough matches
-    if len(matches) > min_match_count:
-        # Extract location of good matches
-        src_pts = np.float32([keypoints1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([keypoints2[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-        
-        # Compute homography using RANSAC
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-        matches_mask = mask.ravel().tolist()
-        
-        # Verify the match using the homography matrix
-        if M is not None and sum(matches_mask) > min_match_count:
-            out = cv2.drawMatches(image1, keypoints1, image2, keypoints2, matches, None, 
-                                  matchesMask=matches_mask, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-            plt.imshow(out)
-            plt.show()
-            return True, sum(matches_mask)
-    return False, 0
-
-def match_fingerprints_in_directory(directory_path):
-    """Match all fingerprint images in a directory."""
-    image_files = os.listdir(directory_path)
-    matched_images = []
+    if args.watch:
+        print(f"Watching {args.directory}; press Ctrl+C to stop.")
+        try:
+            for image1, image2, num_matches in watch_directory(args.directory, interval=args.interval):
+                print(f"{image1} and {image2} match with {num_matches} good matches.", flush=True)
+        except KeyboardInterrupt:
+            pass
+        return
     
-    # Iterate through each pair of images
-    for i in range(len(image_files)):
-        for j in range(i + 1, len(image_files)):
-            image_path1 = os.path.join(directory_path, image_files[i])
-            image_path2 = os.path.join(directory_path, image_files[j])
-            
-            try:
-                image1 = load_image(image_path1)
-                image2 = load_image(image_path2)
-                
-                match, num_matches = verify_fingerprints(image1, image2)
-                if match:
-                    matched_images.append((image_files[i], image_files[j], num_matches))
-                    
-            except Exception as e:
-                print(f"Error processing {image_files[i]} and {image_files[j]}: {e}")
+    num_matched = 0
+    for image1, image2, num_matches in match_fingerprints_in_directory(args.directory):
+        if not num_matched:
+            print("Matched fingerprint pairs:")
+        num_matched += 1
+        print(f"{image1} and {image2} match with {num_matches} good matches.")
     
-    return matched_images
+    if not num_matched:
+        print("No matching fingerprints found.")
 
 if __name__ == "__main__":
-    directory_path = "./fingerprints"
-    matched_images = match_fingerprints_in_directory(directory_path)
-    
-    if matched_images:
-        print("Matched fingerprint pairs:")
-        for image1, image2, num_matches in matched_images:
-            print(f"{image1} and {image2} match with {num_matches} good matches.")
-    else:
-        print("No matching fingerprints found.")
+    main(sys.argv[1:])
@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+from collections import deque
+
+# Enabled with --trace (or --dump-histograms) on the command line or FINGERPRINT_TRACE=1.
+# Disabled, span() returns a shared do-nothing context and count() returns at once.
+enabled = ("--trace" in sys.argv or "--dump-histograms" in sys.argv
+           or os.environ.get("FINGERPRINT_TRACE") == "1")
+TRACE_DIR = os.environ.get("FINGERPRINT_TRACE_DIR", "traces")
+# Durations kept per span name for the rolling histograms.
+HISTORY = 1000
+# Events kept in memory for the Chrome trace; the JSON lines file has all of them.
+MAX_EVENTS = 100000
+# Queued events are written every WRITE_INTERVAL seconds, or sooner once WRITE_BATCH are waiting.
+WRITE_INTERVAL = 1.0
+WRITE_BATCH = 1000
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+PERCENTILES = (50, 95, 99)
+
+_origin = time.perf_counter()
+_epoch = time.time() - _origin
+_lock = threading.Lock()
+# Serializes writers of the JSON lines file; never taken while recording.
+_write_lock = threading.Lock()
+_wake = threading.Event()
+_writer = None
+_pending = []
+_events = deque(maxlen=MAX_EVENTS)
+_durations = {}
+_threads = {}
+counters = {}
+_jsonl = None
+_run_name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """A timed section; args end up in the trace next to its duration."""
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        record(self.name, self.start, time.perf_counter() - self.start, **self.args)
+        return False
+
+    def set(self, **args):
+        """Add args known only inside the span, e.g. a result count."""
+        self.args.update(args)
+
+def span(name, **args):
+    """Time a with-block as name (dotted, stage first: "capture.decode")."""
+    if not enabled:
+        return _NULL_SPAN
+    return Span(name, args)
+
+def record(name, start, seconds, **args):
+    """Record a span measured elsewhere; start is a time.perf_counter() value."""
+    if not enabled:
+        return
+    thread = threading.current_thread()
+    event = {"type": "span", "name": name, "start": start, "seconds": seconds, "thread": thread.ident, "args": args}
+    with _lock:
+        if thread.ident not in _threads:
+            _threads[thread.ident] = thread.name
+            _pending.append({"type": "thread", "thread": thread.ident, "name": thread.name, "start": start})
+        _events.append(event)
+        _durations.setdefault(name, deque(maxlen=HISTORY)).append(seconds)
+        _pending.append(event)
+    _wake_writer()
+
+def count(name, value=1):
+    """Add value to the counter name."""
+    if not enabled:
+        return
+    with _lock:
+        total = counters[name] = counters.get(name, 0) + value
+        event = {"type": "counter", "name": name, "start": time.perf_counter(), "value": value, "total": total}
+        _events.append(event)
+        _pending.append(event)
+    _wake_writer()
+
+def _wake_writer():
+    # Recording only queues events; a background thread appends them to the file.
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_loop, name="trace-writer", daemon=True)
+                _writer.start()
+    if len(_pending) >= WRITE_BATCH:
+        _wake.set()
+
+def _write_loop():
+    while True:
+        _wake.wait(WRITE_INTERVAL)
+        _wake.clear()
+        flush()
+
+def flush():
+    """Append the events recorded since the last flush to the JSON lines file."""
+    global _jsonl
+    with _write_lock:
+        with _lock:
+            events = list(_pending)
+            _pending.clear()
+        if not events:
+            return
+        if _jsonl is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            _jsonl = open(os.path.join(TRACE_DIR, f"trace-{_run_name}.jsonl"), "a")
+        lines = []
+        for event in events:
+            line = dict(event, start=round(_epoch + event["start"], 6))
+            if "seconds" in line:
+                line["ms"] = round(line.pop("seconds") * 1000, 3)
+            lines.append(json.dumps(line, default=str) + "\n")
+        _jsonl.writelines(lines)
+        _jsonl.flush()
+
+def summarize(durations_ms):
+    """Count, mean, percentiles, max and bucket counts of a list of durations in milliseconds."""
+    values = sorted(durations_ms)
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean_ms": sum(values) / len(values), "max_ms": values[-1]}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = values[min(len(values) - 1, int(len(values) * p / 100))]
+    buckets = [0] * (len(BUCKETS_MS) + 1)
+    for value in values:
+        buckets[sum(value > bound for bound in BUCKETS_MS)] += 1
+    summary["buckets"] = buckets
+    return summary
+
+def histograms():
+    """Summaries of the last HISTORY durations of every span name."""
+    with _lock:
+        durations = {name: [seconds * 1000 for seconds in values] for name, values in _durations.items()}
+    return {name: summarize(values) for name, values in sorted(durations.items())}
+
+def format_histograms(summaries, counter_totals=None):
+    """Format histograms() (and counter totals) as a table."""
+    lines = [f"{'span':<32}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  ms"]
+    for name, summary in summaries.items():
+        lines.append(f"{name:<32}{summary['count']:>7}{summary['mean_ms']:>9.1f}{summary['p50_ms']:>9.1f}"
+                     f"{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}{summary['max_ms']:>9.1f}")
+        bounds = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        filled = [f"{bound}:{n}" for bound, n in zip(bounds, summary["buckets"]) if n]
+        lines.append(f"{'':<32}{' '.join(filled)}")
+    for name, total in sorted((counter_totals or {}).items()):
+        lines.append(f"{name:<32}{total:>7} (counter)")
+    return "\n".join(lines)
+
+def dump_histograms(path=None):
+    """Write the current histograms and counters to path (by default in TRACE_DIR). Returns (path, text)."""
+    with _lock:
+        counter_totals = dict(counters)
+    text = format_histograms(histograms(), counter_totals)
+    path = path or os.path.join(TRACE_DIR, f"histograms-{_run_name}.txt")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text + "\n")
+    return path, text
+
+def chrome_trace(events, threads=None, start_offset=0.0):
+    """Convert span and counter events to the Chrome trace format (chrome://tracing, Perfetto)."""
+    pid = os.getpid()
+    trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+             for tid, name in (threads or {}).items()]
+    for event in events:
+        ts = (event["start"] - start_offset) * 1e6
+        if event["type"] == "span":
+            trace.append({"name": event["name"], "cat": event["name"].split(".")[0], "ph": "X", "ts": ts,
+                          "dur": event["seconds"] * 1e6, "pid": pid, "tid": event["thread"],
+                          "args": event["args"]})
+        else:
+            trace.append({"name": event["name"], "ph": "C", "ts": ts, "pid": pid,
+                          "args": {event["name"]: event["total"]}})
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+def export_chrome_trace(path=None):
+    """Write the events still in memory as a Chrome trace file and return its path."""
+    with _lock:
+        events, threads = list(_events), dict(_threads)
+    path = path or os.path.join(TRACE_DIR, f"trace-{_run_name}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(chrome_trace(events, threads, _origin), f, default=str)
+    return path
+
+def reset():
+    with _lock:
+        _events.clear()
+        _durations.clear()
+        counters.clear()
+
+def _at_exit():
+    if not _events:
+        return
+    flush()
+    print(f"[trace] Chrome trace written to {export_chrome_trace()}")
+    if "--dump-histograms" in sys.argv:
+        path, text = dump_histograms()
+        print(text)
+        print(f"[trace] Histograms written to {path}")
+    if _jsonl is not None:
+        _jsonl.close()
+
+if enabled:
+    atexit.register(_at_exit)
+
+def load_jsonl(path):
+    """Read a trace JSON lines file back into events (start in epoch seconds)."""
+    events, threads = [], {}
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            if event["type"] == "thread":
+                threads[event["thread"]] = event["name"]
+                continue
+            if "ms" in event:
+                event["seconds"] = event.pop("ms") / 1000
+            events.append(event)
+    return events, threads
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a trace JSON lines file written with --trace.")
+    parser.add_argument("trace", help="traces/trace-*.jsonl")
+    parser.add_argument("--chrome", metavar="PATH", help="also convert it to a Chrome trace file")
+    parser.add_argument("--last", type=int, default=HISTORY,
+                        help=f"durations per span name to summarize (default {HISTORY})")
+    args = parser.parse_args(argv)
+
+    events, threads = load_jsonl(args.trace)
+    durations, counter_totals = {}, {}
+    for event in events:
+        if event["type"] == "span":
+            durations.setdefault(event["name"], deque(maxlen=args.last)).append(event["seconds"] * 1000)
+        else:
+            counter_totals[event["name"]] = event["total"]
+    print(format_histograms({name: summarize(values) for name, values in sorted(durations.items())}, counter_totals))
+    if args.chrome:
+        start = min((event["start"] for event in events), default=0.0)
+        with open(args.chrome, "w") as f:
+            json.dump(chrome_trace(events, threads, start), f, default=str)
+        print(f"Chrome trace written to {args.chrome}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import cv2
+from simulated_sensor import SimulatedSensor, OK
+from sensor_session import SensorSession
+from capture_service import POLL_INTERVAL
+from frame_decoder import decode_frame, normalize_frame
+from template_store import TemplateStore
+from descriptor_index import DescriptorIndex
+from match_cascade import MatchCascade
+from verification import verify_templates
+
+PERCENTILES = (50, 95, 99)
+GALLERY_SIZES = (10, 50, 100)
+IDENTIFY_SHORTLIST = 3
+SENSOR_STAGES = ("sensor_wait", "transfer")
+
+def summarize(samples):
+    """Percentiles and mean, in milliseconds, of a list of durations in seconds."""
+    values = np.asarray(samples, np.float64) * 1000
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary["mean"] = float(values.mean())
+    summary["count"] = len(values)
+    return summary
+
+def summarize_trials(trials):
+    """Aggregate per-trial stage timings into latency percentiles and throughput."""
+    stages = {}
+    for trial in trials:
+        for name, seconds in trial.items():
+            stages.setdefault(name, []).append(seconds)
+    totals = [sum(trial.values()) for trial in trials]
+    decision = [sum(seconds for name, seconds in trial.items() if name not in SENSOR_STAGES) for trial in trials]
+    return {
+        "trials": len(trials),
+        "stages_ms": {name: summarize(samples) for name, samples in stages.items()},
+        "total_ms": summarize(totals),
+        "throughput_per_s": len(trials) / sum(totals),
+        "decision_throughput_per_s": len(trials) / sum(decision),
+    }
+
+def load_frames(directory_path):
+    paths = sorted(os.path.join(directory_path, f) for f in os.listdir(directory_path))
+    frames = [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in paths]
+    return [frame for frame in frames if frame is not None]
+
+def build_gallery(frames, size, template_store, seed=0):
+    """Templates for a gallery of the given size.
+
+    The sample images are used first; larger galleries are filled with
+    randomly rotated and shifted copies so every entry has its own keypoints.
+    """
+    rng = np.random.default_rng(seed)
+    templates = []
+    for i in range(size):
+        frame = frames[i % len(frames)]
+        if i >= len(frames):
+            height, width = frame.shape
+            M = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-20, 20), 1.0)
+            M[:, 2] += rng.uniform(-15, 15, 2)
+            frame = cv2.warpAffine(frame, M, (width, height), borderValue=255)
+        templates.append(template_store.extract(frame))
+    return templates
+
+def capture(session, trial):
+    """Capture and decode one frame, the same way CaptureService does."""
+    finger = session.finger
+    start = time.perf_counter()
+    while finger.get_image() != OK:
+        time.sleep(POLL_INTERVAL)
+    trial["sensor_wait"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    payload = session.upload_image()
+    trial["transfer"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frame = decode_frame(payload)
+    trial["decode"] = time.perf_counter() - start
+    return frame
+
+def probe_template(frame, template_store, trial):
+    """Featurize a captured frame in memory the way identify_frame does."""
+    start = time.perf_counter()
+    image = normalize_frame(frame)
+    trial["normalize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template = template_store.extract(image)
+    trial["extract"] = time.perf_counter() - start
+    return template
+
+def add_timings(trial, timings):
+    for name, seconds in timings.items():
+        trial[name] = trial.get(name, 0.0) + seconds
+
+def run_verify(session, gallery, template_store, iterations):
+    """1:1 verification of each capture against one gallery template."""
+    trials = []
+    for i in range(iterations):
+        trial = {}
+        probe = probe_template(capture(session, trial), template_store, trial)
+        add_timings(trial, verify_templates(probe, gallery[i % len(gallery)]).timings)
+        trials.append(trial)
+    return trials
+
+def run_identify(session, gallery, template_store, iterations):
+    """1:N identification: index shortlist, then cascade verification, as in identify_frame."""
+    index = DescriptorIndex(path=None)
+    for label, template in enumerate(gallery):
+        index.add(label, template.descriptors, save=False)
+    cascade = MatchCascade()
+    trials = []
+    for _ in range(iterations):
+        trial = {}
+        probe = probe_template(capture(session, trial), template_store, trial)
+        start = time.perf_counter()
+        shortlist = index.query(probe.descriptors, limit=IDENTIFY_SHORTLIST)
+        trial["index_query"] = time.perf_counter() - start
+        for label, votes in shortlist:
+            result = cascade.verify(probe, gallery[int(label)])
+            add_timings(trial, result.timings)
+            if result.match:
+                break
+        trials.append(trial)
+    return trials
+
+def run_api(api_url, username, password, iterations):
+    """Round trips of the signin request through the pooled APIClient."""
+    from api_client import APIClient
+    client = APIClient(api_url)
+    for _ in range(iterations):
+        client.signin(username, password)
+    client.close()
+    return [{"api": timing["seconds"]} for timing in client.timings]
+
+def run_benchmark(args):
+    frames = load_frames(args.images)
+    template_store = TemplateStore()
+    sensor = SimulatedSensor(frames, baudrate=args.baudrate, packet_size=args.packet_size,
+                             touch_delay=args.touch_delay, time_scale=args.time_scale)
+    session = SensorSession(factory=lambda: sensor)
+    gallery_sizes = [int(size) for size in args.gallery_sizes.split(",") if size]
+    results = []
+    gallery = build_gallery(frames, max(gallery_sizes + [len(frames)]), template_store)
+    print("verify 1:1", file=sys.stderr)
+    results.append(dict(scenario="verify", gallery_size=1,
+                        **summarize_trials(run_verify(session, gallery, template_store, args.iterations))))
+    for size in gallery_sizes:
+        print(f"identify 1:{size}", file=sys.stderr)
+        trials = run_identify(session, gallery[:size], template_store, args.iterations)
+        results.append(dict(scenario="identify", gallery_size=size, **summarize_trials(trials)))
+    if args.api_url:
+        print("api round trip", file=sys.stderr)
+        results.append(dict(scenario="api", gallery_size=0,
+                            **summarize_trials(run_api(args.api_url, args.api_username, args.api_password,
+                                                       args.iterations))))
+    return {
+        "config": {name: value for name, value in vars(args).items() if name != "api_password"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "opencv": cv2.__version__, "numpy": np.__version__, "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+def format_report(report):
+    lines = []
+    for result in report["results"]:
+        total = result["total_ms"]
+        lines.append(f"{result['scenario']} (gallery {result['gallery_size']}): p50 {total['p50']:.1f} ms, "
+                     f"p95 {total['p95']:.1f} ms, p99 {total['p99']:.1f} ms, "
+                     f"{result['throughput_per_s']:.2f}/s ({result['decision_throughput_per_s']:.2f}/s without the sensor)")
+        for name, stage in result["stages_ms"].items():
+            lines.append(f"    {name:<14}p50 {stage['p50']:>9.2f}  p95 {stage['p95']:>9.2f}  p99 {stage['p99']:>9.2f} ms")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture-to-decision latency benchmark on a simulated sensor.")
+    parser.add_argument("--images", default="./fingerprints", help="frames replayed by the simulated sensor")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--gallery-sizes", default=",".join(map(str, GALLERY_SIZES)))
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--packet-size", type=int, default=256, choices=(32, 64, 128, 256))
+    parser.add_argument("--touch-delay", type=float, default=0.0, help="seconds until the finger is placed")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="UART timing factor, 0 for no sensor delays")
+    parser.add_argument("--api-url", help="also time signin requests to the API at this base URL")
+    parser.add_argument("--api-username", default="")
+    parser.add_argument("--api-password", default="")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    print(format_report(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
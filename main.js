@@ -6,6 +6,7 @@ const session = require('express-session');
 const multer = require('multer');
 const fs = require('fs');
 const path = require('path');
+const crypto = require('crypto');
 
 const app = express();
 const port = 3000;
@@ -51,8 +52,20 @@ db.serialize(() => {
         pilotid INTEGER PRIMARY KEY,
         address TEXT,
         fingerprint_image_path TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        fingerprint_quality REAL,
+        fingerprint_template_path TEXT,
+        fingerprint_template_params TEXT
     )`);
+    // Databases created before capture quality scores and fused templates existed lack the columns.
+    const added = { fingerprint_quality: 'REAL', fingerprint_template_path: 'TEXT', fingerprint_template_params: 'TEXT' };
+    for (const [column, type] of Object.entries(added)) {
+        db.run(`ALTER TABLE fingerprints ADD COLUMN ${column} ${type}`, err => {
+            if (err && !err.message.includes('duplicate column')) {
+                console.error(`Error adding ${column} column:`, err);
+            }
+        });
+    }
 });
 
 // Example endpoint
@@ -108,16 +121,32 @@ app.post('/api/signin', (req, res) => {
                 return res.status(500).json({ error: 'Error reading fingerprint image' });
             }
 
-            const fingerprint_image_base64 = data.toString('base64');
-
-            res.status(200).json({
+            const fingerprint_hash = crypto.createHash('sha256').update(data).digest('hex');
+            const response = {
                 token: token,
-                fingerprint_image: fingerprint_image_base64,
+                fingerprint_hash: fingerprint_hash,
                 username: user.username,
                 droneid: user.droneid,
                 pilotid: user.pilotid,
-                address: user.address
-            });
+                address: user.address,
+                fingerprint_quality: user.fingerprint_quality
+            };
+
+            // Clients send the hash of their cached copy; the image is only sent when it changed.
+            if (req.body.fingerprint_hash !== fingerprint_hash) {
+                response.fingerprint_image = data.toString('base64');
+                // A multi-impression enrollment also has the template fused from all impressions.
+                if (user.fingerprint_template_path) {
+                    try {
+                        response.fingerprint_template = fs.readFileSync(user.fingerprint_template_path).toString('base64');
+                        response.fingerprint_template_params = user.fingerprint_template_params;
+                    } catch (err) {
+                        console.error('Error reading fingerprint template:', err);
+                    }
+                }
+            }
+
+            res.status(200).json(response);
         });
     });
 });
@@ -147,23 +176,27 @@ app.get('/api/fingerprint/retrieve/:pilotid', (req, res) => {
     });
 });
 
-// Endpoint to insert new fingerprint data
-app.post('/api/fingerprint/insert', upload.single('fingerprint_image'), (req, res) => {
-    const { username, password, droneid, pilotid, address } = req.body;
-    const fingerprint_image_path = req.file ? req.file.path : null;
-    let newFilePath = fingerprint_image_path; // Initialize newFilePath with fingerprint_image_path
-
-    // Capture original filename if available
-    const original_filename = req.file ? req.file.originalname : null;
-
-    // Move uploaded file to destination with original filename
-    if (fingerprint_image_path && original_filename) {
-        newFilePath = path.join('./uploads', original_filename);
-        fs.renameSync(fingerprint_image_path, newFilePath); // Rename the file to the original filename
+// Move an uploaded file to ./uploads under its original filename and return the new path.
+function keepUpload(file) {
+    if (!file) {
+        return null;
     }
-
-    db.run('INSERT INTO fingerprints (username, password, droneid, pilotid, address, fingerprint_image_path) VALUES (?, ?, ?, ?, ?, ?)',
-        [username, password, droneid, pilotid, address, newFilePath],
+    const newFilePath = path.join('./uploads', file.originalname);
+    fs.renameSync(file.path, newFilePath); // Rename the file to the original filename
+    return newFilePath;
+}
+
+// Endpoint to insert new fingerprint data; fingerprint_template is the optional fused template.
+const insertFields = upload.fields([{ name: 'fingerprint_image', maxCount: 1 }, { name: 'fingerprint_template', maxCount: 1 }]);
+app.post('/api/fingerprint/insert', insertFields, (req, res) => {
+    const { username, password, droneid, pilotid, address, quality, template_params } = req.body;
+    const files = req.files || {};
+    const newFilePath = keepUpload(files.fingerprint_image && files.fingerprint_image[0]);
+    const templatePath = keepUpload(files.fingerprint_template && files.fingerprint_template[0]);
+
+    db.run('INSERT INTO fingerprints (username, password, droneid, pilotid, address, fingerprint_image_path, fingerprint_quality, fingerprint_template_path, fingerprint_template_params) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [username, password, droneid, pilotid, address, newFilePath, quality === undefined ? null : Number(quality),
+         templatePath, templatePath ? template_params : null],
         function (err) {
             if (err) {
                 console.error('Error inserting fingerprint data:', err);
@@ -1,48 +1,195 @@
+import startup_profile
+import instrumentation
 import os
 import json
-import numpy as np
-from matplotlib import pyplot as plt
-import serial
-import requests
+import time
+import functools
+import threading
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
-from PIL import Image
 import base64
-from io import BytesIO
-import adafruit_fingerprint
-import cv2
-import shutil
-
-uart = serial.Serial("COM4", baudrate=57600, timeout=1)
-finger = adafruit_fingerprint.Adafruit_Fingerprint(uart)
-
-def get_fingerprint_photo(username, save_path=""):
-    print("Waiting for image...")
-    while finger.get_image() != adafruit_fingerprint.OK:
-        pass
-    
-    print("Got image...Transferring image data...")
-    imgList = finger.get_fpdata("image", 2)
-    imgArray = np.zeros(73728, np.uint8)
-    
-    for i, val in enumerate(imgList):
-        imgArray[(i * 2)] = val & 240
-        imgArray[(i * 2) + 1] = (val & 15) * 16
-    
-    imgArray = np.reshape(imgArray, (288, 256))
-    
-    if not save_path:
-        save_path = f"{username}_fingerprint.png"
-    
-    plt.imsave(save_path, imgArray, cmap='gray')
+from sensor_session import SensorSession
+from capture_service import CaptureService, CaptureCancelled
+from api_client import APIClient
+
+# OpenCV, NumPy and requests are imported on first use so the
+# window appears quickly; run with --profile-startup to see the cost of each phase.
+# Run with --trace to record where the time of each capture, match and API
+# call goes (see instrumentation.py), or --dump-histograms to also print the
+# timings on exit.
+startup_profile.record("imports", startup_profile.since_start())
+
+sensor_session = SensorSession()
+api_client = APIClient()
+
+IDENTIFY_SHORTLIST = 3
+# Captures are matched and uploaded from memory; set FINGERPRINT_SAVE_CAPTURES=1
+# to also keep match_fingerprint.png and {username}_fingerprint.png on disk.
+SAVE_CAPTURES = os.environ.get("FINGERPRINT_SAVE_CAPTURES") == "1"
+# Set FINGERPRINT_SENSOR_SEARCH=1 to load the signed-in pilots' templates into
+# the sensor and try its own 1:N search before transferring the image.
+SENSOR_SEARCH = os.environ.get("FINGERPRINT_SENSOR_SEARCH") == "1"
+# Captures failing the quality check are retried this many times in all before giving up.
+RECAPTURE_ATTEMPTS = 3
+# Set FINGERPRINT_ENROLL_IMPRESSIONS=3 (for example) to enroll several impressions of the
+# finger, fused into one template that covers more of it.
+ENROLL_IMPRESSIONS = max(int(os.environ.get("FINGERPRINT_ENROLL_IMPRESSIONS", "1")), 1)
+
+@functools.lru_cache(maxsize=None)
+def get_template_store():
+    with startup_profile.phase("template store"):
+        from template_store import TemplateStore
+        return TemplateStore()
+
+@functools.lru_cache(maxsize=None)
+def get_image_cache():
+    from image_cache import ImageCache
+    # Templates of evicted images are dropped together with the image.
+    return ImageCache(on_evict=lambda content_hash: get_fingerprint_engine().store.discard(content_hash))
+
+_fingerprint_index = None
+_fingerprint_index_lock = threading.Lock()
+
+def get_fingerprint_index():
+    """The shared DescriptorIndex of signed-in pilots.
+
+    Building it may re-extract every template, so the first call must not
+    come from the Tk thread; the lock makes concurrent first calls share one.
+    """
+    global _fingerprint_index
+    with _fingerprint_index_lock:
+        if _fingerprint_index is None:
+            with startup_profile.phase("fingerprint index"):
+                from descriptor_index import DescriptorIndex
+                fingerprint_index = DescriptorIndex()
+                refresh_fingerprint_index(fingerprint_index, get_fingerprint_engine())
+                _fingerprint_index = fingerprint_index
+        return _fingerprint_index
+
+def refresh_fingerprint_index(fingerprint_index, engine):
+    """Re-extract index entries cached under other extractor settings, e.g. after changing the preprocessing or engine."""
+    stale = [label for label, info in fingerprint_index.info.items()
+             if not info.get('template_key', '').endswith(engine.store.params_key)]
+    for label in stale:
+        info = fingerprint_index.info[label]
+        try:
+            template_key, template = engine.store.add(info['image_path'])
+        except (OSError, ValueError, KeyError):
+            fingerprint_index.remove(label, save=False)
+            continue
+        fingerprint_index.add(label, engine.index_descriptors(template),
+                              info=dict(info, template_key=template_key), save=False)
+    if stale:
+        fingerprint_index.save()
+
+@functools.lru_cache(maxsize=None)
+def get_fingerprint_engine():
+    # FINGERPRINT_ENGINE=minutiae swaps ORB for compact minutiae templates.
+    with startup_profile.phase("fingerprint engine"):
+        import fingerprint_engines
+        return fingerprint_engines.get_fingerprint_engine()
+
+@functools.lru_cache(maxsize=None)
+def get_sensor_search():
+    from sensor_search import SensorSearch
+    return SensorSearch()
+
+@functools.lru_cache(maxsize=None)
+def get_match_visualizer():
+    # Set FINGERPRINT_MATCH_RENDER_DIR to have every comparison drawn to that folder.
+    if not os.environ.get("FINGERPRINT_MATCH_RENDER_DIR"):
+        return None
+    from verification import MatchVisualizer
+    return MatchVisualizer(os.environ["FINGERPRINT_MATCH_RENDER_DIR"])
+
+def prepare_frame(imgArray):
+    """Scale a captured frame to the full gray range, like the enrolled images."""
+    from frame_decoder import normalize_frame
+    return normalize_frame(imgArray)
+
+def save_encoded_image(data, save_path):
+    with instrumentation.span("image.write", bytes=len(data)), open(save_path, 'wb') as f:
+        f.write(data)
     print(f"Fingerprint image saved as {save_path}")
-    
     return save_path
 
-def send_fingerprint_to_api(username, password, droneid, pilotid, address, fingerprint_image_path):
-    api_url = 'http://localhost:3000/api/fingerprint/insert'
-    files = {'fingerprint_image': open(fingerprint_image_path, 'rb')}
+def save_frame(image, save_path):
+    from template_store import encode_image
+    return save_encoded_image(encode_image(image), save_path)
+
+def start_capture(controller, on_frame, status_var, prematch=None, on_match=None, lift_first=False, prompt=None,
+                  process=None):
+    """Start a capture reporting to status_var; prompt, if given, is shown before each status message."""
+    capture_service = controller.capture_service
+    if capture_service.busy:
+        status_var.set("A capture is already in progress.")
+        return None
+    on_status = status_var.set if prompt is None else lambda message: status_var.set(f"{prompt} {message}")
+    return capture_service.capture(on_frame, on_status=on_status,
+                                   on_error=lambda error: capture_failed(error, status_var),
+                                   prematch=prematch, on_match=on_match, lift_first=lift_first, process=process)
+
+def start_checked_capture(controller, on_image, status_var, attempts=RECAPTURE_ATTEMPTS, prematch=None, on_match=None,
+                          lift_first=False, prompt=None, work=None):
+    """Like start_capture, but on_image(image, quality, result) only receives frames that pass the quality check.
+
+    The quality check and work(image, quality), whose return value is
+    result, run on the capture thread, so the window stays responsive
+    while a frame is matched or fused. Unusable frames are rejected before
+    any matching and the finger is asked for again, up to attempts
+    captures in all.
+    """
+    def process(imgArray):
+        from capture_quality import assess_quality
+        image = prepare_frame(imgArray)
+        with instrumentation.span("quality.assess") as span:
+            quality = assess_quality(image)
+            span.set(score=quality.score)
+        result = work(image, quality) if quality.acceptable and work is not None else None
+        return image, quality, result
+    
+    def checked(remaining):
+        def on_frame(processed):
+            image, quality, result = processed
+            if quality.acceptable:
+                on_image(image, quality, result)
+                return
+            instrumentation.count("capture.rejected")
+            print(f"Capture rejected: {quality.reason} (score {quality.score}).")
+            if remaining > 1:
+                start_capture(controller, checked(remaining - 1), status_var, prematch, on_match, lift_first=True,
+                              prompt=f"{quality.reason}, please place it again.", process=process)
+            else:
+                status_var.set("")
+                messagebox.showerror("Error", f"{quality.reason}. Clean the sensor and try again.")
+        return on_frame
+    
+    return start_capture(controller, checked(attempts), status_var, prematch, on_match, lift_first, prompt, process)
+
+def capture_failed(error, status_var):
+    if isinstance(error, CaptureCancelled):
+        status_var.set("Capture cancelled.")
+    elif isinstance(error, TimeoutError):
+        status_var.set("No finger detected, please try again.")
+    else:
+        status_var.set("")
+        messagebox.showerror("Error", f"Failed to capture fingerprint: {str(error)}")
+
+def api_failed(error):
+    messagebox.showerror("Error", f"Failed to connect to API: {str(error)}")
+
+def upload_fingerprint(data, fingerprint_image, filename, template=None):
+    response = api_client.insert_fingerprint(data, fingerprint_image, filename, template)
+    return response.status_code, response.json()
+
+def send_fingerprint_to_api(username, password, droneid, pilotid, address, fingerprint_image, quality=None,
+                            template=None):
+    """Upload the enrollment in the background.
+
+    fingerprint_image is the encoded PNG, quality its score and template the
+    Template fused from several impressions, stored with the image.
+    """
     data = {
         'username': username,
         'password': password,
@@ -50,165 +197,231 @@ def send_fingerprint_to_api(username, password, droneid, pilotid, address, finge
         'pilotid': pilotid,
         'address': address
     }
-    try:
-        response = requests.post(api_url, files=files, data=data)
-        response_data = response.json()
-        if response.status_code == 201:
+    if quality is not None:
+        data['quality'] = quality
+    template_bytes = None
+    if template is not None:
+        data['template_params'] = get_template_store().params_key
+        template_bytes = template.to_bytes()
+    
+    def uploaded(result):
+        status_code, response_data = result
+        if status_code == 201:
             messagebox.showinfo("Success", "Fingerprint image and data saved successfully!")
         else:
             messagebox.showerror("Error", f"Failed to save fingerprint image and data: {response_data['error']}")
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to connect to API: {str(e)}")
+    
+    api_client.submit(upload_fingerprint, data, fingerprint_image, f"{username}_fingerprint.png", template_bytes,
+                      on_done=uploaded, on_error=api_failed)
 
-def save_base64_image(base64_string, username, download_dir="downloaded_images"):
+def store_signin_image(response_data, username, cached_hash):
+    """Cache the image sent with a signin response, or reuse the cached copy if it is still current."""
+    image_cache = get_image_cache()
     try:
-        if not os.path.exists(download_dir):
-            os.makedirs(download_dir)
-        
-        image_data = base64.b64decode(base64_string)
-        
-        image = Image.open(BytesIO(image_data))
-        
-        image_filename = os.path.join(download_dir, f"{username}_downloaded_image.png")
-        image.save(image_filename)
-        print(f"Fingerprint image saved as {image_filename}")
-        
+        if 'fingerprint_image' in response_data:
+            image_path = image_cache.put(username, base64.b64decode(response_data['fingerprint_image']))
+            print(f"Fingerprint image saved as {image_path}")
+            return image_path
+        if cached_hash is not None and response_data.get('fingerprint_hash') == cached_hash:
+            return image_cache.get(username)
     except Exception as e:
         print(f"Error saving fingerprint image: {str(e)}")
+    return None
 
-def user_signin(username_entry, password_entry):
+def store_signin_template(response_data, image_path, store):
+    """Cache the fused template sent with a multi-impression enrollment as the template of its image."""
+    if response_data.get('fingerprint_template_params') != store.params_key or 'fingerprint_template' not in response_data:
+        return
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        template = store.template_class.from_bytes(base64.b64decode(response_data['fingerprint_template']))
+        store.add_template(data, template)
+    except Exception as e:
+        print(f"Error saving fingerprint template: {str(e)}")
+
+def signin_and_fetch(username, password):
+    """Sign in, cache the enrolled image and its template and index the pilot. Runs on the API client's threads."""
+    cached_hash = get_image_cache().lookup(username)
+    response = api_client.signin(username, password, cached_hash)
+    response_data = response.json()
+    enrolled = None
+    if response.status_code == 200:
+        image_path = store_signin_image(response_data, username, cached_hash)
+        if image_path:
+            engine = get_fingerprint_engine()
+            store_signin_template(response_data, image_path, engine.store)
+            template_key, template = engine.store.add(image_path)
+            quality = enrolled_quality(response_data, image_path)
+            get_fingerprint_index().add(response_data.get('pilotid', username), engine.index_descriptors(template),
+                                        info={'image_path': image_path, 'template_key': template_key, 'quality': quality})
+            enrolled = (image_path, quality)
+    return response.status_code, response_data, enrolled
+
+def enrolled_quality(response_data, image_path):
+    """Quality score stored with the enrolled image, or assessed here for images enrolled without one."""
+    quality = response_data.get('fingerprint_quality')
+    if quality is not None:
+        return quality
+    from capture_quality import assess_quality
+    return assess_quality(load_image(image_path)).score
+
+def sync_sensor_template(controller, pilotid, image_path):
+    """Load a signed-in pilot's template into the sensor for on-chip search."""
+    controller.capture_service.run(get_sensor_search().enroll, pilotid, image_path,
+                                   on_error=lambda error: print(f"Failed to load pilot {pilotid} into the sensor: {error}"))
+
+def user_signin(controller, username_entry, password_entry):
     username = username_entry.get()
     password = password_entry.get()
     
     print(f"Signing in with Username: {username}, Password: {password}")
     
-    api_url = 'http://localhost:3000/api/signin'
-    data = {
-        'username': username,
-        'password': password
-    }
-    try:
-        response = requests.post(api_url, json=data)
-        response_data = response.json()
-        if response.status_code == 200:
-            messagebox.showinfo("Success", "Signin successful!")
-            
-            if 'fingerprint_image' in response_data:
-                save_base64_image(response_data['fingerprint_image'], username)
-            
-            remaining_data = {
-                'username': username,
-                'droneid': response_data.get('droneid', ''),
-                'pilotid': response_data.get('pilotid', ''),
-                'address': response_data.get('address', ''),
-                'timestamp': response_data.get('timestamp', '')
-            }
-            with open('remaining_data.json', 'w') as f:
-                json.dump(remaining_data, f, indent=4)
-        else:
+    def signed_in(result):
+        status_code, response_data, enrolled = result
+        if status_code != 200:
             messagebox.showerror("Error", f"Signin failed: {response_data['error']}")
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to connect to API: {str(e)}")
+            return
+        messagebox.showinfo("Success", "Signin successful!")
+        
+        if enrolled:
+            image_path, quality = enrolled
+            pilotid = response_data.get('pilotid', username)
+            from capture_quality import LOW_SCORE
+            if quality < LOW_SCORE:
+                messagebox.showwarning("Warning", f"The enrolled fingerprint has a low quality score ({quality}), "
+                                                  "so matching may fail. Please enroll it again.")
+            if SENSOR_SEARCH:
+                sync_sensor_template(controller, pilotid, image_path)
+        
+        remaining_data = {
+            'username': username,
+            'droneid': response_data.get('droneid', ''),
+            'pilotid': response_data.get('pilotid', ''),
+            'address': response_data.get('address', ''),
+            'timestamp': response_data.get('timestamp', '')
+        }
+        with open('remaining_data.json', 'w') as f:
+            json.dump(remaining_data, f, indent=4)
+    
+    api_client.submit(signin_and_fetch, username, password, on_done=signed_in, on_error=api_failed)
 
-def save_fingerprint_image(username_entry, password_entry, droneid_entry, pilotid_entry, address_entry):
+def save_fingerprint_image(controller, status_var, username_entry, password_entry, droneid_entry, pilotid_entry, address_entry):
     try:
         username = username_entry.get()
         password = password_entry.get()
         droneid = int(droneid_entry.get())
         pilotid = int(pilotid_entry.get())
         address = address_entry.get()
-        
-        fingerprint_image_path = get_fingerprint_photo(username)
-        
-        send_fingerprint_to_api(username, password, droneid, pilotid, address, fingerprint_image_path)
-        if os.path.exists(f"{username}_fingerprint.png"):
-            os.remove(f"{username}_fingerprint.png")
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save fingerprint image: {str(e)}")
+        return
+    
+    impressions, scores = [], []
+    captures = [0]
+    
+    def fuse_impressions(image, quality):
+        # Runs on the capture thread; impressions only changes on the GUI thread between captures.
+        if len(impressions) + 1 < ENROLL_IMPRESSIONS or ENROLL_IMPRESSIONS == 1:
+            return None
+        from template_fusion import fuse_images
+        return fuse_images(impressions + [image], get_template_store())
+    
+    def enroll_frame(image, quality, fused):
+        from template_store import encode_image
+        captures[0] += 1
+        impressions.append(image)
+        scores.append(quality.score)
+        template = None
+        if fused is not None:
+            # Impressions that do not overlap the others cannot be merged into the finger's template.
+            # The anchor comes first: the fused template is in its coordinates.
+            template, merged = fused
+            impressions[:] = [impressions[i] for i in merged]
+            scores[:] = [scores[i] for i in merged]
+        if len(impressions) < ENROLL_IMPRESSIONS:
+            if captures[0] >= 2 * ENROLL_IMPRESSIONS:
+                messagebox.showerror("Error", "The impressions do not line up. Press the same finger flat on the sensor and try again.")
+                return
+            start_checked_capture(controller, enroll_frame, status_var, lift_first=True, work=fuse_impressions,
+                                  prompt=f"Impression {len(impressions) + 1} of {ENROLL_IMPRESSIONS}:")
+            return
+        try:
+            fingerprint_image = encode_image(impressions[0])
+            if SAVE_CAPTURES:
+                save_encoded_image(fingerprint_image, f"{username}_fingerprint.png")
+            
+            send_fingerprint_to_api(username, password, droneid, pilotid, address, fingerprint_image, min(scores),
+                                    template)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save fingerprint image: {str(e)}")
+    
+    start_checked_capture(controller, enroll_frame, status_var, work=fuse_impressions)
 
 def load_image(path):
-    image = cv2.imread(path)
+    import cv2
+    with instrumentation.span("image.read"):
+        image = cv2.imread(path)
     if image is None:
         raise FileNotFoundError(f"Image at path {path} not found.")
     gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     return gray_image
 
-def detect_and_compute(image):
-    orb = cv2.ORB_create(nfeatures=1500)
-    keypoints, descriptors = orb.detectAndCompute(image, None)
-    return keypoints, descriptors
-
-def match_descriptors(descriptors1, descriptors2):
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING)
-    matches = bf.knnMatch(descriptors1, descriptors2, k=2)
-    
-    good_matches = []
-    for m, n in matches:
-        if m.distance < 0.75 * n.distance:
-            good_matches.append(m)
-    return good_matches
-
-def verify_fingerprints(image1_path, image2_path, min_match_count=10):
-    image1 = load_image(image1_path)
-    image2 = load_image(image2_path)
-    
-    keypoints1, descriptors1 = detect_and_compute(image1)
-    keypoints2, descriptors2 = detect_and_compute(image2)
-    
-    if descriptors1 is None or descriptors2 is None:
-        return False, 0
-    
-    matches = match_descriptors(descriptors1, descriptors2)
-    out = cv2.drawMatches(image1, keypoints1, image2, keypoints2, matches, None)
-    plt.imshow(out)
-    plt.show()
-    if len(matches) > min_match_count:
-        src_pts = np.float32([keypoints1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([keypoints2[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-        
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-        matches_mask = mask.ravel().tolist()
-        
-        if M is not None and sum(matches_mask) > min_match_count:
-            out = cv2.drawMatches(image1, keypoints1, image2, keypoints2, matches, None, 
-                                  matchesMask=matches_mask, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-            plt.imshow(out)
-            plt.show()
-            return True, sum(matches_mask)
-    return False, 0
-
-def user_fingerprint_authentication():
-    print("Waiting for image...")
-    while finger.get_image() != adafruit_fingerprint.OK:
-        pass
-    
-    print("Got image...Transferring image data...")
-    imgList = finger.get_fpdata("image", 2)
-    imgArray = np.zeros(73728, np.uint8)
-    
-    for i, val in enumerate(imgList):
-        imgArray[(i * 2)] = val & 240
-        imgArray[(i * 2) + 1] = (val & 15) * 16
+def user_fingerprint_authentication(controller, status_var):
+    # Traced as match.total, from the button press to the result dialog.
+    started = time.perf_counter()
+    on_image = functools.partial(show_match_result, started=started)
+    if not SENSOR_SEARCH:
+        start_checked_capture(controller, on_image, status_var, work=identify_frame)
+        return
+    # Only signed-in pilots may be accepted by the sensor, as with host matching.
+    def prematch(finger):
+        return get_sensor_search().search(finger, allowed=list(get_fingerprint_index().entries()))
     
-    imgArray = np.reshape(imgArray, (288, 256))
+    start_checked_capture(controller, on_image, status_var, work=identify_frame, prematch=prematch,
+                          on_match=functools.partial(sensor_matched, started=started))
+
+def sensor_matched(match, started=None):
+    if started is not None:
+        instrumentation.record("match.total", started, time.perf_counter() - started, matched=True, by="sensor")
+    print(f"Pilot {match.pilotid}: matched by the sensor in slot {match.slot}, confidence {match.confidence}")
+    messagebox.showinfo("Success", f"Fingerprint verified successfully! Sensor confidence: {match.confidence}")
+
+def identify_frame(image, quality):
+    """Identify a captured image among the signed-in pilots; runs on the capture thread. Returns (matched, inliers)."""
+    if SAVE_CAPTURES:
+        save_frame(image, "match_fingerprint.png")
     
-    save_path = "match_fingerprint.png"
-    
-    plt.imsave(save_path, imgArray, cmap='gray')
-    print(f"Fingerprint image saved as {save_path}")
+    engine = get_fingerprint_engine()
+    fingerprint_index = get_fingerprint_index()
+    # Match drawings need ORB keypoints.
+    match_visualizer = get_match_visualizer() if engine.name == "orb" else None
     
     matched = False
     match_count = 0
-    downloaded_images_dir = "./downloaded_images"
+    with instrumentation.span("match.extract", engine=engine.name):
+        probe = engine.extract(image)
     
-    for image_file in os.listdir(downloaded_images_dir):
-        if image_file.endswith("_downloaded_image.png"):
-            image2_path = os.path.join(downloaded_images_dir, image_file)
-            match_result, count = verify_fingerprints(save_path, image2_path)
-            if match_result:
-                matched = True
-                match_count = count
-                break
+    # Only the most likely pilots (for ORB, the best voted in the index) go through full verification.
+    identify_start = time.perf_counter()
+    for pilotid, gallery, result in engine.identify(probe, fingerprint_index, limit=IDENTIFY_SHORTLIST):
+        instrumentation.count("match.candidates")
+        print(f"Pilot {pilotid}: {result.inliers} {engine.name} matches, "
+              f"{sum(result.timings.values()) * 1000:.1f} ms")
+        info = fingerprint_index.entry(pilotid)
+        if match_visualizer is not None and info is not None:
+            match_visualizer.submit(f"{pilotid}_match", image, probe, info['image_path'], gallery, result)
+        if result.match:
+            matched = True
+            match_count = result.inliers
+            break
+    instrumentation.record("match.identify", identify_start, time.perf_counter() - identify_start, matched=matched)
+    return matched, match_count
+
+def show_match_result(image, quality, result, started=None):
+    matched, match_count = result
+    if started is not None:
+        instrumentation.record("match.total", started, time.perf_counter() - started, matched=matched, by="host")
     
     if matched:
         messagebox.showinfo("Success", f"Fingerprint verified successfully! Match count: {match_count}")
@@ -216,26 +429,72 @@ def user_fingerprint_authentication():
         messagebox.showerror("Error", f"Fingerprint verification failed. Match count: {match_count}")
 
 
+def logout_and_forget():
+    """Log out and, if that worked, drop every pilot from the index. Runs on the API client's threads."""
+    response = api_client.logout()
+    if response.status_code == 200:
+        # Downloaded images stay in the image cache for the next signin.
+        get_fingerprint_index().clear()
+    return response
+
 def logout_process():
-    endpoint = "http://localhost:3000/api/logout"
-    response = requests.post(endpoint)
+    def logged_out(response):
+        if response.status_code == 200:
+            user_data = response.json()
+            print(user_data)
+            if os.path.exists("match_fingerprint.png"):
+                os.remove("match_fingerprint.png")
+            if os.path.exists("remaining_data.json"):
+                os.remove("remaining_data.json")
+        else:
+            print("Logout failed")
+    
+    api_client.submit(logout_and_forget, on_done=logged_out, on_error=lambda error: print(f"Logout failed: {error}"))
+
+def show_timings():
+    path, text = instrumentation.dump_histograms()
+    print(text)
+    messagebox.showinfo("Timings", f"Stage timings saved to {path} and printed to the console.")
+
+def delete_and_forget(pilotid):
+    """Delete a pilot's fingerprint and drop it from the index. Runs on the API client's threads."""
+    response = api_client.delete_fingerprint(pilotid)
     if response.status_code == 200:
-        user_data = response.json()
-        print(user_data)
-        if os.path.exists("match_fingerprint.png"):
-            os.remove("match_fingerprint.png")
-        os.remove("remaining_data.json")
-        shutil.rmtree("downloaded_images")
-    else:
-        print("Logout failed")
+        # The pilot can no longer be matched, even while still signed in.
+        get_fingerprint_index().remove(pilotid)
+    return response
+
+def delete_fingerprint(controller, pilotid_entry):
+    try:
+        pilotid = int(pilotid_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Enter the numeric Pilot ID to delete.")
+        return
+    if not messagebox.askyesno("Delete Fingerprint", f"Delete the enrolled fingerprint of pilot {pilotid}?"):
+        return
+    
+    def deleted(response):
+        if response.status_code == 200:
+            controller.capture_service.run(get_sensor_search().remove, pilotid,
+                                           on_error=lambda error: print(f"Failed to remove pilot {pilotid} from the sensor: {error}"))
+            messagebox.showinfo("Success", f"Fingerprint of pilot {pilotid} deleted.")
+        else:
+            messagebox.showerror("Error", f"Failed to delete fingerprint: {response.json().get('error')}")
+    
+    api_client.submit(delete_and_forget, pilotid, on_done=deleted, on_error=api_failed)
 
 class MainApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Main Window")
-        self.geometry("600x400")
+        self.geometry("600x480")
         self.configure(bg="#f0f0f0")
 
+        self.capture_service = CaptureService(sensor_session)
+        self.capture_service.attach(self)
+        api_client.attach(self)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.frames = {}
         for F in (HomeScreen, SignupScreen, SigninScreen, FingerprintMatchScreen, LogoutScreen):
             page_name = F.__name__
@@ -249,6 +508,12 @@ class MainApp(tk.Tk):
         frame = self.frames[page_name]
         frame.tkraise()
 
+    def on_close(self):
+        self.capture_service.close()
+        api_client.close()
+        sensor_session.close()
+        self.destroy()
+
 class HomeScreen(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
@@ -261,6 +526,8 @@ class HomeScreen(tk.Frame):
         ttk.Button(self, text="Signin", command=lambda: controller.show_frame("SigninScreen")).pack(pady=10)
         ttk.Button(self, text="Fingerprint Match", command=lambda: controller.show_frame("FingerprintMatchScreen")).pack(pady=10)
         ttk.Button(self, text="Logout", command=lambda: controller.show_frame("LogoutScreen")).pack(pady=10)
+        if instrumentation.enabled:
+            ttk.Button(self, text="Timings", command=show_timings).pack(pady=10)
 
 class SignupScreen(tk.Frame):
     def __init__(self, parent, controller):
@@ -293,8 +560,14 @@ class SignupScreen(tk.Frame):
         address_entry = tk.Entry(frame, font=('Helvetica', 12), width=30)
         address_entry.grid(row=4, column=1, padx=10, pady=5)
 
+        status_var = tk.StringVar()
+        
         tk.Button(self, text="Save Fingerprint", font=('Helvetica', 12), command=lambda: save_fingerprint_image(
-            username_entry, password_entry, droneid_entry, pilotid_entry, address_entry)).pack(pady=10)
+            controller, status_var, username_entry, password_entry, droneid_entry, pilotid_entry, address_entry)).pack(pady=10)
+        
+        tk.Label(self, textvariable=status_var, bg="#f0f0f0", font=('Helvetica', 11)).pack(pady=5)
+        
+        tk.Button(self, text="Cancel Capture", font=('Helvetica', 12), command=controller.capture_service.cancel).pack(pady=5)
         
         tk.Button(self, text="Close", font=('Helvetica', 12), command=lambda: controller.show_frame("HomeScreen")).pack(pady=10)
 
@@ -317,7 +590,7 @@ class SigninScreen(tk.Frame):
         password_entry = tk.Entry(frame, show="*", font=('Helvetica', 12), width=30)
         password_entry.grid(row=1, column=1, padx=10, pady=5)
 
-        tk.Button(self, text="Signin", font=('Helvetica', 12), command=lambda: user_signin(username_entry, password_entry)).pack(pady=10)
+        tk.Button(self, text="Signin", font=('Helvetica', 12), command=lambda: user_signin(controller, username_entry, password_entry)).pack(pady=10)
         
         tk.Button(self, text="Close", font=('Helvetica', 12), command=lambda: controller.show_frame("HomeScreen")).pack(pady=10)
 
@@ -329,7 +602,14 @@ class FingerprintMatchScreen(tk.Frame):
 
         tk.Label(self, text="Fingerprint Match", font=("Helvetica", 16), bg="#f0f0f0").pack(pady=10)
 
-        tk.Button(self, text="Start Matching", font=('Helvetica', 12), command=user_fingerprint_authentication).pack(pady=10)
+        status_var = tk.StringVar()
+        
+        tk.Button(self, text="Start Matching", font=('Helvetica', 12),
+                  command=lambda: user_fingerprint_authentication(controller, status_var)).pack(pady=10)
+        
+        tk.Label(self, textvariable=status_var, bg="#f0f0f0", font=('Helvetica', 11)).pack(pady=5)
+        
+        tk.Button(self, text="Cancel Capture", font=('Helvetica', 12), command=controller.capture_service.cancel).pack(pady=5)
         
         tk.Button(self, text="Close", font=('Helvetica', 12), command=lambda: controller.show_frame("HomeScreen")).pack(pady=10)
 
@@ -343,8 +623,20 @@ class LogoutScreen(tk.Frame):
 
         tk.Button(self, text="Logout", font=('Helvetica', 12), command=logout_process).pack(pady=10)
         
+        frame = tk.Frame(self, bg="#f0f0f0")
+        frame.pack(pady=10)
+        
+        tk.Label(frame, text="Pilot ID:", bg="#f0f0f0", font=('Helvetica', 12)).grid(row=0, column=0, padx=10, pady=5, sticky="w")
+        pilotid_entry = tk.Entry(frame, font=('Helvetica', 12), width=30)
+        pilotid_entry.grid(row=0, column=1, padx=10, pady=5)
+        
+        tk.Button(self, text="Delete Fingerprint", font=('Helvetica', 12),
+                  command=lambda: delete_fingerprint(controller, pilotid_entry)).pack(pady=10)
+        
         tk.Button(self, text="Close", font=('Helvetica', 12), command=lambda: controller.show_frame("HomeScreen")).pack(pady=10)
 
 if __name__ == "__main__":
-    app = MainApp()
+    with startup_profile.phase("build window"):
+        app = MainApp()
+    app.after_idle(startup_profile.record, "window ready", startup_profile.since_start())
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import itertools
+import numpy as np
+import instrumentation
+from template_store import TemplateStore
+from verification import VerificationResult, match_descriptors, verify_templates
+
+# Thresholds leave a margin below the weakest genuine pair in ./fingerprints;
+# rerun this module on that folder after changing them.
+DEFAULT_CASCADE = [
+    ("keypoint_count", {"min_ratio": 0.5}),
+    ("keypoint_density", {"min_ratio": 0.4}),
+    ("strongest_subset", {"size": 300, "min_matches": 3}),
+]
+
+class KeypointCountStage:
+    """Reject pairs whose keypoint counts differ too much, e.g. a near-blank capture."""
+    name = "keypoint_count"
+
+    def __init__(self, min_ratio=0.5):
+        self.min_ratio = min_ratio
+
+    def __call__(self, template1, template2):
+        n1, n2 = len(template1.keypoints), len(template2.keypoints)
+        return min(n1, n2) >= self.min_ratio * max(n1, n2)
+
+class KeypointDensityStage:
+    """Reject pairs with incompatible keypoint density over the finger area.
+
+    ORB keypoints sit on ridge endings and bifurcations, so their density
+    follows the ridge density of the finger.
+    """
+    name = "keypoint_density"
+
+    def __init__(self, min_ratio=0.4):
+        self.min_ratio = min_ratio
+
+    @staticmethod
+    def density(template):
+        points = template.keypoints[:, :2]
+        if len(points) < 2:
+            return 0.0
+        low, high = np.percentile(points, [5, 95], axis=0)
+        return len(points) / max(float(np.prod(high - low)), 1.0)
+
+    def __call__(self, template1, template2):
+        d1, d2 = self.density(template1), self.density(template2)
+        return min(d1, d2) >= self.min_ratio * max(d1, d2)
+
+class StrongestSubsetStage:
+    """Reject pairs with too few ratio-test matches among their strongest keypoints."""
+    name = "strongest_subset"
+
+    def __init__(self, size=300, min_matches=3):
+        self.size = size
+        self.min_matches = min_matches
+
+    def strongest(self, template):
+        if len(template.keypoints) <= self.size:
+            return template.descriptors
+        order = np.argpartition(-template.keypoints[:, 4], self.size)[:self.size]
+        return template.descriptors[order]
+
+    def __call__(self, template1, template2):
+        matches = match_descriptors(self.strongest(template1), self.strongest(template2))
+        return len(matches) >= self.min_matches
+
+STAGES = {stage.name: stage for stage in (
+    KeypointCountStage, KeypointDensityStage, StrongestSubsetStage)}
+
+class MatchCascade:
+    """Cheap early-reject tests run in order before full verification.
+
+    Every stage counts the pairs it saw, the pairs it rejected and the time
+    it spent, so the cascade's effect can be checked with report().
+    """
+
+    def __init__(self, config=DEFAULT_CASCADE):
+        self.stages = [STAGES[name](**params) for name, params in config]
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {name: {"evaluated": 0, "rejected": 0, "seconds": 0.0}
+                      for name in [stage.name for stage in self.stages] + ["full"]}
+
+    def screen(self, template1, template2):
+        """Return the name of the first stage that rejects the pair, or None."""
+        if template1.descriptors is None or template2.descriptors is None:
+            return None
+        for stage in self.stages:
+            stats = self.stats[stage.name]
+            start = time.perf_counter()
+            passed = stage(template1, template2)
+            stats["seconds"] += time.perf_counter() - start
+            stats["evaluated"] += 1
+            if not passed:
+                stats["rejected"] += 1
+                return stage.name
+        return None
+
+    def verify(self, template1, template2, min_match_count=10):
+        """Screen the pair and run verify_templates only if every stage passes."""
+        start = time.perf_counter()
+        rejected_by = self.screen(template1, template2)
+        screen_time = time.perf_counter() - start
+        instrumentation.record("verify.cascade", start, screen_time, rejected_by=rejected_by)
+        if rejected_by is not None:
+            instrumentation.count(f"cascade.rejected.{rejected_by}")
+            return VerificationResult(False, 0, [], None, {"cascade": screen_time})
+        start = time.perf_counter()
+        result = verify_templates(template1, template2, min_match_count)
+        stats = self.stats["full"]
+        stats["seconds"] += time.perf_counter() - start
+        stats["evaluated"] += 1
+        stats["rejected"] += not result.match
+        result.timings["cascade"] = screen_time
+        return result
+
+    def report(self):
+        """Format the per-stage statistics as a table."""
+        lines = [f"{'stage':<22}{'evaluated':>10}{'rejected':>10}{'ms/pair':>10}"]
+        for name, stats in self.stats.items():
+            per_pair = stats["seconds"] * 1000 / max(stats["evaluated"], 1)
+            lines.append(f"{name:<22}{stats['evaluated']:>10}{stats['rejected']:>10}{per_pair:>10.2f}")
+        return "\n".join(lines)
+
+def evaluate_cascade(directory_path, cascade=None, template_store=None):
+    """Compare cascade and full verification on every pair in a directory.
+
+    Returns the pairs accepted by full verification but rejected by the cascade.
+    """
+    cascade = cascade or MatchCascade()
+    template_store = template_store or TemplateStore()
+    image_files = sorted(os.listdir(directory_path))
+    templates = {f: template_store.get(os.path.join(directory_path, f)) for f in image_files}
+
+    lost = []
+    accepted = 0
+    full_seconds = 0.0
+    for image1, image2 in itertools.combinations(image_files, 2):
+        start = time.perf_counter()
+        reference = verify_templates(templates[image1], templates[image2])
+        full_seconds += time.perf_counter() - start
+        result = cascade.verify(templates[image1], templates[image2])
+        accepted += reference.match
+        if reference.match and not result.match:
+            lost.append((image1, image2, reference.inliers))
+
+    print(cascade.report())
+    print(f"Full verification only: {full_seconds:.2f} s, "
+          f"with cascade: {sum(s['seconds'] for s in cascade.stats.values()):.2f} s")
+    print(f"Accepted by full verification: {accepted}, lost by the cascade: {len(lost)}")
+    for image1, image2, inliers in lost:
+        print(f"  {image1} and {image2} ({inliers} inliers)")
+    return lost
+
+if __name__ == "__main__":
+    evaluate_cascade(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints")
@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import numpy as np
+from geometry import GEOMETRY_MODEL, ORIENTATION_FILTER
+from matcher_engines import DEFAULT_BACKEND
+
+MATRIX_DIR = "match_cache"
+NOT_COMPARED = -1
+
+def matrix_path(directory_path, matrix_dir=MATRIX_DIR, backend=DEFAULT_BACKEND):
+    """Default file of the match matrix of an image folder, one per folder and matcher backend."""
+    directory_path = os.path.abspath(directory_path)
+    digest = hashlib.sha256(directory_path.encode()).hexdigest()[:8]
+    return os.path.join(matrix_dir, f"{os.path.basename(directory_path)}_{digest}_{backend}.npz")
+
+class MatchMatrix:
+    """Persistent all-pairs verification results of a folder of images.
+
+    Rows are template keys (image content hash and extractor settings), so
+    a renamed file keeps its results and a changed file or extractor
+    setting gets new ones. inliers[i, j] is the inlier count of keys[i]
+    against keys[j], or NOT_COMPARED, and matched[i, j] the decision; both
+    are symmetric. files remembers the size, mtime and key of every image
+    so unchanged files are not read again. The decisions depend on
+    min_match_count, the geometry settings and the matcher backend, so a
+    matrix saved with other values is not loaded.
+    """
+
+    def __init__(self, path, min_match_count=10):
+        self.path = path
+        self.min_match_count = min_match_count
+        self.keys = []
+        self.files = {}
+        self.inliers = np.empty((0, 0), np.int16)
+        self.matched = np.empty((0, 0), bool)
+        self._positions = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self):
+        with np.load(self.path) as data:
+            meta = json.loads(str(data["meta"]))
+            if (meta["min_match_count"] != self.min_match_count or meta.get("geometry") != self.geometry()
+                    or meta.get("matcher") != DEFAULT_BACKEND):
+                return
+            self.inliers = data["inliers"]
+            self.matched = data["matched"]
+        self.keys = meta["keys"]
+        self.files = meta["files"]
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+
+    def save(self):
+        """Write the matrix to self.path atomically."""
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        meta = json.dumps({"min_match_count": self.min_match_count, "geometry": self.geometry(),
+                           "matcher": DEFAULT_BACKEND, "keys": self.keys, "files": self.files})
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, inliers=self.inliers, matched=self.matched, meta=np.array(meta))
+        os.replace(tmp_path, self.path)
+
+    def geometry(self):
+        return {"model": GEOMETRY_MODEL, "orientation_filter": ORIENTATION_FILTER}
+
+    def cached_key(self, name, stat):
+        """Key recorded for the file name if its size and mtime are unchanged, else None."""
+        entry = self.files.get(name)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["key"]
+        return None
+
+    def set_files(self, files):
+        """Make {name: (os.stat_result, key)} the folder's contents.
+
+        Rows of keys no longer in the folder are dropped and new keys get
+        rows of NOT_COMPARED. Returns the number of rows dropped.
+        """
+        self.files = {name: {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "key": key}
+                      for name, (stat, key) in files.items()}
+        present = dict.fromkeys(key for _, key in files.values())
+        keep = [i for i, key in enumerate(self.keys) if key in present]
+        added = [key for key in present if key not in self._positions]
+        dropped = len(self.keys) - len(keep)
+
+        size = len(keep) + len(added)
+        inliers = np.full((size, size), NOT_COMPARED, np.int16)
+        matched = np.zeros((size, size), bool)
+        inliers[:len(keep), :len(keep)] = self.inliers[np.ix_(keep, keep)]
+        matched[:len(keep), :len(keep)] = self.matched[np.ix_(keep, keep)]
+        self.inliers, self.matched = inliers, matched
+        self.keys = [self.keys[i] for i in keep] + added
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+        return dropped
+
+    def names_by_key(self):
+        names = {}
+        for name, entry in sorted(self.files.items()):
+            names.setdefault(entry["key"], []).append(name)
+        return names
+
+    def pending(self):
+        """(key, [other keys]) for every pair not compared yet.
+
+        A key is only compared with itself when two files have the same
+        content.
+        """
+        missing = np.triu(self.inliers == NOT_COMPARED, 1)
+        for key, names in self.names_by_key().items():
+            if len(names) > 1:
+                i = self._positions[key]
+                missing[i, i] = self.inliers[i, i] == NOT_COMPARED
+        for i in np.flatnonzero(missing.any(axis=1)):
+            yield self.keys[i], [self.keys[j] for j in np.flatnonzero(missing[i])]
+
+    def record(self, key1, key2, match, inliers):
+        i, j = self._positions[key1], self._positions[key2]
+        self.inliers[i, j] = self.inliers[j, i] = inliers
+        self.matched[i, j] = self.matched[j, i] = match
+
+    def matching_pairs(self):
+        """(name1, name2, inliers) for every compared pair of files that matched, in name order."""
+        names = sorted(self.files)
+        rows = np.array([self._positions[self.files[name]["key"]] for name in names], np.intp)
+        matched = np.triu(self.matched[np.ix_(rows, rows)], 1)
+        for a, b in zip(*np.nonzero(matched)):
+            yield names[a], names[b], int(self.inliers[rows[a], rows[b]])
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import itertools
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+import cv2
+
+DEFAULT_BACKEND = os.environ.get("FINGERPRINT_MATCHER", "bf")
+RATIO = 0.75
+
+FLANN_INDEX_LSH = 6
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+class MatcherEngine(ABC):
+    """Finds the two nearest neighbours of each query descriptor; the ratio test is shared."""
+    name = None
+
+    @abstractmethod
+    def knn(self, descriptors1, descriptors2):
+        """Return (indices, distances), both (N, 2), of the two nearest train descriptors.
+
+        Missing neighbours have index -1 and an infinite distance.
+        """
+
+    def match(self, descriptors1, descriptors2, ratio=RATIO):
+        """Match descriptors with Lowe's ratio test and return cv2.DMatch objects."""
+        # The ratio test needs two neighbours for every query.
+        if descriptors1 is None or descriptors2 is None or not len(descriptors1) or len(descriptors2) < 2:
+            return []
+        indices, distances = self.knn(descriptors1, descriptors2)
+        good = np.flatnonzero((distances[:, 0] < ratio * distances[:, 1]) & np.isfinite(distances[:, 1]))
+        return [cv2.DMatch(int(q), int(indices[q, 0]), float(distances[q, 0])) for q in good]
+
+def _knn_from_dmatches(knn_matches, count):
+    indices = np.full((count, 2), -1, np.intp)
+    distances = np.full((count, 2), np.inf, np.float32)
+    for row, pair in enumerate(knn_matches):
+        for k, m in enumerate(pair[:2]):
+            indices[row, k] = m.trainIdx
+            distances[row, k] = m.distance
+    return indices, distances
+
+class BruteForceEngine(MatcherEngine):
+    """cv2.BFMatcher with Hamming distance, the original matcher."""
+    name = "bf"
+
+    def __init__(self):
+        self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def knn(self, descriptors1, descriptors2):
+        return _knn_from_dmatches(self._matcher.knnMatch(descriptors1, descriptors2, k=2), len(descriptors1))
+
+class FlannLshEngine(MatcherEngine):
+    """Approximate matching with a FLANN LSH index built over the train descriptors."""
+    name = "flann"
+
+    def __init__(self, table_number=6, key_size=12, multi_probe_level=1, checks=50):
+        index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=table_number,
+                            key_size=key_size, multi_probe_level=multi_probe_level)
+        self._matcher = cv2.FlannBasedMatcher(index_params, dict(checks=checks))
+
+    def knn(self, descriptors1, descriptors2):
+        return _knn_from_dmatches(self._matcher.knnMatch(descriptors1, descriptors2, k=2), len(descriptors1))
+
+class PopcountEngine(MatcherEngine):
+    """Exact brute force in NumPy: XOR of packed 64-bit words plus popcount, in row blocks."""
+    name = "numpy"
+
+    def __init__(self, block_rows=256):
+        self.block_rows = block_rows
+
+    @staticmethod
+    def _popcount(words):
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(words)
+        return _POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+    def knn(self, descriptors1, descriptors2):
+        words1 = np.ascontiguousarray(descriptors1, np.uint8).view(np.uint64)
+        words2 = np.ascontiguousarray(np.ascontiguousarray(descriptors2, np.uint8).view(np.uint64).T)
+        n1, n2 = len(words1), words2.shape[1]
+        indices = np.full((n1, 2), -1, np.intp)
+        distances = np.full((n1, 2), np.inf, np.float32)
+        xor = np.empty((min(self.block_rows, n1), n2), np.uint64)
+        for start in range(0, n1, self.block_rows):
+            block = words1[start:start + self.block_rows]
+            rows = np.arange(len(block))
+            dist = np.zeros((len(block), n2), np.uint16)
+            # Accumulate one 64-bit word at a time to keep the temporaries 2-D.
+            for word in range(words1.shape[1]):
+                np.bitwise_xor(block[:, word, None], words2[word][None, :], out=xor[:len(block)])
+                dist += self._popcount(xor[:len(block)])
+            for k in range(min(2, n2)):
+                nearest = dist.argmin(axis=1)
+                indices[start + rows, k] = nearest
+                distances[start + rows, k] = dist[rows, nearest]
+                dist[rows, nearest] = np.iinfo(np.uint16).max
+        return indices, distances
+
+BACKENDS = {engine.name: engine for engine in (BruteForceEngine, FlannLshEngine, PopcountEngine)}
+
+_local = threading.local()
+
+def get_engine(name=None):
+    """Return this thread's long-lived engine for a backend (default FINGERPRINT_MATCHER or "bf")."""
+    name = name or DEFAULT_BACKEND
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    engine = engines.get(name)
+    if engine is None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown matcher backend {name!r}, expected one of {sorted(BACKENDS)}.")
+        engine = engines[name] = BACKENDS[name]()
+    return engine
+
+def benchmark_backends(directory_path, pairs=60):
+    """Time every backend on image pairs from a directory and compare match counts with bf."""
+    from template_store import TemplateStore
+    store = TemplateStore()
+    image_files = sorted(os.listdir(directory_path))
+    templates = [store.get(os.path.join(directory_path, f)) for f in image_files]
+    pair_list = list(itertools.islice(itertools.combinations(templates, 2), pairs))
+
+    reference = [len(get_engine("bf").match(t1.descriptors, t2.descriptors)) for t1, t2 in pair_list]
+    for name in BACKENDS:
+        engine = get_engine(name)
+        start = time.perf_counter()
+        counts = [len(engine.match(t1.descriptors, t2.descriptors)) for t1, t2 in pair_list]
+        elapsed = time.perf_counter() - start
+        agreement = np.mean([1.0 if a == b else min(a, b) / max(a, b) for a, b in zip(counts, reference)])
+        print(f"{name:<8}{elapsed * 1000 / len(pair_list):>8.2f} ms/pair   agreement with bf {agreement:.2f}")
+
+if __name__ == "__main__":
+    benchmark_backends(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints")
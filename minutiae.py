@@ -0,0 +1,252 @@
+import os
+import time
+import struct
+from collections import namedtuple
+import numpy as np
+import cv2
+from preprocessing import preprocess, orientation_field, params as preprocessing_params
+from template_store import TemplateStore, TEMPLATE_DIR, params_key, temp_path
+from verification import VerificationResult
+
+MINUTIAE_DIR = os.path.join(TEMPLATE_DIR, "minutiae")
+ENDING = 1
+BIFURCATION = 3
+MAX_MINUTIAE = 64
+# Minutiae closer than this to the edge of the finger are mostly artifacts of the boundary.
+BORDER_DISTANCE = 12
+# Skeleton pixels at these distances from a minutia show which way its ridge runs.
+DIRECTION_RADII = (4, 9)
+# Pairs of minutiae closer than this are a broken ridge or a bridge, not real features.
+MIN_SEPARATION = 8
+NEIGHBOURS = 4
+CANDIDATE_PAIRS = 16
+DISTANCE_TOLERANCE = 12.0
+ANGLE_TOLERANCE = np.pi / 12
+# Just above the best impostor pair in ./fingerprints; run fingerprint_engines.py after changing it.
+MIN_MATCHED = 13
+
+MINUTIA_DTYPE = np.dtype([("x", "<u2"), ("y", "<u2"), ("angle", "u1"), ("kind", "u1")])
+TEMPLATE_VERSION = 1
+_HEADER = struct.Struct("<BB4H")
+
+class MinutiaeTemplate(namedtuple("MinutiaeTemplate", ["minutiae", "roi"], defaults=(None,))):
+    """Ridge endings and bifurcations of one image.
+
+    minutiae is a MINUTIA_DTYPE array (6 bytes per minutia): position in the
+    full image, direction quantized to 256 steps over 360 degrees, and
+    kind (ENDING or BIFURCATION). to_bytes() packs it with the ROI into a
+    few hundred bytes.
+    """
+    __slots__ = ()
+
+    def points(self):
+        return np.stack([self.minutiae["x"], self.minutiae["y"]], axis=1).astype(np.float32)
+
+    def angles(self):
+        return self.minutiae["angle"].astype(np.float32) * (2 * np.pi / 256)
+
+    def to_bytes(self):
+        roi = self.roi or (0, 0, 0, 0)
+        return _HEADER.pack(TEMPLATE_VERSION, len(self.minutiae), *roi) + self.minutiae.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, count, x, y, width, height = _HEADER.unpack_from(data)
+        if version != TEMPLATE_VERSION:
+            raise ValueError(f"Unsupported minutiae template version {version}.")
+        minutiae = np.frombuffer(data, MINUTIA_DTYPE, count, _HEADER.size).copy()
+        return cls(minutiae, (x, y, width, height) if width else None)
+
+def _neighbourhood(image):
+    """The 8 neighbours P2..P9 of every pixel, clockwise from north, as views into a padded copy."""
+    padded = np.pad(image, 1)
+    height, width = image.shape
+    offsets = [(0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (1, 0), (0, 0)]
+    return [padded[dy:dy + height, dx:dx + width] for dy, dx in offsets]
+
+def thin(binary):
+    """Zhang-Suen thinning of a boolean ridge image to one-pixel-wide skeletons."""
+    skeleton = binary.astype(np.uint8)
+    while True:
+        changed = False
+        for step in (0, 1):
+            p = _neighbourhood(skeleton)
+            count = sum(p)
+            transitions = sum(((p[i] == 0) & (p[(i + 1) % 8] == 1)).astype(np.uint8) for i in range(8))
+            if step == 0:
+                clear = (p[0] * p[2] * p[4] == 0) & (p[2] * p[4] * p[6] == 0)
+            else:
+                clear = (p[0] * p[2] * p[6] == 0) & (p[0] * p[4] * p[6] == 0)
+            remove = (skeleton == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & clear
+            if remove.any():
+                skeleton[remove] = 0
+                changed = True
+        if not changed:
+            return skeleton.astype(bool)
+
+def crossing_numbers(skeleton):
+    """Crossing number of every skeleton pixel: 1 at ridge endings, 3 at bifurcations."""
+    p = [n.astype(np.int8) for n in _neighbourhood(skeleton.astype(np.uint8))]
+    crossings = sum(np.abs(p[i] - p[(i + 1) % 8]) for i in range(8)) // 2
+    return np.where(skeleton, crossings, 0)
+
+def extract_minutiae(image, max_minutiae=MAX_MINUTIAE):
+    """Extract a MinutiaeTemplate from a grayscale fingerprint image."""
+    processed = preprocess(image, "enhance")
+    ridges = (processed.image < 128) & (processed.mask > 0)
+    skeleton = thin(ridges)
+    crossings = crossing_numbers(skeleton)
+    inside = cv2.distanceTransform(processed.mask, cv2.DIST_L2, 3) > BORDER_DISTANCE
+    ys, xs = np.nonzero(((crossings == ENDING) | (crossings == BIFURCATION)) & inside)
+    kinds = crossings[ys, xs]
+    points = np.stack([xs, ys], axis=1).astype(np.float32)
+
+    if len(points) > 1:
+        distances = np.linalg.norm(points[:, None] - points[None], axis=2)
+        np.fill_diagonal(distances, np.inf)
+        keep = distances.min(axis=1) >= MIN_SEPARATION
+        points, kinds, ys, xs = points[keep], kinds[keep], ys[keep], xs[keep]
+    if len(points) > max_minutiae:
+        # The centre of the finger is captured most reliably.
+        centre = points.mean(axis=0)
+        order = np.argsort(np.linalg.norm(points - centre, axis=1))[:max_minutiae]
+        points, kinds, ys, xs = points[order], kinds[order], ys[order], xs[order]
+
+    # Ridges run perpendicular to the local gradient direction.
+    angles = np.mod(orientation_field(processed.image)[ys, xs] + np.pi / 2, np.pi)
+    angles = _resolve_directions(skeleton, xs, ys, angles)
+    x, y = processed.roi[:2]
+    minutiae = np.empty(len(points), MINUTIA_DTYPE)
+    minutiae["x"] = xs + x
+    minutiae["y"] = ys + y
+    minutiae["angle"] = np.round(angles * (256 / (2 * np.pi))).astype(np.int32) % 256
+    minutiae["kind"] = kinds
+    return MinutiaeTemplate(minutiae, processed.roi)
+
+def _resolve_directions(skeleton, xs, ys, angles):
+    """Turn ridge orientations (modulo 180 degrees) into directions pointing along the minutia's ridge.
+
+    The direction is the one of the two closer to the mean offset of the
+    nearby skeleton pixels: the single ridge of an ending, or the two
+    branches of a bifurcation.
+    """
+    inner, outer = DIRECTION_RADII
+    dy, dx = np.mgrid[-outer:outer + 1, -outer:outer + 1]
+    ring = (dx * dx + dy * dy >= inner * inner) & (dx * dx + dy * dy <= outer * outer)
+    padded = np.pad(skeleton, outer)
+    windows = np.stack([padded[y:y + 2 * outer + 1, x:x + 2 * outer + 1] for x, y in zip(xs, ys)]) \
+        if len(xs) else np.zeros((0, 2 * outer + 1, 2 * outer + 1), bool)
+    weights = windows & ring
+    mean_x = (weights * dx).sum(axis=(1, 2))
+    mean_y = (weights * dy).sum(axis=(1, 2))
+    flip = np.cos(angles) * mean_x + np.sin(angles) * mean_y < 0
+    return np.mod(angles + np.pi * flip, 2 * np.pi)
+
+def _angle_difference(a, b):
+    """Smallest absolute difference between two directions."""
+    d = np.mod(a - b, 2 * np.pi)
+    return np.minimum(d, 2 * np.pi - d)
+
+def local_structures(points, angles, neighbours=NEIGHBOURS):
+    """Rotation and translation invariant description of each minutia by its nearest neighbours.
+
+    Returns (distances, relative directions, relative ridge angles), each of
+    shape (N, neighbours), ordered by distance.
+    """
+    k = min(neighbours, len(points) - 1)
+    offsets = points[None] - points[:, None]
+    distances = np.linalg.norm(offsets, axis=2)
+    np.fill_diagonal(distances, np.inf)
+    nearest = np.argsort(distances, axis=1)[:, :k]
+    rows = np.arange(len(points))[:, None]
+    directions = np.arctan2(offsets[rows, nearest, 1], offsets[rows, nearest, 0])
+    return (distances[rows, nearest],
+            np.mod(directions - angles[:, None], 2 * np.pi),
+            _angle_difference(angles[nearest], angles[:, None]))
+
+def match_minutiae(template1, template2):
+    """Number of minutiae paired under the best alignment of template1 onto template2.
+
+    Pairs of minutiae with similar local structures propose alignments; each
+    proposal rotates and translates all of template1 and counts the
+    minutiae landing near a minutia of template2 with a similar direction,
+    counting each minutia at most once.
+    """
+    n1, n2 = len(template1.minutiae), len(template2.minutiae)
+    if min(n1, n2) <= NEIGHBOURS:
+        return 0
+    points1, points2 = template1.points(), template2.points()
+    angles1, angles2 = template1.angles(), template2.angles()
+    d1, r1, a1 = local_structures(points1, angles1)
+    d2, r2, a2 = local_structures(points2, angles2)
+    cost = (np.abs(d1[:, None] - d2[None]).sum(axis=2) / DISTANCE_TOLERANCE
+            + _angle_difference(r1[:, None], r2[None]).sum(axis=2) / ANGLE_TOLERANCE
+            + np.abs(a1[:, None] - a2[None]).sum(axis=2) / ANGLE_TOLERANCE)
+    best = np.argsort(cost, axis=None)[:CANDIDATE_PAIRS]
+    i, j = np.unravel_index(best, cost.shape)
+
+    rotations = angles2[j] - angles1[i]
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    centred = points1[None] - points1[i][:, None]
+    moved = np.stack([cos[:, None] * centred[..., 0] - sin[:, None] * centred[..., 1],
+                      sin[:, None] * centred[..., 0] + cos[:, None] * centred[..., 1]], axis=2)
+    moved += points2[j][:, None]
+    distances = np.linalg.norm(moved[:, :, None] - points2[None, None], axis=3)
+    turned = _angle_difference(angles1[None, :, None] + rotations[:, None, None], angles2[None, None])
+    close = (distances < DISTANCE_TOLERANCE) & (turned < ANGLE_TOLERANCE)
+    distances = np.where(close, distances, np.inf)
+    # A pairing counts when the two minutiae are each other's nearest candidate.
+    nearest2 = distances.argmin(axis=2)
+    nearest1 = distances.argmin(axis=1)
+    alignments = np.arange(len(rotations))[:, None]
+    mutual = nearest1[alignments, nearest2] == np.arange(n1)[None]
+    paired = mutual & np.isfinite(distances.min(axis=2))
+    return int(paired.sum(axis=1).max())
+
+def verify_minutiae(template1, template2, min_matched=MIN_MATCHED):
+    """Minutiae counterpart of verification.verify_templates; inliers is the number of paired minutiae."""
+    start = time.perf_counter()
+    matched = match_minutiae(template1, template2)
+    timings = {"match": time.perf_counter() - start}
+    return VerificationResult(matched >= min_matched, matched, [], None, timings)
+
+class MinutiaeStore(TemplateStore):
+    """TemplateStore for MinutiaeTemplates, with the same content-hash keys and methods."""
+
+    suffix = ".min"
+    template_class = MinutiaeTemplate
+
+    def __init__(self, directory=MINUTIAE_DIR, max_minutiae=MAX_MINUTIAE):
+        super().__init__(directory, nfeatures=max_minutiae, preprocessing="enhance")
+        self.max_minutiae = max_minutiae
+        self.params = {
+            "detector": "minutiae",
+            "version": TEMPLATE_VERSION,
+            "max_minutiae": max_minutiae,
+            "border_distance": BORDER_DISTANCE,
+            "min_separation": MIN_SEPARATION,
+            "opencv": cv2.__version__,
+            "preprocessing": preprocessing_params("enhance"),
+        }
+        self.params_key = params_key(self.params)
+
+    def extract(self, image):
+        return extract_minutiae(image, self.max_minutiae)
+
+    def _read(self, key):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return MinutiaeTemplate.from_bytes(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _write(self, key, template):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        tmp_path = temp_path(path)
+        with open(tmp_path, "wb") as f:
+            f.write(template.to_bytes())
+        os.replace(tmp_path, path)
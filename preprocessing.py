@@ -0,0 +1,132 @@
+import os
+from collections import namedtuple
+import numpy as np
+import cv2
+
+# none: raw frame; roi: foreground crop and contrast normalization; enhance: roi plus Gabor ridge enhancement.
+MODES = ("none", "roi", "enhance")
+PREPROCESSING = os.environ.get("FINGERPRINT_PREPROCESSING", "roi")
+
+BLOCK_SIZE = 16
+# Blocks whose standard deviation is below this fraction of the frame's are background.
+VARIANCE_THRESHOLD = 0.5
+# Kept around the foreground so ORB can still describe keypoints at its edge.
+ROI_MARGIN = 16
+NORMALIZE_SIGMA = 8
+ORIENTATION_SIGMA = 7
+ORIENTATIONS = 8
+# Gabor wavelength in pixels, tuned on the images in fingerprints/.
+RIDGE_PERIOD = 11
+GABOR_SIGMA = 3.0
+
+Preprocessed = namedtuple("Preprocessed", ["image", "mask", "roi"])
+Preprocessed.__doc__ = """Output of preprocess().
+
+image is the cropped, normalized (and possibly enhanced) uint8 image, mask
+its 0/255 foreground mask, and roi the (x, y, width, height) of the crop in
+the original frame.
+"""
+
+def params(mode=PREPROCESSING):
+    """Settings that determine the output of preprocess(), for cache keys."""
+    if mode == "none":
+        return {"mode": mode}
+    settings = {"mode": mode, "block_size": BLOCK_SIZE, "variance_threshold": VARIANCE_THRESHOLD,
+                "roi_margin": ROI_MARGIN, "normalize_sigma": NORMALIZE_SIGMA}
+    if mode == "enhance":
+        settings.update(orientation_sigma=ORIENTATION_SIGMA, orientations=ORIENTATIONS,
+                        ridge_period=RIDGE_PERIOD, gabor_sigma=GABOR_SIGMA)
+    return settings
+
+def segment(image, block_size=BLOCK_SIZE, threshold=VARIANCE_THRESHOLD):
+    """Foreground mask (uint8, 0 or 255) from the standard deviation of each block.
+
+    Isolated blocks are dropped and holes closed, and only the largest
+    region is kept, so specks and streaks on the sensor glass do not count
+    as finger.
+    """
+    height, width = image.shape
+    rows, cols = height // block_size, width // block_size
+    blocks = image[:rows * block_size, :cols * block_size].astype(np.float32)
+    blocks = blocks.reshape(rows, block_size, cols, block_size)
+    block_std = blocks.std(axis=(1, 3))
+    foreground = (block_std > threshold * max(float(image.std()), 1.0)).astype(np.uint8)
+    kernel = np.ones((3, 3), np.uint8)
+    foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, kernel)
+    foreground = cv2.morphologyEx(foreground, cv2.MORPH_CLOSE, kernel)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=4)
+    if count > 1:
+        largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+        foreground = (labels == largest).astype(np.uint8)
+    mask = np.zeros((height, width), np.uint8)
+    mask[:rows * block_size, :cols * block_size] = np.kron(foreground, np.ones((block_size, block_size), np.uint8))
+    return mask * 255
+
+def roi_box(mask, margin=ROI_MARGIN):
+    """(x, y, width, height) around the mask's foreground plus margin, or the whole frame if empty."""
+    height, width = mask.shape
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return 0, 0, width, height
+    x, y, w, h = cv2.boundingRect(points)
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x1, y1 = min(x + w + margin, width), min(y + h + margin, height)
+    return x0, y0, x1 - x0, y1 - y0
+
+def normalize_contrast(image, sigma=NORMALIZE_SIGMA):
+    """Local mean and variance normalization, evening out pressure and illumination."""
+    image = image.astype(np.float32)
+    mean = cv2.GaussianBlur(image, (0, 0), sigma)
+    variance = cv2.GaussianBlur(image * image, (0, 0), sigma) - mean * mean
+    normalized = (image - mean) / np.sqrt(np.maximum(variance, 1.0))
+    return np.clip(normalized * 64 + 128, 0, 255).astype(np.uint8)
+
+def orientation_field(image, sigma=ORIENTATION_SIGMA):
+    """Per-pixel angle (radians) of the ridge normal, from smoothed gradient moments."""
+    image = image.astype(np.float32)
+    gx = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3)
+    gxx = cv2.GaussianBlur(gx * gx, (0, 0), sigma)
+    gyy = cv2.GaussianBlur(gy * gy, (0, 0), sigma)
+    gxy = cv2.GaussianBlur(gx * gy, (0, 0), sigma)
+    return 0.5 * np.arctan2(2 * gxy, gxx - gyy)
+
+def _gabor_bank(orientations, period, sigma):
+    size = int(3 * sigma) * 2 + 1
+    kernels = []
+    for theta in np.arange(orientations) * np.pi / orientations:
+        kernel = cv2.getGaborKernel((size, size), sigma, theta, period, 1.0, 0)
+        kernels.append(kernel - kernel.mean())
+    return kernels
+
+def enhance_ridges(image, orientations=ORIENTATIONS, period=RIDGE_PERIOD, sigma=GABOR_SIGMA):
+    """Gabor filtering along the local ridge orientation.
+
+    The image is filtered once per orientation of the bank and each pixel
+    takes the response of the filter closest to its own orientation.
+    """
+    angles = orientation_field(image)
+    bins = np.round(np.mod(angles, np.pi) / (np.pi / orientations)).astype(np.intp) % orientations
+    source = image.astype(np.float32) - 128
+    responses = np.stack([cv2.filter2D(source, cv2.CV_32F, kernel)
+                          for kernel in _gabor_bank(orientations, period, sigma)])
+    enhanced = np.take_along_axis(responses, bins[None], axis=0)[0]
+    scale = 127 / max(float(np.abs(enhanced).max()), 1e-6)
+    return np.clip(enhanced * scale + 128, 0, 255).astype(np.uint8)
+
+def preprocess(image, mode=PREPROCESSING):
+    """Segment, crop and normalize a grayscale fingerprint image for feature extraction."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown preprocessing mode {mode!r}; choose one of {', '.join(MODES)}.")
+    height, width = image.shape
+    if mode == "none":
+        return Preprocessed(image, None, (0, 0, width, height))
+    mask = segment(image)
+    x, y, w, h = roi_box(mask)
+    image, mask = image[y:y + h, x:x + w], mask[y:y + h, x:x + w]
+    processed = normalize_contrast(image)
+    if mode == "enhance":
+        processed = enhance_ridges(processed)
+    # Background inside the crop is flattened so it yields no keypoints.
+    processed[mask == 0] = 128
+    return Preprocessed(processed, mask, (x, y, w, h))
@@ -1,17 +1,57 @@
-import sqlite3
+import sys
+import csv
+import json
+import argparse
+from fingerprint_db import FingerprintDB, DB_PATH, BATCH_SIZE, SCHEMA_VERSION
 
-# Connect to the database
-conn = sqlite3.connect('trialdb.db')
-cursor = conn.cursor()
+PRINT_COLUMNS = ("username", "password", "droneid", "pilotid", "address", "timestamp")
+TEMPLATE_COLUMNS = ("pilotid", "engine", "params_key", "image_hash", "bytes", "created")
 
-# Example: Select all rows from the users table where username is 'john_doe'
-cursor.execute('SELECT username,password,droneid,pilotid,address,timestamp FROM fingerprints')
-# cursor.execute('DROP TABLE fingerprints')
-rows = cursor.fetchall()
+def export(rows, columns, output, fmt):
+    """Write rows to output as they arrive; nothing is held in memory."""
+    if fmt == "csv":
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+    elif fmt == "jsonl":
+        for row in rows:
+            output.write(json.dumps({column: row[column] for column in columns}) + "\n")
+    else:
+        for row in rows:
+            print(tuple(row[column] for column in columns), file=output)
 
-# Print the retrieved data
-for row in rows:
-    print(row)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the pilots (or stored templates) of trialdb.db.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--format", choices=("rows", "csv", "jsonl"), default="rows",
+                        help="rows prints one tuple per pilot (default)")
+    parser.add_argument("--output", help="write here instead of stdout")
+    parser.add_argument("--columns", help=f"comma-separated columns (default {','.join(PRINT_COLUMNS)})")
+    parser.add_argument("--templates", action="store_true", help="list the stored templates instead of the pilots")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows fetched at a time")
+    args = parser.parse_args(argv)
 
-# Close the connection
-conn.close()
\ No newline at end of file
+    # Exporting never changes the database: it is opened read-only.
+    with FingerprintDB(args.db, batch_size=args.batch_size, readonly=True) as db:
+        if args.templates:
+            if db.schema_version < SCHEMA_VERSION:
+                parser.error(f"{args.db} has no templates table yet; run python fingerprint_db.py first.")
+            columns = TEMPLATE_COLUMNS
+            rows = db.iter_rows("SELECT pilotid, engine, params_key, image_hash, length(template) AS bytes, "
+                                "created FROM templates ORDER BY pilotid, params_key")
+        else:
+            columns = tuple(args.columns.split(",")) if args.columns else PRINT_COLUMNS
+            try:
+                rows = db.iter_pilots(columns)
+            except ValueError as e:
+                parser.error(str(e))
+        output = open(args.output, "w", newline="") if args.output else sys.stdout
+        try:
+            export(rows, columns, output, args.format)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import sys
+import argparse
+import numpy as np
+import adafruit_fingerprint
+from sensor_session import SensorSession
+
+DELETE_MODEL = 0x0C
+# Template buffer used for transfers; buffer 2 is left to enrollment.
+TRANSFER_BUFFER = 1
+
+class LibraryError(RuntimeError):
+    pass
+
+def check_code(code, action):
+    if code != adafruit_fingerprint.OK:
+        raise LibraryError(f"{action} failed (sensor code 0x{code:02X}).")
+
+def library_status(finger):
+    """Template count, occupied slots and capacity, read from the sensor's index table."""
+    check_code(finger.count_templates(), "Reading the template count")
+    check_code(finger.read_templates(), "Reading the template index")
+    return {"count": finger.template_count, "slots": sorted(finger.templates), "capacity": finger.library_size}
+
+def slot_runs(slots):
+    """Group slot numbers into (start, count) runs of consecutive slots."""
+    runs = []
+    for slot in sorted(set(slots)):
+        if runs and runs[-1][0] + runs[-1][1] == slot:
+            runs[-1][1] += 1
+        else:
+            runs.append([slot, 1])
+    return [tuple(run) for run in runs]
+
+def empty_library(finger):
+    """Wipe the whole library with one Empty command. Returns the number of templates removed."""
+    count = library_status(finger)["count"]
+    if count:
+        check_code(finger.empty_library(), "Emptying the library")
+    return count
+
+def delete_slots(finger, slots):
+    """Delete the occupied slots among slots; free ones are skipped.
+
+    Consecutive slots go out as a single Delete command. Returns the slots
+    that were deleted.
+    """
+    occupied = sorted(set(slots) & set(library_status(finger)["slots"]))
+    for start, count in slot_runs(occupied):
+        finger._send_packet([DELETE_MODEL, start >> 8, start & 0xFF, count >> 8, count & 0xFF])
+        check_code(finger._get_packet(12)[0], f"Deleting slots {start}-{start + count - 1}")
+    return occupied
+
+def download_templates(finger, slots=None):
+    """Read templates off the sensor. Returns {slot: template bytes} for the occupied slots."""
+    occupied = library_status(finger)["slots"]
+    if slots is not None:
+        occupied = sorted(set(slots) & set(occupied))
+    templates = {}
+    for slot in occupied:
+        check_code(finger.load_model(slot, TRANSFER_BUFFER), f"Loading slot {slot}")
+        templates[slot] = bytes(finger.get_fpdata("char", TRANSFER_BUFFER))
+    return templates
+
+def upload_templates(finger, templates):
+    """Write {slot: template bytes} into the sensor's library, overwriting those slots."""
+    for slot, template in sorted(templates.items()):
+        finger.send_fpdata(list(template), "char", TRANSFER_BUFFER)
+        check_code(finger.store_model(slot, TRANSFER_BUFFER), f"Storing slot {slot}")
+
+def backup(finger, path, slots=None):
+    """Save the sensor's templates to an .npz file. Returns the number saved."""
+    templates = download_templates(finger, slots)
+    size = max((len(template) for template in templates.values()), default=0)
+    data = np.zeros((len(templates), size), np.uint8)
+    for row, template in enumerate(templates.values()):
+        data[row, :len(template)] = np.frombuffer(template, np.uint8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, slots=np.array(list(templates), np.int32), templates=data)
+    os.replace(tmp_path, path)
+    return len(templates)
+
+def load_backup(path):
+    with np.load(path) as data:
+        return {int(slot): data["templates"][row].tobytes() for row, slot in enumerate(data["slots"])}
+
+def restore(finger, path, replace=False):
+    """Write the templates of a backup back to their slots. Returns the number restored.
+
+    With replace set, the library is emptied first so it ends up exactly
+    as backed up; otherwise templates in other slots are kept.
+    """
+    templates = load_backup(path)
+    if replace:
+        empty_library(finger)
+    upload_templates(finger, templates)
+    return len(templates)
+
+def parse_slots(values):
+    """Slot arguments such as 5 or 10-20 into a list of slot numbers."""
+    slots = []
+    for value in values:
+        start, _, end = value.partition("-")
+        slots.extend(range(int(start), int(end or start) + 1))
+    return slots
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, wipe, back up and restore the sensor's template library.")
+    parser.add_argument("--port", help="serial port of the sensor (default: FINGERPRINT_SENSOR_PORT)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show the template count and occupied slots")
+    commands.add_parser("empty", help="delete every template")
+    delete = commands.add_parser("delete", help="delete templates in the given slots, e.g. 3 10-20")
+    delete.add_argument("slots", nargs="+")
+    save = commands.add_parser("backup", help="save the templates to an .npz file")
+    save.add_argument("path")
+    save.add_argument("--slots", nargs="+", help="only these slots")
+    load = commands.add_parser("restore", help="write the templates of a backup back to the sensor")
+    load.add_argument("path")
+    load.add_argument("--replace", action="store_true", help="empty the library first")
+    args = parser.parse_args(argv)
+
+    session_args = {"port": args.port} if args.port else {}
+    with SensorSession(timeout=2, settle_time=1, **session_args) as session:
+        finger = session.finger
+        if args.command == "status":
+            status = library_status(finger)
+            print(f"{status['count']} of {status['capacity']} slots in use: "
+                  + ", ".join(f"{start}" if count == 1 else f"{start}-{start + count - 1}"
+                              for start, count in slot_runs(status["slots"])))
+        elif args.command == "empty":
+            print(f"Deleted {empty_library(finger)} templates.")
+        elif args.command == "delete":
+            deleted = delete_slots(finger, parse_slots(args.slots))
+            print(f"Deleted {len(deleted)} templates: {deleted}")
+        elif args.command == "backup":
+            slots = parse_slots(args.slots) if args.slots else None
+            print(f"Saved {backup(finger, args.path, slots)} templates to {args.path}.")
+        elif args.command == "restore":
+            print(f"Restored {restore(finger, args.path, args.replace)} templates from {args.path}.")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
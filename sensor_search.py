@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+import adafruit_fingerprint
+from sensor_library import library_status, delete_slots, LibraryError, check_code
+
+SLOT_MAP = "sensor_slots.json"
+# Sensor search hits scoring below this go through host matching instead.
+MIN_CONFIDENCE = int(os.environ.get("FINGERPRINT_SENSOR_MIN_CONFIDENCE", "50"))
+SEARCH_BUFFER = 1
+
+SensorMatch = namedtuple("SensorMatch", "pilotid slot confidence")
+
+def load_frame(image):
+    """A 288x256 grayscale frame from a path or an array, as the sensor's image buffer holds it."""
+    import cv2
+    from frame_decoder import FRAME_HEIGHT, FRAME_WIDTH
+    if isinstance(image, str):
+        path, image = image, cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise FileNotFoundError(f"Image at path {path} not found.")
+    if image.shape != (FRAME_HEIGHT, FRAME_WIDTH):
+        image = cv2.resize(image, (FRAME_WIDTH, FRAME_HEIGHT), interpolation=cv2.INTER_AREA)
+    return image
+
+class SensorSearch:
+    """Enrolled pilots' templates kept in the sensor's flash, for its on-chip 1:N search.
+
+    enroll() downloads a pilot's enrolled image into the sensor, has the
+    sensor extract its own template from it and stores that in a free slot.
+    The pilotid to slot map is kept in path together with a hash of the
+    image, so a pilot whose image has not changed and whose slot is still
+    occupied on the sensor is not written again; a library wiped since is
+    refilled. Slots are numbered from 1, as in erase_sensor_memory.py.
+    search() turns the image just captured into a template and runs the
+    sensor's fast search; only hits on mapped slots with at least
+    min_confidence are returned, everything else is left to host matching.
+
+    All methods talk to the sensor and must run on the thread that owns it
+    (CaptureService.run or a capture's prematch).
+    """
+
+    def __init__(self, path=SLOT_MAP, min_confidence=MIN_CONFIDENCE):
+        self.path = path
+        self.min_confidence = min_confidence
+        self.slots = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.slots = json.load(f)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.slots, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def pilot_at(self, slot):
+        return next((pilotid for pilotid, entry in self.slots.items() if entry["slot"] == slot), None)
+
+    def enroll(self, finger, pilotid, image):
+        """Store the template of pilotid's enrolled image (path or array) on the sensor. Returns its slot."""
+        from frame_decoder import encode_frame
+        pilotid = str(pilotid)
+        payload = encode_frame(load_frame(image))
+        image_hash = hashlib.sha256(payload).hexdigest()
+        entry = self.slots.get(pilotid)
+        status = library_status(finger)
+        if entry is not None and entry["hash"] == image_hash and entry["slot"] in status["slots"]:
+            return entry["slot"]
+        slot = entry["slot"] if entry is not None else self._free_slot(status)
+        finger.send_fpdata(list(payload), "image")
+        check_code(finger.image_2_tz(SEARCH_BUFFER), f"Extracting the template of pilot {pilotid}")
+        check_code(finger.store_model(slot, SEARCH_BUFFER), f"Storing pilot {pilotid} in slot {slot}")
+        self.slots[pilotid] = {"slot": slot, "hash": image_hash}
+        self._save()
+        return slot
+
+    def _free_slot(self, status):
+        used = set(status["slots"]) | {entry["slot"] for entry in self.slots.values()}
+        for slot in range(1, status["capacity"]):
+            if slot not in used:
+                return slot
+        raise LibraryError("The sensor's template library is full.")
+
+    def remove(self, finger, pilotid):
+        entry = self.slots.pop(str(pilotid), None)
+        if entry is not None:
+            delete_slots(finger, [entry["slot"]])
+            self._save()
+
+    def search(self, finger, allowed=None):
+        """Search the library for the image captured last. Returns a SensorMatch or None.
+
+        allowed limits hits to those pilotids (for example the signed-in
+        ones), so the sensor never accepts a finger host matching would not.
+        """
+        if finger.image_2_tz(SEARCH_BUFFER) != adafruit_fingerprint.OK:
+            return None
+        if finger.finger_fast_search() != adafruit_fingerprint.OK:
+            return None
+        pilotid = self.pilot_at(finger.finger_id)
+        if pilotid is None or (allowed is not None and pilotid not in {str(p) for p in allowed}):
+            return None
+        if finger.confidence < self.min_confidence:
+            print(f"Sensor match for pilot {pilotid} too weak (confidence {finger.confidence}).")
+            return None
+        return SensorMatch(pilotid, finger.finger_id, finger.confidence)
@@ -0,0 +1,95 @@
+import os
+import threading
+import startup_profile
+import instrumentation
+
+SENSOR_PORT = os.environ.get("FINGERPRINT_SENSOR_PORT", "COM4")
+SENSOR_BAUDRATE = 57600
+# Rate the link is raised to once connected, e.g. 115200. The sensor stores it in flash,
+# so it is opt-in; 0 keeps the sensor's current rate.
+SENSOR_TARGET_BAUDRATE = int(os.environ.get("FINGERPRINT_SENSOR_TARGET_BAUDRATE", "0"))
+
+class SensorSession:
+    """Lazily opened, reusable connection to the AS608 fingerprint sensor.
+
+    Nothing touches the serial port until .finger is first used, so the
+    application starts (and shows its window) without the sensor plugged
+    in. A failed connection is retried on the next use, and after a serial
+    error mid-session (e.g. the sensor was unplugged) the owner calls
+    close() so the next use reconnects. The link itself is a
+    SensorTransport, which negotiates the packet size (and the baud rate,
+    if a target is set) and verifies image transfers; factory replaces it
+    with any callable returning an Adafruit_Fingerprint-like object, and a
+    port of the form sim:<directory> uses a SimulatedSensor replaying that
+    directory.
+    """
+
+    def __init__(self, port=SENSOR_PORT, baudrate=SENSOR_BAUDRATE, timeout=1, settle_time=0, factory=None,
+                 target_baudrate=SENSOR_TARGET_BAUDRATE):
+        self.port = port
+        self.baudrate = baudrate
+        self.target_baudrate = target_baudrate
+        self.timeout = timeout
+        self.settle_time = settle_time
+        self.factory = factory
+        self.uart = None
+        self.transport = None
+        self._finger = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._finger is not None
+
+    @property
+    def finger(self):
+        """The Adafruit_Fingerprint object, connecting on first access."""
+        if self._finger is None:
+            self.open()
+        return self._finger
+
+    def open(self):
+        with self._lock:
+            if self._finger is not None:
+                return self._finger
+            with startup_profile.phase("sensor connection"):
+                if self.factory is not None:
+                    self._finger = self.factory()
+                elif self.port.startswith("sim:"):
+                    from simulated_sensor import SimulatedSensor
+                    self._finger = SimulatedSensor(self.port[4:] or "./fingerprints")
+                else:
+                    self._finger = self._connect()
+            return self._finger
+
+    def _connect(self):
+        from sensor_transport import SensorTransport
+
+        transport = SensorTransport(self.port, baudrate=self.baudrate, target_baudrate=self.target_baudrate,
+                                    timeout=self.timeout, settle_time=self.settle_time)
+        finger = transport.connect()
+        self.transport = transport
+        self.uart = transport.uart
+        return finger
+
+    def upload_image(self):
+        """Transfer the image captured by get_image() and return the packed payload."""
+        finger = self.finger
+        with instrumentation.span("sensor.get_fpdata"):
+            if self.transport is not None:
+                return self.transport.upload_image()
+            return finger.get_fpdata("image", 2)
+
+    def close(self):
+        with self._lock:
+            if self.transport is not None:
+                self.transport.close()
+            self.uart = None
+            self.transport = None
+            self._finger = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
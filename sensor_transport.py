@@ -0,0 +1,185 @@
+import struct
+import time
+import serial
+import adafruit_fingerprint
+from frame_decoder import PACKED_SIZE
+
+STARTCODE = b"\xef\x01"
+COMMAND_PACKET = 0x01
+DATA_PACKET = 0x02
+ACK_PACKET = 0x07
+END_PACKET = 0x08
+UPLOAD_IMAGE = 0x0A
+
+# System parameter numbers for SetSysPara; the baud rate is stored as N * 9600
+# and the data packet size as an index into PACKET_SIZES.
+SYSPARAM_BAUDRATE = 4
+SYSPARAM_PACKET_SIZE = 6
+PACKET_SIZES = (32, 64, 128, 256)
+BAUD_RATES = tuple(9600 * n for n in range(12, 0, -1))
+
+# Fastest rate the AS608 supports; sessions raise the link to it only when asked.
+TARGET_BAUDRATE = 115200
+TARGET_PACKET_SIZE = 256
+# Read timeout while looking for the sensor, so each wrong rate fails fast.
+PROBE_TIMEOUT = 0.2
+TRANSFER_RETRIES = 3
+DRAIN_TIMEOUT = 0.05
+
+class TransferError(RuntimeError):
+    """Raised when an image transfer cannot be completed."""
+
+def packet_checksum(packet_type, payload):
+    """Checksum of a sensor packet: packet type, length and payload bytes, modulo 2**16."""
+    length = len(payload) + 2
+    return (packet_type + (length >> 8) + (length & 0xFF) + sum(payload)) & 0xFFFF
+
+class SensorTransport:
+    """Serial link to the AS608 that negotiates its speed and verifies image transfers.
+
+    connect() finds the sensor at whatever baud rate it was left at, then
+    raises the data packet size and, if target_baudrate is given, the baud
+    rate to the targets through the sensor's system parameters (both are
+    stored in the sensor's flash) and switches the port to the new rate. upload_image() checks the checksum of
+    every data packet. The sensor has no command to resend part of an image,
+    so a failed transfer is retried by uploading the image buffer again
+    (the finger does not have to be placed again) and only the packets that
+    failed are taken from the new stream.
+    """
+
+    def __init__(self, port, baudrate=57600, target_baudrate=None,
+                 target_packet_size=TARGET_PACKET_SIZE, timeout=1, settle_time=0, retries=TRANSFER_RETRIES):
+        self.port = port
+        self.baudrate = baudrate
+        self.target_baudrate = target_baudrate
+        self.target_packet_size = target_packet_size
+        self.timeout = timeout
+        self.settle_time = settle_time
+        self.retries = retries
+        self.uart = None
+        self.finger = None
+        self.last_transfer = None
+
+    @property
+    def packet_size(self):
+        return PACKET_SIZES[self.finger.data_packet_size]
+
+    def connect(self):
+        """Open the port, find the sensor's current baud rate and negotiate the link."""
+        uart = serial.Serial(self.port, baudrate=self.baudrate, timeout=self.timeout)
+        try:
+            if self.settle_time:
+                time.sleep(self.settle_time)
+            self.uart = uart
+            self.finger = self._probe()
+            self.negotiate()
+        except Exception:
+            uart.close()
+            self.uart = self.finger = None
+            raise
+        return self.finger
+
+    def _probe(self):
+        # A sensor raised to the target rate before keeps it in flash, so try that first,
+        # then the configured rate, then every other rate.
+        rates = [self.target_baudrate, self.baudrate] + list(BAUD_RATES)
+        self.uart.timeout = min(self.timeout, PROBE_TIMEOUT)
+        try:
+            for rate in dict.fromkeys(rate for rate in rates if rate):
+                self._set_baudrate(rate)
+                try:
+                    return adafruit_fingerprint.Adafruit_Fingerprint(self.uart)
+                except Exception:
+                    continue
+        finally:
+            self.uart.timeout = self.timeout
+        raise RuntimeError(f"Failed to find sensor on {self.port}, check wiring!")
+
+    def _set_baudrate(self, rate):
+        self.uart.baudrate = rate
+        self.baudrate = rate
+        self._drain()
+
+    def negotiate(self):
+        """Raise the baud rate and data packet size to the targets if the sensor accepts them."""
+        finger = self.finger
+        if self.target_packet_size and self.packet_size != self.target_packet_size:
+            try:
+                finger.set_sysparam(SYSPARAM_PACKET_SIZE, PACKET_SIZES.index(self.target_packet_size))
+            except RuntimeError:
+                pass
+        if self.target_baudrate and self.baudrate != self.target_baudrate:
+            previous = self.baudrate
+            try:
+                # The sensor acknowledges at the old rate and switches afterwards.
+                finger.set_sysparam(SYSPARAM_BAUDRATE, self.target_baudrate // 9600)
+            except RuntimeError:
+                return
+            self._set_baudrate(self.target_baudrate)
+            try:
+                ok = finger.verify_password() == adafruit_fingerprint.OK
+            except RuntimeError:
+                ok = False
+            if not ok:
+                self._set_baudrate(previous)
+                finger.verify_password()
+        finger.read_sysparam()
+
+    def upload_image(self):
+        """Transfer the sensor's image buffer and return the 36864-byte packed payload."""
+        size = self.packet_size
+        packets = [None] * (PACKED_SIZE // size)
+        start = time.perf_counter()
+        failed = 0
+        for attempt in range(self.retries + 1):
+            self._request_upload()
+            self._read_packets(packets, size)
+            missing = packets.count(None)
+            if not missing:
+                self.last_transfer = {"seconds": time.perf_counter() - start, "attempts": attempt + 1,
+                                      "failed_packets": failed, "baudrate": self.baudrate, "packet_size": size}
+                return b"".join(packets)
+            failed += missing
+        raise TransferError(f"{missing} of {len(packets)} image packets were still corrupt after {self.retries} retries.")
+
+    def _request_upload(self):
+        self._drain()
+        self.finger._send_packet([UPLOAD_IMAGE])
+        if self.finger._get_packet(12)[0] != adafruit_fingerprint.OK:
+            raise TransferError("Sensor refused to upload the image.")
+
+    def _read_packets(self, packets, size):
+        """Fill the empty slots of packets from one upload stream; keep slots already verified."""
+        address = bytes(self.finger.address)
+        for index in range(len(packets)):
+            header = self.uart.read(9)
+            if len(header) != 9 or header[:2] != STARTCODE or header[2:6] != address:
+                # Framing is lost; the remaining slots are retried on the next upload.
+                self._drain()
+                return
+            packet_type, length = struct.unpack(">BH", header[6:9])
+            body = self.uart.read(length)
+            if len(body) != length or length != size + 2 or packet_type not in (DATA_PACKET, END_PACKET):
+                self._drain()
+                return
+            payload = body[:-2]
+            if packets[index] is None and packet_checksum(packet_type, payload) == struct.unpack(">H", body[-2:])[0]:
+                packets[index] = payload
+            if packet_type == END_PACKET:
+                return
+
+    def _drain(self):
+        """Discard whatever the sensor is still sending."""
+        timeout = self.uart.timeout
+        self.uart.timeout = DRAIN_TIMEOUT
+        try:
+            while self.uart.read(4096):
+                pass
+        finally:
+            self.uart.timeout = timeout
+
+    def close(self):
+        if self.uart is not None:
+            self.uart.close()
+        self.uart = None
+        self.finger = None
@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+import cv2
+from frame_decoder import encode_frame
+
+OK = 0x00
+NOFINGER = 0x02
+NOTFOUND = 0x09
+BADLOCATION = 0x0B
+
+PACKET_SIZES = (32, 64, 128, 256)
+# Start code, address, packet type, length and checksum around every payload.
+PACKET_OVERHEAD = 11
+COMMAND_BYTES = 12
+BITS_PER_BYTE = 10
+# Time the AS608 takes to expose and store an image after GetImage.
+IMAGE_CAPTURE_SECONDS = 0.15
+# Rough on-chip processing times: feature extraction, and search per stored template.
+EXTRACT_SECONDS = 0.1
+SEARCH_SECONDS_PER_TEMPLATE = 0.0003
+MATCH_SCORE = 120
+
+class SimulatedSensor:
+    """In-process stand-in for adafruit_fingerprint.Adafruit_Fingerprint.
+
+    Replays the images of a directory (or a list of 288x256 frames) as
+    successive captures and sleeps for the time each command and reply
+    would spend on the UART at the configured baud rate and packet size,
+    scaled by time_scale (0 runs at full speed). A finger is reported
+    touch_delay seconds after the first get_image() of a capture.
+    Images can also be downloaded into the sensor and stored as templates
+    for its search, which (like fake_sensor) only finds templates made
+    from exactly the same image.
+
+    Use it as SensorSession(factory=...) or set FINGERPRINT_SENSOR_PORT to
+    sim:<directory>.
+    """
+
+    def __init__(self, frames="./fingerprints", baudrate=115200, packet_size=256, touch_delay=0.0,
+                 time_scale=1.0, library_size=127):
+        if isinstance(frames, str):
+            paths = sorted(os.path.join(frames, f) for f in os.listdir(frames))
+            frames = [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in paths]
+            frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            raise ValueError("SimulatedSensor needs at least one frame.")
+        self.payloads = [encode_frame(frame) for frame in frames]
+        self.baudrate = baudrate // 9600
+        self.data_packet_size = PACKET_SIZES.index(packet_size)
+        self.touch_delay = touch_delay
+        self.time_scale = time_scale
+        self.library_size = library_size
+        self.status_register = 0
+        self.system_id = 0
+        self.security_level = 3
+        self.device_address = b"\xff\xff\xff\xff"
+        self.address = [0xFF, 0xFF, 0xFF, 0xFF]
+        self.library = {}
+        self.templates = []
+        self.template_count = 0
+        self.finger_id = None
+        self.confidence = None
+        self._char_buffers = {}
+        self.captures = 0
+        self._image = None
+        self._touch_at = None
+
+    def _wire(self, payload_bytes, packets=1):
+        """Sleep for the time payload_bytes in the given number of packets take on the UART."""
+        if self.time_scale:
+            nbytes = COMMAND_BYTES + payload_bytes + packets * PACKET_OVERHEAD
+            time.sleep(nbytes * BITS_PER_BYTE / (self.baudrate * 9600) * self.time_scale)
+
+    def _command(self, reply_payload=1):
+        self._wire(reply_payload)
+
+    def verify_password(self):
+        self._command()
+        return OK
+
+    def read_sysparam(self):
+        self._command(17)
+        return OK
+
+    def set_sysparam(self, param_num, param_val):
+        self._command()
+        if param_num == 4:
+            self.baudrate = param_val
+        elif param_num == 5:
+            self.security_level = param_val
+        elif param_num == 6:
+            self.data_packet_size = param_val
+        return OK
+
+    def _sleep(self, seconds):
+        if self.time_scale:
+            time.sleep(seconds * self.time_scale)
+
+    def count_templates(self):
+        self._command(3)
+        self.template_count = len(self.library)
+        return OK
+
+    def read_templates(self):
+        self._command(33)
+        self.templates = sorted(self.library)
+        return OK
+
+    def image_2_tz(self, slot=1):
+        self._command()
+        if self._image is None:
+            return NOFINGER
+        self._sleep(EXTRACT_SECONDS)
+        self._char_buffers[slot] = hashlib.sha256(self._image).digest()
+        return OK
+
+    def store_model(self, location, slot=1):
+        self._command()
+        if not 0 <= location < self.library_size:
+            return BADLOCATION
+        self.library[location] = self._char_buffers[slot]
+        return OK
+
+    def finger_fast_search(self):
+        self._command(5)
+        self._sleep(SEARCH_SECONDS_PER_TEMPLATE * len(self.library))
+        template = self._char_buffers.get(1)
+        slot = next((slot for slot in sorted(self.library) if self.library[slot] == template), None)
+        if slot is None:
+            self.finger_id, self.confidence = 0, 0
+            return NOTFOUND
+        self.finger_id, self.confidence = slot, MATCH_SCORE
+        return OK
+
+    finger_search = finger_fast_search
+
+    def get_image(self):
+        self._command()
+        now = time.monotonic()
+        if self._touch_at is None:
+            self._touch_at = now + self.touch_delay
+        if now < self._touch_at:
+            return NOFINGER
+        if self.time_scale:
+            time.sleep(IMAGE_CAPTURE_SECONDS * self.time_scale)
+        self._image = self.payloads[self.captures % len(self.payloads)]
+        self.captures += 1
+        self._touch_at = None
+        return OK
+
+    def get_fpdata(self, sensorbuffer="char", slot=1):
+        if sensorbuffer != "image":
+            raise RuntimeError("SimulatedSensor only uploads images.")
+        if self._image is None:
+            raise RuntimeError("Failed to read data from sensor")
+        packet_size = PACKET_SIZES[self.data_packet_size]
+        self._wire(len(self._image), len(self._image) // packet_size + 1)
+        return list(self._image)
+
+    def send_fpdata(self, data, sensorbuffer="char", slot=1):
+        if sensorbuffer != "image":
+            raise RuntimeError("SimulatedSensor only downloads images.")
+        packet_size = PACKET_SIZES[self.data_packet_size]
+        self._wire(len(data), len(data) // packet_size + 1)
+        self._image = bytes(data)
+        return True
+
+    def close_uart(self):
+        pass
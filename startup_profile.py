@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Enabled with --profile-startup on the command line or FINGERPRINT_PROFILE_STARTUP=1.
+enabled = "--profile-startup" in sys.argv or os.environ.get("FINGERPRINT_PROFILE_STARTUP") == "1"
+
+_process_start = time.perf_counter()
+phases = []
+
+@contextmanager
+def phase(name):
+    """Time a startup or first-use phase; free when profiling is disabled."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def record(name, seconds):
+    """Record a phase duration measured elsewhere."""
+    if enabled:
+        phases.append((name, seconds))
+        print(f"[startup] {name}: {seconds * 1000:.1f} ms (t+{(time.perf_counter() - _process_start) * 1000:.1f} ms)")
+
+def since_start():
+    """Seconds since this module was first imported."""
+    return time.perf_counter() - _process_start
@@ -0,0 +1,178 @@
+import os
+import sys
+import itertools
+import numpy as np
+import cv2
+from template_store import Template, TemplateStore, ORB_NFEATURES
+from verification import match_descriptors
+from descriptor_index import hamming_distances
+from geometry import estimate_transform
+
+# Fused templates stay within ORB's own feature budget, so the match
+# cascade's keypoint count test still compares like with like.
+MAX_FUSED_FEATURES = ORB_NFEATURES
+# An impression needs this many RANSAC inliers against the anchor to be merged.
+MIN_ALIGN_INLIERS = 12
+ALIGN_REPROJ_THRESHOLD = 5.0
+# A keypoint this close to an already fused one, with a similar descriptor, is the same feature.
+DEDUP_RADIUS = 4.0
+DEDUP_HAMMING = 64
+
+class FusionError(ValueError):
+    pass
+
+def align(template, anchor, min_inliers=MIN_ALIGN_INLIERS):
+    """Similarity transform taking template's keypoints onto anchor's.
+
+    Returns (2x3 matrix, inlier count), or None when the two do not overlap
+    enough to be aligned.
+    """
+    if template.descriptors is None or anchor.descriptors is None:
+        return None
+    matches = match_descriptors(template.descriptors, anchor.descriptors)
+    if len(matches) < min_inliers:
+        return None
+    query_idx = np.fromiter((m.queryIdx for m in matches), np.intp, len(matches))
+    train_idx = np.fromiter((m.trainIdx for m in matches), np.intp, len(matches))
+    M, inliers = estimate_transform(template.keypoints[query_idx, :2], anchor.keypoints[train_idx, :2],
+                                    "similarity", ALIGN_REPROJ_THRESHOLD)
+    if M is None or inliers.sum() < min_inliers:
+        return None
+    return M, int(inliers.sum())
+
+def transform_keypoints(keypoints, M):
+    """Apply a similarity transform to keypoint positions, sizes and angles."""
+    moved = keypoints.copy()
+    moved[:, :2] = keypoints[:, :2] @ M[:, :2].T + M[:, 2]
+    moved[:, 2] *= np.sqrt(abs(np.linalg.det(M[:, :2])))
+    moved[:, 3] = np.mod(keypoints[:, 3] + np.degrees(np.arctan2(M[1, 0], M[0, 0])), 360)
+    return moved
+
+def _transform_roi(roi, M):
+    x, y, width, height = roi
+    corners = np.array([[x, y], [x + width, y], [x, y + height], [x + width, y + height]], np.float32)
+    return corners @ M[:, :2].T + M[:, 2]
+
+def fuse_templates(templates, max_features=MAX_FUSED_FEATURES, min_inliers=MIN_ALIGN_INLIERS):
+    """Merge the templates of several impressions of one finger into one Template.
+
+    The impression that aligns best with the others is the anchor and the
+    others are moved into its coordinates. A moved keypoint within
+    DEDUP_RADIUS of a fused one with a similar descriptor counts as another
+    sighting of it instead of being added. Keypoints seen in the most
+    impressions, then the strongest, are kept up to max_features.
+
+    Returns (template, merged) where merged lists the indices of the
+    impressions that went into it, the anchor (whose coordinates the template
+    is in) first; impressions that could not be aligned are left out. Raises FusionError if no template has descriptors.
+    """
+    usable = [i for i, template in enumerate(templates) if template.descriptors is not None and len(template.keypoints)]
+    if not usable:
+        raise FusionError("None of the impressions has any features.")
+    alignments = {}
+    for i, j in itertools.permutations(usable, 2):
+        if (j, i) not in alignments:
+            alignments[i, j] = align(templates[i], templates[j], min_inliers)
+    def alignment(i, j):
+        """Transform from impression i to impression j, or None."""
+        if (i, j) in alignments:
+            return alignments[i, j] and alignments[i, j][0]
+        reverse = alignments.get((j, i))
+        return None if reverse is None else cv2.invertAffineTransform(reverse[0])
+    def inliers(i, j):
+        found = alignments.get((i, j)) or alignments.get((j, i))
+        return 0 if found is None else found[1]
+    anchor = max(usable, key=lambda i: (sum(inliers(i, j) for j in usable if j != i), len(templates[i].keypoints)))
+
+    keypoints = templates[anchor].keypoints
+    descriptors = templates[anchor].descriptors
+    support = np.ones(len(keypoints), np.int32)
+    corners = [_transform_roi(templates[anchor].roi, np.eye(2, 3))] if templates[anchor].roi else []
+    merged = [anchor]
+    for i in usable:
+        M = None if i == anchor else alignment(i, anchor)
+        if M is None:
+            continue
+        moved = transform_keypoints(templates[i].keypoints, M)
+        distances = np.linalg.norm(moved[:, None, :2] - keypoints[None, :, :2], axis=2)
+        nearest = distances.argmin(axis=1)
+        close = distances[np.arange(len(moved)), nearest] <= DEDUP_RADIUS
+        similar = hamming_distances(templates[i].descriptors, descriptors[nearest]) <= DEDUP_HAMMING
+        duplicate = close & similar
+        np.add.at(support, nearest[duplicate], 1)
+        keypoints = np.concatenate([keypoints, moved[~duplicate]])
+        descriptors = np.concatenate([descriptors, templates[i].descriptors[~duplicate]])
+        support = np.concatenate([support, np.ones(int((~duplicate).sum()), np.int32)])
+        if templates[i].roi:
+            corners.append(_transform_roi(templates[i].roi, M))
+        merged.append(i)
+
+    order = np.lexsort((-keypoints[:, 4], -support))[:max_features]
+    roi = None
+    if corners:
+        x, y, width, height = cv2.boundingRect(np.concatenate(corners).astype(np.float32))
+        roi = (max(x, 0), max(y, 0), width, height)
+    return Template(keypoints[order], descriptors[order], roi), merged
+
+def fuse_images(images, template_store=None, max_features=MAX_FUSED_FEATURES):
+    """Extract and fuse the templates of several grayscale impressions. Returns (template, merged indices)."""
+    template_store = template_store or TemplateStore()
+    return fuse_templates([template_store.extract(image) for image in images], max_features)
+
+def evaluate_fusion(directory_path, template_store=None, cascade=None):
+    """Leave-one-out comparison of fused against per-impression galleries on a folder of labelled images.
+
+    For every finger with at least three impressions (see
+    fingerprint_engines.finger_label), each impression in turn is the probe
+    and the others form the gallery, either as separate templates or fused
+    into one. Both galleries are also checked against the probes of the
+    other fingers. Impressions that share no area with the rest cannot be
+    fused; enrollment captures them again, so they are reported apart.
+    """
+    from match_cascade import MatchCascade
+    from fingerprint_engines import finger_label
+    template_store = template_store or TemplateStore()
+    cascade = cascade or MatchCascade()
+    fingers = {}
+    for image_file in sorted(os.listdir(directory_path)):
+        if finger_label(image_file):
+            fingers.setdefault(finger_label(image_file), []).append(
+                template_store.get(os.path.join(directory_path, image_file)))
+
+    separate = {"accepted": 0, "false": 0, "comparisons": 0}
+    aligned = {"accepted": 0, "false": 0, "comparisons": 0}
+    fused = {"accepted": 0, "false": 0, "comparisons": 0}
+    probes = partial = 0
+    for label, templates in fingers.items():
+        if len(templates) < 3:
+            continue
+        for held_out, probe in enumerate(templates):
+            gallery = templates[:held_out] + templates[held_out + 1:]
+            template, merged = fuse_templates(gallery)
+            probes += 1
+            partial += len(merged) < len(gallery)
+            kept = [gallery[i] for i in merged]
+            separate["accepted"] += any(cascade.verify(probe, t).match for t in gallery)
+            aligned["accepted"] += any(cascade.verify(probe, t).match for t in kept)
+            fused["accepted"] += cascade.verify(probe, template).match
+            separate["comparisons"] += len(gallery)
+            aligned["comparisons"] += len(kept)
+            fused["comparisons"] += 1
+            for other, impostors in fingers.items():
+                if other == label:
+                    continue
+                for impostor in impostors:
+                    separate["false"] += any(cascade.verify(impostor, t).match for t in gallery)
+                    aligned["false"] += any(cascade.verify(impostor, t).match for t in kept)
+                    fused["false"] += cascade.verify(impostor, template).match
+            print(f"{label} without impression {held_out + 1}: merged {len(merged)} of {len(gallery)}, "
+                  f"{len(template.keypoints)} keypoints")
+    # aligned: the impressions that went into the fused template, compared one by one.
+    for name, stats in (("separate", separate), ("aligned", aligned), ("fused", fused)):
+        print(f"{name:>8}: {stats['accepted']}/{probes} probes accepted, {stats['false']} false accepts, "
+              f"{stats['comparisons']} genuine comparisons")
+    print(f"{partial} of {probes} galleries had impressions that could not be aligned")
+    return separate, aligned, fused
+
+if __name__ == "__main__":
+    evaluate_fusion(sys.argv[1] if len(sys.argv) > 1 else "./fingerprints")
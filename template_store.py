@@ -0,0 +1,221 @@
+import os
+import json
+import struct
+import hashlib
+import zipfile
+import threading
+from collections import namedtuple
+import numpy as np
+import cv2
+import instrumentation
+from preprocessing import PREPROCESSING, preprocess, params as preprocessing_params
+
+TEMPLATE_DIR = "template_cache"
+ORB_NFEATURES = 1500
+
+# x, y, size, angle, response, octave, class_id
+KEYPOINT_FIELDS = 7
+DESCRIPTOR_BYTES = 32
+# Layout of Template.to_bytes(): version, keypoint count, descriptor count, roi.
+BYTES_VERSION = 1
+_HEADER = struct.Struct("<BII4i")
+
+_local = threading.local()
+
+def orb_detector(nfeatures=ORB_NFEATURES):
+    """Return this thread's long-lived ORB detector for nfeatures."""
+    detectors = getattr(_local, "detectors", None)
+    if detectors is None:
+        detectors = _local.detectors = {}
+    if nfeatures not in detectors:
+        detectors[nfeatures] = cv2.ORB_create(nfeatures=nfeatures)
+    return detectors[nfeatures]
+
+class Template(namedtuple("Template", ["keypoints", "descriptors", "roi"], defaults=(None,))):
+    """ORB features of one image.
+
+    keypoints is an (N, 7) float32 array in the coordinates of the full
+    image, descriptors (N, 32) uint8 or None, and roi the (x, y, width,
+    height) region the features were taken from, or None for the whole image.
+    """
+    __slots__ = ()
+
+    def cv_keypoints(self):
+        """Rebuild the cv2.KeyPoint list, e.g. for cv2.drawMatches."""
+        return array_to_keypoints(self.keypoints)
+
+    def to_bytes(self):
+        """Pack the template into a BLOB, e.g. for fingerprint_db.py."""
+        descriptors = self.descriptors if self.descriptors is not None else np.empty((0, DESCRIPTOR_BYTES), np.uint8)
+        header = _HEADER.pack(BYTES_VERSION, len(self.keypoints), len(descriptors), *(self.roi or (0, 0, 0, 0)))
+        return header + np.ascontiguousarray(self.keypoints, np.float32).tobytes() + descriptors.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, count, descriptor_count, x, y, width, height = _HEADER.unpack_from(data)
+        if version != BYTES_VERSION:
+            raise ValueError(f"Unsupported template version {version}.")
+        keypoints = np.frombuffer(data, np.float32, count * KEYPOINT_FIELDS, _HEADER.size)
+        keypoints = keypoints.reshape(count, KEYPOINT_FIELDS)
+        descriptors = np.frombuffer(data, np.uint8, descriptor_count * DESCRIPTOR_BYTES,
+                                    _HEADER.size + keypoints.nbytes).reshape(descriptor_count, DESCRIPTOR_BYTES)
+        return cls(keypoints, descriptors if descriptor_count else None, (x, y, width, height) if width else None)
+
+def keypoints_to_array(keypoints):
+    """Pack a sequence of cv2.KeyPoint into an (N, 7) float32 array."""
+    array = np.empty((len(keypoints), KEYPOINT_FIELDS), np.float32)
+    for row, kp in zip(array, keypoints):
+        row[:] = (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+    return array
+
+def array_to_keypoints(array):
+    """Unpack an (N, 7) keypoint array back into cv2.KeyPoint objects."""
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+            for x, y, size, angle, response, octave, class_id in array]
+
+def detect_features(image, nfeatures=ORB_NFEATURES, mode=PREPROCESSING):
+    """Preprocess image and run ORB on the result. Returns (keypoints array, descriptors, roi)."""
+    with instrumentation.span("features.preprocess", mode=mode):
+        processed = preprocess(image, mode)
+    with instrumentation.span("features.detect_and_compute") as span:
+        keypoints, descriptors = orb_detector(nfeatures).detectAndCompute(processed.image, processed.mask)
+        span.set(keypoints=len(keypoints))
+    keypoints = keypoints_to_array(keypoints)
+    x, y, width, height = processed.roi
+    keypoints[:, 0] += x
+    keypoints[:, 1] += y
+    roi = None if mode == "none" else processed.roi
+    return keypoints, descriptors, roi
+
+def decode_image(data):
+    """Decode encoded image bytes to grayscale the same way load_image does."""
+    with instrumentation.span("image.decode", bytes=len(data)):
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image data.")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def encode_image(image, ext=".png"):
+    """Encode an image in memory, e.g. for uploading without a temporary file."""
+    with instrumentation.span("image.encode", ext=ext):
+        ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}.")
+    return buffer.tobytes()
+
+def temp_path(path):
+    """Name for writing path atomically, unique per process and thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def params_key(params):
+    """Short stable hash of extractor parameters, used in cache file names."""
+    encoded = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+class TemplateStore:
+    """On-disk cache of ORB templates keyed by image content hash and extractor parameters.
+
+    preprocessing is the preprocessing.py mode applied before extraction;
+    its settings are part of the cache key.
+    """
+
+    suffix = ".npz"
+    template_class = Template
+
+    def __init__(self, directory=TEMPLATE_DIR, nfeatures=ORB_NFEATURES, preprocessing=PREPROCESSING):
+        self.directory = directory
+        self.nfeatures = nfeatures
+        self.preprocessing = preprocessing
+        self.params = {
+            "detector": "ORB",
+            "nfeatures": nfeatures,
+            "opencv": cv2.__version__,
+            "preprocessing": preprocessing_params(preprocessing),
+        }
+        self.params_key = params_key(self.params)
+
+    def extract(self, image):
+        """Compute a Template for a grayscale image without touching the cache."""
+        return Template(*detect_features(image, self.nfeatures, self.preprocessing))
+
+    def key_for(self, data):
+        """Cache key for encoded image bytes under the current extractor parameters."""
+        return f"{hashlib.sha256(data).hexdigest()}_{self.params_key}"
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, image_path):
+        """Return the template for an image file, extracting and saving it on a cache miss."""
+        return self.add(image_path)[1]
+
+    def add(self, image_path):
+        """Make sure the template of an enrolled image is cached and return (key, template)."""
+        with open(image_path, "rb") as f:
+            return self.add_data(f.read())
+
+    def add_data(self, data, image=None):
+        """Like add() for encoded image bytes; image is their decoded grayscale pixels if already known."""
+        key = self.key_for(data)
+        template = self._read(key)
+        if template is None:
+            template = self.extract(decode_image(data) if image is None else image)
+            self._write(key, template)
+        return key, template
+
+    def add_template(self, data, template):
+        """Cache a template made elsewhere (e.g. fused from several impressions) for encoded image bytes. Returns its key."""
+        key = self.key_for(data)
+        self._write(key, template)
+        return key
+
+    def load(self, key):
+        """Return the cached template stored under key, or None."""
+        return self._read(key)
+
+    def discard(self, content_hash):
+        """Delete the cached template of the image with this sha256, if there is one."""
+        path = self.path_for(f"{content_hash}_{self.params_key}")
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def prune(self):
+        """Delete cached templates produced with different extractor parameters."""
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.suffix) and not filename.endswith(f"_{self.params_key}{self.suffix}"):
+                os.remove(os.path.join(self.directory, filename))
+                removed += 1
+        return removed
+
+    def _read(self, key):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with instrumentation.span("template_cache.read"), np.load(path) as data:
+                keypoints = data["keypoints"]
+                descriptors = data["descriptors"]
+                roi = tuple(int(v) for v in data["roi"]) if "roi" in data else None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # A truncated or corrupt file is treated as a miss and extracted again.
+            return None
+        return Template(keypoints, descriptors if len(descriptors) else None, roi)
+
+    def _write(self, key, template):
+        os.makedirs(self.directory, exist_ok=True)
+        descriptors = template.descriptors
+        if descriptors is None:
+            descriptors = np.empty((0, DESCRIPTOR_BYTES), np.uint8)
+        path = self.path_for(key)
+        tmp_path = temp_path(path)
+        with open(tmp_path, "wb") as f:
+            arrays = {"keypoints": template.keypoints, "descriptors": descriptors}
+            if template.roi is not None:
+                arrays["roi"] = np.array(template.roi, np.int32)
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
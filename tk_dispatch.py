@@ -0,0 +1,31 @@
+import queue
+
+DISPATCH_MS = 50
+
+class TkDispatcher:
+    """Queue of callbacks posted by worker threads and run on the Tk thread.
+
+    Workers call _post(callback, arg); attach() drains the queue from the
+    Tk event loop with after(), so every callback runs on the GUI thread.
+    """
+
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def attach(self, widget):
+        """Deliver posted callbacks on widget's Tk event loop."""
+        self.dispatch()
+        widget.after(DISPATCH_MS, self.attach, widget)
+
+    def dispatch(self):
+        """Run the posted callbacks. Call only from the GUI thread."""
+        while True:
+            try:
+                callback, arg = self._events.get_nowait()
+            except queue.Empty:
+                return
+            callback(arg)
+
+    def _post(self, callback, arg):
+        if callback is not None:
+            self._events.put((callback, arg))
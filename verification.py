@@ -0,0 +1,121 @@
+import os
+import time
+import queue
+import threading
+from collections import namedtuple
+import numpy as np
+import cv2
+import instrumentation
+from template_store import array_to_keypoints
+from matcher_engines import get_engine
+from geometry import GEOMETRY_MODEL, ORIENTATION_FILTER, orientation_filter, estimate_transform
+
+MATCH_RENDER_DIR = "match_renders"
+
+VerificationResult = namedtuple("VerificationResult", ["match", "inliers", "matches", "inlier_mask", "timings"])
+VerificationResult.__doc__ = """Outcome of comparing two templates.
+
+match is the decision, inliers the RANSAC inlier count, matches the ratio-test
+survivors (cv2.DMatch), inlier_mask one 0/1 entry per match or None, and
+timings maps stage name to seconds.
+"""
+
+def match_descriptors(descriptors1, descriptors2, engine=None):
+    """Match descriptors with a ratio test on the configured matcher backend."""
+    return (engine or get_engine()).match(descriptors1, descriptors2)
+
+def verify_templates(template1, template2, min_match_count=10, engine=None, model=None, orientation=None):
+    """Decide whether two templates come from the same finger. Never draws.
+
+    model is the geometry.py transform fitted to the matches (default
+    FINGERPRINT_GEOMETRY) and orientation whether matches disagreeing with
+    the dominant keypoint rotation are dropped first (default
+    FINGERPRINT_ORIENTATION_FILTER).
+    """
+    model = model or GEOMETRY_MODEL
+    orientation = ORIENTATION_FILTER if orientation is None else orientation
+    timings = {}
+    if template1.descriptors is None or template2.descriptors is None:
+        return VerificationResult(False, 0, [], None, timings)
+
+    start = time.perf_counter()
+    matches = match_descriptors(template1.descriptors, template2.descriptors, engine)
+    timings["match"] = time.perf_counter() - start
+    instrumentation.record("verify.match_descriptors", start, timings["match"], matches=len(matches))
+    if len(matches) <= min_match_count:
+        return VerificationResult(False, 0, matches, None, timings)
+
+    query_idx = np.fromiter((m.queryIdx for m in matches), np.intp, len(matches))
+    train_idx = np.fromiter((m.trainIdx for m in matches), np.intp, len(matches))
+    candidates = np.arange(len(matches))
+    if orientation:
+        start = time.perf_counter()
+        consistent = orientation_filter(template1.keypoints[query_idx, 3], template2.keypoints[train_idx, 3])
+        candidates = candidates[consistent]
+        timings["orientation"] = time.perf_counter() - start
+        instrumentation.record("verify.orientation", start, timings["orientation"], kept=len(candidates))
+        if len(candidates) <= min_match_count:
+            return VerificationResult(False, 0, matches, None, timings)
+
+    start = time.perf_counter()
+    src_pts = template1.keypoints[query_idx[candidates], :2]
+    dst_pts = template2.keypoints[train_idx[candidates], :2]
+    M, inliers = estimate_transform(src_pts, dst_pts, model)
+    timings["ransac"] = time.perf_counter() - start
+    instrumentation.record("verify.ransac", start, timings["ransac"], model=model, inliers=int(inliers.sum()))
+    if M is None:
+        return VerificationResult(False, 0, matches, None, timings)
+
+    mask = np.zeros(len(matches), np.uint8)
+    mask[candidates[inliers]] = 1
+    count = int(inliers.sum())
+    return VerificationResult(count > min_match_count, count, matches, mask, timings)
+
+class MatchVisualizer:
+    """Opt-in sink that renders verification results to image files on a background thread.
+
+    submit() only queues the work and never blocks; when the queue is full
+    the render is dropped so the match path is never slowed down.
+    """
+
+    def __init__(self, directory=MATCH_RENDER_DIR, max_pending=16):
+        self.directory = directory
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name="match-visualizer", daemon=True)
+        self._thread.start()
+
+    def submit(self, name, image1, template1, image2, template2, result):
+        """Queue a render of result. Images may be grayscale arrays or file paths."""
+        try:
+            self._queue.put_nowait((name, image1, template1, image2, template2, result))
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        """Finish the queued renders and stop the worker."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._render(*item)
+            except Exception as e:
+                print(f"Error rendering match {item[0]}: {e}")
+
+    def _render(self, name, image1, template1, image2, template2, result):
+        if isinstance(image1, str):
+            image1 = cv2.imread(image1)
+        if isinstance(image2, str):
+            image2 = cv2.imread(image2)
+        mask = None if result.inlier_mask is None else result.inlier_mask.tolist()
+        flags = cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS if mask is not None else cv2.DrawMatchesFlags_DEFAULT
+        out = cv2.drawMatches(image1, array_to_keypoints(template1.keypoints),
+                              image2, array_to_keypoints(template2.keypoints),
+                              result.matches, None, matchesMask=mask, flags=flags)
+        os.makedirs(self.directory, exist_ok=True)
+        cv2.imwrite(os.path.join(self.directory, f"{name}.png"), out)